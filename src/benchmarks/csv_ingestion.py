@@ -0,0 +1,88 @@
+#!/usr/local/bin/python3
+
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+
+import src.exchanges.binance as binance
+import src.exchanges.coinbase as coinbase
+import src.exchanges.kraken as kraken
+
+
+# Synthetic statements in each exchange's export format. Binance rows only use
+# USD pairs with fees in the traded coin so no prices have to be fetched.
+def write_coinbase_csv(filename, num_rows, seed=0):
+    rng = random.Random(seed)
+    start = datetime.datetime(2020, 1, 1)
+    with open(filename, 'w') as f:
+        f.write(','.join(coinbase.COINBASE_TRADES_CSV_FIELDS) + '\n')
+        for i in range(num_rows):
+            date = start + datetime.timedelta(seconds=i * 13, milliseconds=rng.randrange(1000))
+            size = rng.uniform(0.01, 10)
+            price = rng.uniform(100, 1000)
+            f.write('default,{},ETH-USD,{},{}Z,{:.8f},ETH,{:.2f},{:.8f},{:.8f},USD\n'.format(
+                i, rng.choice(['BUY', 'SELL']), date.isoformat(timespec='milliseconds'), size, price,
+                size * price * 0.005, -size * price))
+
+
+def write_kraken_csv(filename, num_rows, seed=0):
+    rng = random.Random(seed)
+    start = datetime.datetime(2020, 1, 1)
+    with open(filename, 'w') as f:
+        f.write(','.join(kraken.KRAKEN_TRADES_CSV_FIELDS) + '\n')
+        for i in range(num_rows):
+            date = start + datetime.timedelta(seconds=i * 13, microseconds=rng.randrange(10000) * 100)
+            size = rng.uniform(0.01, 10)
+            price = rng.uniform(100, 1000)
+            f.write('T{0},O{0},{1},{2},{3},limit,{4:.5f},{5:.5f},{6:.5f},{7:.8f},0.00000000,,L{0}\n'.format(
+                i, rng.choice(['XXBTZUSD', 'XETHZUSD', 'DOTUSD']), date.isoformat(' ', timespec='microseconds')[:-2],
+                rng.choice(['buy', 'sell']), price, size * price, size * price * 0.0026, size))
+
+
+def write_binance_csv(filename, num_rows, seed=0):
+    rng = random.Random(seed)
+    start = datetime.datetime(2020, 1, 1)
+    with open(filename, 'w') as f:
+        f.write(','.join(binance.BINANCE_TRADES_CSV_FIELDS) + '\n')
+        for i in range(num_rows):
+            date = start + datetime.timedelta(seconds=i * 13)
+            coin = rng.choice(['BTC', 'ETH', 'BNB', '1INCH'])
+            size = rng.uniform(0.01, 10)
+            price = rng.uniform(100, 1000)
+            side = rng.choice(['BUY', 'SELL'])
+            fee = '{:.8f}{}'.format(size * 0.001, coin) if side == 'BUY' else '{:.8f}USDT'.format(size * price * 0.001)
+            f.write('{}/{}/{} {}:{:02d},{}USDT,{},{:.2f},"{:,.4f}{}","{:,.4f}USDT",{}\n'.format(
+                date.month, date.day, date.year, date.hour, date.minute, coin, side,
+                price, size, coin, size * price, fee))
+
+
+LOADERS = [
+    ('coinbase', write_coinbase_csv, coinbase.get_standard_trades),
+    ('kraken', write_kraken_csv, kraken.get_standard_trades),
+    ('binance', write_binance_csv, binance.get_standard_trades),
+]
+
+
+# Returns {exchange: rows per second}
+def run(num_rows):
+    results = {}
+    with tempfile.TemporaryDirectory() as csv_dir:
+        for exchange, write_csv, get_standard_trades in LOADERS:
+            filename = os.path.join(csv_dir, '{}_trades.csv'.format(exchange))
+            write_csv(filename, num_rows)
+            start = time.perf_counter()
+            rows = get_standard_trades(filename)
+            elapsed = time.perf_counter() - start
+            assert len(rows) >= num_rows * 0.9
+            results[exchange] = num_rows / elapsed
+    return results
+
+
+if __name__ == '__main__':
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    print('exchange,rows,rows/second')
+    for exchange, rows_per_second in run(num_rows).items():
+        print('{},{},{:.0f}'.format(exchange, num_rows, rows_per_second))
@@ -0,0 +1,381 @@
+#!/usr/local/bin/python3
+
+import argparse
+import datetime
+import heapq
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import urllib.parse
+
+from unittest import mock
+
+import src.benchmarks.csv_ingestion as csv_ingestion
+import src.cli as cli
+import src.exchanges.binance as binance
+import src.exchanges.fixed_point as fixed_point
+import src.exchanges.http_archive as http_archive
+import src.exchanges.incremental as incremental
+import src.exchanges.ohlc_store as ohlc_store
+import src.exchanges.price_cache as price_cache
+import src.exchanges.price_service as price_service
+import src.exchanges.utils as utils
+
+from src.exchanges.audit import AuditSink
+from src.exchanges.lot_book import LotBook
+
+
+# Times the cost basis engine, the CSV loaders and the price lookups over
+# synthetic data, writes the results as JSON and flags the cases that got
+# slower than the baseline committed next to this file (for DEFAULT_SIZES; a
+# missing baseline is an error). Its timings are only comparable on the
+# machine that recorded them: regenerate it there before relying on the check.
+# e.g.
+#   PYTHONPATH=. python src/benchmarks/suite.py --save-baseline
+#   PYTHONPATH=. python src/benchmarks/suite.py
+# The cases hold their generated trades in memory, except trade_stream, which
+# generates them lazily, so only the lots still open take memory; a short
+# holding period keeps 10M trades under 100 MB:
+#   PYTHONPATH=. python src/benchmarks/suite.py --sizes 10000000 --cases trade_stream --baseline none --holding-days 1,30
+# Real statements can be benchmarked offline from an HTTP archive recorded
+# over a cold price cache (see run_replayed).
+RESULTS_FILE = 'benchmark_results.json'
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+DEFAULT_SIZES = [1000, 10000, 100000]
+REGRESSION_THRESHOLD = 0.25  # flag cases more than 25% slower than the baseline
+REGRESSION_SLACK = 0.05  # and more than 50ms slower, so millisecond cases don't flag on noise
+DEFAULT_REPEAT = 3  # cases report their best of 3 runs
+ASSETS = ['BTC', 'ETH', 'BNB', 'KNC', 'LINK', 'AAVE', 'UNI', 'DOT']
+
+
+# Orders of random assets, each filled fills_per_order times a second apart.
+# Sells are dated holding_days (a (min, max) range) after a random moment, so
+# they find lots to match. Returns num_trades standard rows sorted by date.
+def generate_trades(num_trades, assets=ASSETS, fills_per_order=1, buy_ratio=0.5, holding_days=(1, 730), seed=0):
+    rng = random.Random(seed)
+    start = datetime.datetime(2018, 1, 1)
+    rows = []
+    while len(rows) < num_trades:
+        asset = rng.choice(assets)
+        is_buy = rng.random() < buy_ratio
+        date = start + datetime.timedelta(seconds=rng.randrange(3 * 365 * price_cache.DAY))
+        if not is_buy:
+            date += datetime.timedelta(days=rng.uniform(*holding_days))
+        price = rng.uniform(1, 1000)
+        for fill in range(min(fills_per_order, num_trades - len(rows))):
+            size = rng.uniform(0.01, 10)
+            rows.append(['BENCHMARK:{}'.format(len(rows)), 'BUY' if is_buy else 'SELL',
+                         date + datetime.timedelta(seconds=fill), size, asset, size * price * 0.001, size * price])
+    rows.sort(key=lambda x: x[2])
+    return rows
+
+
+# Yields num_orders offsets (in seconds) in ascending order, distributed like
+# a uniform [0, span] moment plus a uniform [min_delay, max_delay] delay: the
+# ascending uniforms are drawn one at a time and mapped through the inverse
+# CDF of that sum (a trapezoid), so nothing is held in memory.
+def iter_sorted_offsets(rng, num_orders, span, min_delay=0, max_delay=0):
+    short, long = sorted([span, max_delay - min_delay])
+    u = 0
+    for remaining in range(num_orders, 0, -1):
+        u += (1 - u) * (1 - rng.random() ** (1 / remaining))
+        if u * 2 * long <= short:
+            offset = (2 * span * (max_delay - min_delay) * u) ** 0.5
+        elif (1 - u) * 2 * long <= short:
+            offset = short + long - (2 * span * (max_delay - min_delay) * (1 - u)) ** 0.5
+        else:
+            offset = u * long + short / 2
+        yield min_delay + offset
+
+
+# Same kinds of trades as generate_trades, yielded lazily in date order so
+# memory does not grow with num_trades. Buy and sell orders are drawn apart,
+# each in date order (see iter_sorted_offsets): buys over the same 3 years,
+# sells over the same 3 years plus holding_days, so the dates are distributed
+# as in generate_trades. Fills wait in a heap until no earlier one can come.
+def iter_trades(num_trades, assets=ASSETS, fills_per_order=1, buy_ratio=0.5, holding_days=(1, 730), seed=0):
+    rng = random.Random(seed)
+    start = datetime.datetime(2018, 1, 1)
+    span = 3 * 365 * price_cache.DAY
+    num_orders = -(-num_trades // fills_per_order)
+    num_buy_orders = sum(1 for _ in range(num_orders) if rng.random() < buy_ratio)
+    buy_offsets = iter_sorted_offsets(random.Random('{}:buys'.format(seed)), num_buy_orders, span)
+    sell_offsets = iter_sorted_offsets(random.Random('{}:sells'.format(seed)), num_orders - num_buy_orders, span,
+                                       holding_days[0] * price_cache.DAY, holding_days[1] * price_cache.DAY)
+    orders = heapq.merge(((offset, 'BUY',) for offset in buy_offsets), ((offset, 'SELL',) for offset in sell_offsets))
+    pending = []
+    emitted = 0
+    for order, (offset, action) in enumerate(orders):
+        date = start + datetime.timedelta(seconds=offset)
+        while pending and pending[0][0] <= date and emitted < num_trades:
+            fill_date, _, row = heapq.heappop(pending)
+            yield ['BENCHMARK:{}'.format(emitted), row[0], fill_date] + row[1:]
+            emitted += 1
+        asset = rng.choice(assets)
+        price = rng.uniform(1, 1000)
+        for fill in range(fills_per_order):
+            size = rng.uniform(0.01, 10)
+            heapq.heappush(pending, (date + datetime.timedelta(seconds=fill), (order, fill,),
+                                     [action, size, asset, size * price * 0.001, size * price],))
+    while pending and emitted < num_trades:
+        fill_date, _, row = heapq.heappop(pending)
+        yield ['BENCHMARK:{}'.format(emitted), row[0], fill_date] + row[1:]
+        emitted += 1
+
+
+def split(rows):
+    return [row for row in rows if row[1] == 'BUY'], [row for row in rows if row[1] != 'BUY']
+
+
+def bench_process_buys(num_trades, config):
+    buys, _ = split(generate_trades(num_trades, **config))
+    start = time.perf_counter()
+    utils.process_buys(buys)
+    return time.perf_counter() - start
+
+
+def bench_process_sells(num_trades, config):
+    buys, sells = split(generate_trades(num_trades, **config))
+    basis_dict, _ = utils.process_buys(buys)
+    start = time.perf_counter()
+    utils.process_sells(sells, basis_dict, audit=AuditSink())
+    return time.perf_counter() - start
+
+
+def bench_calculate_obligation_after_sale(num_trades, config):
+    buys, sells = split(generate_trades(num_trades, **config))
+    basis_dict, _ = utils.process_buys(buys)
+    lot_books = {asset: LotBook(lots) for asset, lots in basis_dict.items()}
+    start = time.perf_counter()
+    for trade_id, action, date, size, asset, fee, net_fiat in sells:
+        if asset in lot_books:
+            utils.calculate_obligation_after_sale(lot_books[asset], 'hifo', size, net_fiat, date, trade_id)
+    return time.perf_counter() - start
+
+
+def bench_loader(write_csv, get_standard_trades):
+    def bench(num_trades, config):
+        with tempfile.TemporaryDirectory() as csv_dir:
+            filename = os.path.join(csv_dir, 'trades.csv')
+            write_csv(filename, num_trades)
+            start = time.perf_counter()
+            get_standard_trades(filename)
+            return time.perf_counter() - start
+    return bench
+
+
+# Serves any klines range from memory, one candle per minute
+def get_fake_klines(url, headers):
+    query = urllib.parse.parse_qs(urllib.parse.urlsplit(url).query)
+    start = int(query['startTime'][0]) // 60000 * 60000
+    end = int(query['endTime'][0])
+    limit = int(query.get('limit', ['1'])[0])
+    candles = []
+    for open_time in range(start, end + 1, 60000)[:limit]:
+        price = str(1 + open_time % 997)
+        candles.append([open_time, price, price, price, price, '0', open_time + 59999, '0', 0, '0', '0', '0'])
+    return candles
+
+
+# num_trades lookups of 1m prices (about one trade every 10 minutes), prefetched
+# then read, against mocked HTTP and an empty in-memory price cache
+def bench_price_lookups(num_trades, config):
+    rng = random.Random(config.get('seed', 0))
+    start_date = datetime.datetime(2020, 1, 1)
+    lookups = [(rng.choice(config.get('assets', ASSETS)),
+                start_date + datetime.timedelta(minutes=rng.randrange(num_trades * 10)), rng.random() < 0.5,)
+               for _ in range(num_trades)]
+    with mock.patch('src.exchanges.price_cache.PRICE_CACHE', price_cache.PriceCache(':memory:')), \
+            mock.patch('src.exchanges.utils.get_request_with_retry', get_fake_klines), \
+            mock.patch('src.exchanges.price_service.PRICE_SERVICE', price_service.PriceService()):
+        start = time.perf_counter()
+        binance.prefetch_historical_prices(lookups)
+        for symbol, date, use_max in lookups:
+            binance.get_historical_price(symbol, date, use_max)
+        return time.perf_counter() - start
+
+
+# The whole date-ordered matching of process_trade_stream, in floats, or in
+# the fixed point / decimal.Decimal backends of src/exchanges/fixed_point.py
+def bench_numeric(process_trades):
+    def bench(num_trades, config):
+        rows = generate_trades(num_trades, **config)
+        with mock.patch('builtins.print'):
+            start = time.perf_counter()
+            process_trades(rows)
+            return time.perf_counter() - start
+    return bench
+
+
+# process_trade_stream over iter_trades, never holding the whole history
+def bench_trade_stream(num_trades, config):
+    trades = iter_trades(num_trades, **config)
+    with mock.patch('builtins.print'):
+        start = time.perf_counter()
+        utils.process_trade_stream(trades)
+        return time.perf_counter() - start
+
+
+# A daily re-import: the full history of num_trades trades, 10 of them new and
+# dated after the rest, through an incremental ledger saved by the previous run
+def bench_incremental_append(num_trades, config):
+    rows = generate_trades(num_trades, **config)
+    with tempfile.TemporaryDirectory() as state_dir:
+        state_file = os.path.join(state_dir, 'incremental.sqlite3')
+        ledger = incremental.IncrementalLedger.load(state_file)
+        ledger.update(rows[:-10])
+        ledger.save()
+        ledger.close()
+        start = time.perf_counter()
+        ledger = incremental.IncrementalLedger.load(state_file)
+        ledger.update(rows)
+        ledger.save()
+        seconds = time.perf_counter() - start
+        ledger.close()
+        return seconds
+
+
+BENCHMARKS = {
+    'process_buys': bench_process_buys,
+    'process_sells': bench_process_sells,
+    'calculate_obligation_after_sale': bench_calculate_obligation_after_sale,
+    'coinbase_loader': bench_loader(csv_ingestion.write_coinbase_csv, csv_ingestion.coinbase.get_standard_trades),
+    'kraken_loader': bench_loader(csv_ingestion.write_kraken_csv, csv_ingestion.kraken.get_standard_trades),
+    'binance_loader': bench_loader(csv_ingestion.write_binance_csv, binance.get_standard_trades),
+    'price_lookups': bench_price_lookups,
+    'numeric_float': bench_numeric(utils.process_trade_stream),
+    'numeric_fixed_point': bench_numeric(fixed_point.process_trades_fixed_point),
+    'numeric_decimal': bench_numeric(lambda rows: fixed_point.process_trades_fixed_point(rows, numbers=fixed_point.DECIMAL)),
+    'trade_stream': bench_trade_stream,
+    'incremental_append': bench_incremental_append,
+}
+
+
+# Returns {case: {size: {'seconds', 'trades_per_second'}}}, keeping the best of `repeat` runs
+def run(sizes=DEFAULT_SIZES, cases=tuple(BENCHMARKS), config=None, repeat=DEFAULT_REPEAT):
+    config = config or {}
+    results = {}
+    for case in cases:
+        results[case] = {}
+        for num_trades in sizes:
+            seconds = min(BENCHMARKS[case](num_trades, config) for _ in range(repeat))
+            results[case][str(num_trades)] = {
+                'seconds': seconds,
+                'trades_per_second': num_trades / seconds if seconds else None,
+            }
+            print('{},{},{:.4f}'.format(case, num_trades, seconds))
+    return results
+
+
+# Loads each (kind, argument) source as ./tax-calculator does, with every API
+# request answered by the archive in replay mode over an empty price cache
+# and OHLC store, so all the price lookups go through recorded responses.
+# Record the archive from a cold cache for the replay to find every request:
+#   TAX_CALCULATOR_CACHE_DIR=$(mktemp -d) ./tax-calculator binance:binance_trades.csv --record-http recordings
+# Returns results like run(), as 'replay <source>' cases sized by the trades loaded.
+def run_replayed(archive_dir, sources, repeat=DEFAULT_REPEAT):
+    results = {}
+    archive = http_archive.HttpArchive(archive_dir, 'replay')
+    try:
+        for kind, argument in sources:
+            timings = []
+            for _ in range(repeat):
+                with tempfile.TemporaryDirectory() as store_dir, \
+                        mock.patch('src.exchanges.http_archive.ARCHIVE', archive), \
+                        mock.patch('src.exchanges.price_cache.PRICE_CACHE', price_cache.PriceCache(':memory:')), \
+                        mock.patch('src.exchanges.price_service.PRICE_SERVICE', price_service.PriceService()), \
+                        mock.patch('src.exchanges.ohlc_store.OHLC_STORE', ohlc_store.OhlcStore(store_dir)):
+                    trades, transfers, _, seconds = cli.load_source(kind, argument)
+                timings.append(seconds)
+            case = 'replay {}'.format(cli.get_source_name(kind, argument))
+            num_trades = len(trades) + len(transfers)
+            seconds = min(timings)
+            results[case] = {str(num_trades): {
+                'seconds': seconds,
+                'trades_per_second': num_trades / seconds if seconds else None,
+            }}
+            print('{},{},{:.4f}'.format(case, num_trades, seconds))
+    finally:
+        archive.close()
+    return results
+
+
+# Returns [(case, size, baseline seconds, seconds)] for every case slower than
+# the baseline by more than the threshold (relative) and the slack (seconds)
+def find_regressions(results, baseline, threshold=REGRESSION_THRESHOLD, slack=REGRESSION_SLACK):
+    regressions = []
+    for case, sizes in results.items():
+        for size, result in sizes.items():
+            baseline_result = baseline.get(case, {}).get(size)
+            if baseline_result and result['seconds'] > max(baseline_result['seconds'] * (1 + threshold),
+                                                           baseline_result['seconds'] + slack):
+                regressions.append((case, size, baseline_result['seconds'], result['seconds'],))
+    return regressions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmark the cost basis engine, loaders and price lookups.')
+    parser.add_argument('--sizes', default=','.join(str(size) for size in DEFAULT_SIZES),
+                        help='comma separated trade counts, e.g. 1000,10000000')
+    parser.add_argument('--cases', default=','.join(BENCHMARKS), help='comma separated benchmarks to run')
+    parser.add_argument('--assets', type=int, default=len(ASSETS), help='number of synthetic assets')
+    parser.add_argument('--fills-per-order', type=int, default=1)
+    parser.add_argument('--buy-ratio', type=float, default=0.5)
+    parser.add_argument('--holding-days', default='1,730', help='min,max days a lot is held before a sale')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='keep the best of this many runs')
+    parser.add_argument('--output', default=RESULTS_FILE)
+    parser.add_argument('--baseline', default=BASELINE_FILE, help="baseline to compare with, or 'none' to skip the check")
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the baseline')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    parser.add_argument('--slack', type=float, default=REGRESSION_SLACK,
+                        help='seconds a case may lose on the baseline before it is flagged')
+    parser.add_argument('--http-archive', metavar='DIR',
+                        help='replay API responses recorded with ./tax-calculator --record-http DIR')
+    parser.add_argument('--replay-sources', nargs='+', type=cli.parse_source, default=[], metavar='KIND:FILE',
+                        help='sources to load through the --http-archive, as given to ./tax-calculator')
+    args = parser.parse_args(argv)
+    if bool(args.http_archive) != bool(args.replay_sources):
+        parser.error('--http-archive and --replay-sources go together')
+
+    assets = ASSETS[:args.assets] + ['ASSET{}'.format(i) for i in range(len(ASSETS), args.assets)]
+    config = {
+        'assets': assets,
+        'fills_per_order': args.fills_per_order,
+        'buy_ratio': args.buy_ratio,
+        'holding_days': tuple(float(days) for days in args.holding_days.split(',')),
+    }
+    print('case,trades,seconds')
+    results = run([int(size) for size in args.sizes.split(',')], args.cases.split(','), config, args.repeat)
+    if args.http_archive:
+        results.update(run_replayed(args.http_archive, args.replay_sources, args.repeat))
+    report = {
+        'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'config': dict(config, assets=len(assets)),
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        return 0
+    if args.baseline == 'none':
+        return 0
+    if not os.path.exists(args.baseline):
+        print('No baseline at {}, run with --save-baseline to store one'.format(args.baseline))
+        return 2
+    with open(args.baseline) as f:
+        baseline = json.load(f)['results']
+    regressions = find_regressions(results, baseline, args.threshold, args.slack)
+    for case, size, baseline_seconds, seconds in regressions:
+        print('REGRESSION {} at {} trades: {:.4f}s -> {:.4f}s'.format(case, size, baseline_seconds, seconds))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
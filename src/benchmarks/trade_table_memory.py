@@ -0,0 +1,46 @@
+#!/usr/local/bin/python3
+
+import datetime
+import random
+import sys
+import tracemalloc
+
+from src.exchanges.trade_table import TradeTable
+
+
+def generate_rows(num_rows, seed=0):
+    rng = random.Random(seed)
+    assets = ['BTC', 'ETH', 'BNB', 'KNC', 'LINK', 'AAVE', 'UNI', 'DOT']
+    start = datetime.datetime(2020, 1, 1)
+    rows = []
+    for i in range(num_rows):
+        rows.append([
+            'BINANCE:{}'.format(i),
+            'BUY' if rng.random() < 0.5 else 'SELL',
+            start + datetime.timedelta(seconds=i * 37, microseconds=rng.randrange(1000000)),
+            rng.uniform(0.001, 100),
+            rng.choice(assets),
+            rng.uniform(0, 5),
+            rng.uniform(1, 100000),
+        ])
+    return rows
+
+
+# Returns (result, bytes allocated by build() that are still alive)
+def measure(build):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, after - before
+
+
+if __name__ == '__main__':
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    rows, list_bytes = measure(lambda: generate_rows(num_rows))
+    table, table_bytes = measure(lambda: TradeTable.from_rows(rows))
+    assert list(table) == rows
+    print('rows,list bytes/trade,table bytes/trade,ratio')
+    print('{},{:.1f},{:.1f},{:.1f}x'.format(
+        num_rows, list_bytes / num_rows, table_bytes / num_rows, list_bytes / table_bytes))
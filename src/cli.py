@@ -0,0 +1,130 @@
+#!/usr/local/bin/python3
+
+import time
+
+STARTED = time.perf_counter()
+
+import argparse
+import concurrent.futures
+import importlib
+import sys
+
+
+# Loads every given source in one process and runs them through a single
+# process_trades. Sources are <kind>:<csv file or address>, e.g.
+#   ./tax-calculator coinbase:coinbase_trades.csv binance:binance_trades.csv etherscan:0xabc...
+# Each kind's module is only imported once a source of that kind is given,
+# and sources load concurrently, sharing the price cache and HTTP sessions.
+SOURCES = {
+    'coinbase': 'src.exchanges.coinbase',
+    'kraken': 'src.exchanges.kraken',
+    'binance': 'src.exchanges.binance',
+    'etherscan': 'src.wallets.etherscan',
+}
+STRATEGIES = ['fifo', 'lifo', 'hifo', 'lofo']
+
+
+def parse_source(source):
+    kind, _, argument = source.partition(':')
+    if kind not in SOURCES:
+        raise argparse.ArgumentTypeError('unknown source {} (expected one of {})'.format(kind, ', '.join(SOURCES)))
+    if kind == 'etherscan' and not argument:
+        raise argparse.ArgumentTypeError('etherscan sources need an address, e.g. etherscan:0xabc...')
+    return kind, argument
+
+
+def get_source_name(kind, argument):
+    return '{}:{}'.format(kind, argument) if argument else kind
+
+
+# Returns (date sorted trades, transfers, seconds spent importing, seconds spent loading)
+def load_source(kind, argument):
+    start = time.perf_counter()
+    module = importlib.import_module(SOURCES[kind])
+    imported = time.perf_counter()
+    transfers = []
+    if kind == 'etherscan':
+        trades, deposits, withdrawals = module.get_standard_trades_deposits_withdrawals(argument)
+        transfers = deposits + withdrawals
+    elif argument:
+        trades = module.get_standard_trades(argument)
+    else:
+        trades = module.get_standard_trades()
+    return trades, transfers, imported - start, time.perf_counter() - imported
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='tax-calculator', description='Compute capital gains over all your sources at once.')
+    parser.add_argument('sources', nargs='+', type=parse_source, metavar='KIND:FILE',
+                        help='{} followed by the CSV file (or the address for etherscan)'.format('/'.join(SOURCES)))
+    parser.add_argument('--strategy', default='hifo', choices=STRATEGIES)
+    parser.add_argument('--parallel', action='store_true', help='match assets in a process pool')
+    parser.add_argument('--audit', help='write the lot matches to a .csv, .jsonl or .columnar file')
+    parser.add_argument('--arithmetic', default='float', choices=['float', 'fixed_point', 'decimal'],
+                        help='match lots in floats or exactly, in scaled integers or decimal.Decimal')
+    parser.add_argument('--match-transfers', action='store_true',
+                        help='keep lots per source and move them along withdrawals matched to deposits')
+    parser.add_argument('--coinbase-deposits', metavar='FILE',
+                        help='Coinbase Pro account statement with the deposits and withdrawals of the coinbase source')
+    parser.add_argument('--record-http', metavar='DIR',
+                        help='answer API requests from this archive and add the ones it misses')
+    parser.add_argument('--replay-http', metavar='DIR', help='answer API requests only from this archive (offline)')
+    parser.add_argument('--instrument', action='store_true', help='print per stage timings at the end')
+    parser.add_argument('--profile', help='write a cProfile dump (or sampled stacks if the file ends in .folded)')
+    args = parser.parse_args(argv)
+    if args.coinbase_deposits and not any(kind == 'coinbase' for kind, _ in args.sources):
+        parser.error('--coinbase-deposits needs a coinbase source')
+    if args.match_transfers and (args.parallel or args.arithmetic != 'float'):
+        parser.error('--match-transfers matches lots in floats in one process, without --parallel or --arithmetic')
+    if args.arithmetic != 'float' and args.parallel:
+        parser.error('--arithmetic {} matches lots in one process, without --parallel'.format(args.arithmetic))
+
+    import src.exchanges.instrumentation as instrumentation
+    if args.instrument or args.profile:
+        instrumentation.enable(args.profile)
+    instrumentation.enable_from_environment()
+    if args.record_http or args.replay_http:
+        import src.exchanges.http_archive as http_archive
+        http_archive.enable(args.replay_http or args.record_http, 'replay' if args.replay_http else 'record')
+    import src.exchanges.audit as audit
+    import src.exchanges.price_service as price_service
+    import src.exchanges.utils as utils
+    startup = time.perf_counter() - STARTED
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(args.sources)) as executor:
+        loaded = list(executor.map(lambda source: load_source(*source), args.sources))
+
+    names = [get_source_name(kind, argument) for kind, argument in args.sources]
+    if args.coinbase_deposits:
+        deposits, withdrawals = importlib.import_module(SOURCES['coinbase']).get_deposits_and_withdrawals(
+            args.coinbase_deposits)
+        coinbase_index = [kind for kind, _ in args.sources].index('coinbase')
+        loaded[coinbase_index][1].extend(deposits + withdrawals)
+
+    print('source,trades,import seconds,load seconds')
+    print('startup,,{:.3f},'.format(startup))
+    for name, (trades, _, import_seconds, load_seconds) in zip(names, loaded):
+        print('{},{},{:.3f},{:.3f}'.format(name, len(trades), import_seconds, load_seconds))
+    price_service.PRICE_SERVICE.print_summary()
+
+    sink = audit.open_audit_sink(args.audit) if args.audit else audit.AuditSink()
+    with sink:
+        if args.match_transfers:
+            import src.exchanges.transfers as transfers
+            transfers.process_venue_trades(
+                {name: trades for name, (trades, _, _, _) in zip(names, loaded)},
+                {name: source_transfers for name, (_, source_transfers, _, _) in zip(names, loaded)},
+                args.strategy, audit=sink)
+        elif args.arithmetic != 'float':
+            import src.exchanges.fixed_point as fixed_point
+            fixed_point.process_trades_fixed_point(
+                utils.merge_trade_streams(*[trades for trades, _, _, _ in loaded]), args.strategy,
+                numbers=fixed_point.NUMERIC_BACKENDS[args.arithmetic], audit=sink)
+        else:
+            rows = list(utils.merge_trade_streams(*[trades for trades, _, _, _ in loaded]))
+            utils.process_trades(rows, args.strategy, parallel=args.parallel, audit=sink)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
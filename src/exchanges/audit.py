@@ -0,0 +1,184 @@
+#!/usr/local/bin/python3
+
+import array
+import collections
+import csv
+import datetime
+import json
+import struct
+
+from src.exchanges.lot_book import EPOCH, to_micros
+
+
+# One lot (or part of a lot) used to cover a sale, as produced by
+# utils.calculate_obligation_after_sale
+LotMatch = collections.namedtuple('LotMatch', [
+    'entry_date', 'entry_basis', 'entry_size', 'entry_trade_id',
+    'exit_date', 'exit_basis', 'exit_size', 'exit_trade_id', 'obligation'])
+
+# A LotMatch with the asset and the action (SELL or BURN) of the sale
+AuditRecord = collections.namedtuple('AuditRecord', ('asset', 'action',) + LotMatch._fields)
+AUDIT_FIELDS = list(AuditRecord._fields)
+
+COLUMNAR_MAGIC = b'AUDITCOL1\n'
+COLUMNAR_ROW_GROUP_SIZE = 65536
+# array typecodes of the columnar format, 's' marks a string column
+COLUMN_TYPES = ['s', 's', 'q', 'd', 'd', 's', 'q', 'd', 'd', 's', 'd']
+
+
+class AuditSink(object):
+    # Receives every AuditRecord as the sales are matched and keeps a running
+    # total of the taxable obligations (BURNs aren't), which process_trades
+    # checks its totals against. This base sink keeps nothing else.
+
+    def __init__(self):
+        self.total = 0
+        self.count = 0
+
+    def write(self, record):
+        self.count += 1
+        if record.action != 'BURN':
+            self.total += record.obligation
+        self.emit(record)
+
+    def emit(self, record):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class AuditList(AuditSink):
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class CsvAuditSink(AuditSink):
+
+    def __init__(self, filename):
+        super().__init__()
+        self.file = open(filename, 'w', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(AUDIT_FIELDS)
+
+    def emit(self, record):
+        self.writer.writerow(record)
+
+    def close(self):
+        self.file.close()
+
+
+class JsonlAuditSink(AuditSink):
+
+    def __init__(self, filename):
+        super().__init__()
+        self.file = open(filename, 'w')
+
+    def emit(self, record):
+        self.file.write(json.dumps(record._asdict(), default=datetime.datetime.isoformat))
+        self.file.write('\n')
+
+    def close(self):
+        self.file.close()
+
+
+class ColumnarAuditSink(AuditSink):
+    # Parquet-like layout: records are buffered into row groups of column
+    # arrays (int64 epoch microseconds, float64, length-prefixed UTF-8
+    # strings) and each full group is written out, so memory stays bounded.
+    # Read back with read_columnar_audit.
+
+    def __init__(self, filename, row_group_size=COLUMNAR_ROW_GROUP_SIZE):
+        super().__init__()
+        self.file = open(filename, 'wb')
+        self.file.write(COLUMNAR_MAGIC)
+        self.row_group_size = row_group_size
+        self.new_row_group()
+
+    def new_row_group(self):
+        self.columns = [[] if column_type == 's' else array.array(column_type) for column_type in COLUMN_TYPES]
+        self.num_rows = 0
+
+    def emit(self, record):
+        for column, column_type, value in zip(self.columns, COLUMN_TYPES, record):
+            column.append(to_micros(value) if column_type == 'q' else value)
+        self.num_rows += 1
+        if self.num_rows == self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if not self.num_rows:
+            return
+        self.file.write(struct.pack('<I', self.num_rows))
+        for column, column_type in zip(self.columns, COLUMN_TYPES):
+            if column_type == 's':
+                data = b''.join(struct.pack('<I', len(value)) + value for value in (
+                    str(value).encode() for value in column))
+            else:
+                data = column.tobytes()
+            self.file.write(struct.pack('<Q', len(data)))
+            self.file.write(data)
+        self.new_row_group()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+def decode_strings(data, num_rows):
+    values = []
+    offset = 0
+    for _ in range(num_rows):
+        length, = struct.unpack_from('<I', data, offset)
+        values.append(data[offset + 4:offset + 4 + length].decode())
+        offset += 4 + length
+    return values
+
+
+# Yields the AuditRecords of a file written by ColumnarAuditSink
+def read_columnar_audit(filename):
+    with open(filename, 'rb') as f:
+        assert f.read(len(COLUMNAR_MAGIC)) == COLUMNAR_MAGIC
+        while True:
+            header = f.read(4)
+            if not header:
+                break
+            num_rows, = struct.unpack('<I', header)
+            columns = []
+            for column_type in COLUMN_TYPES:
+                length, = struct.unpack('<Q', f.read(8))
+                data = f.read(length)
+                if column_type == 's':
+                    columns.append(decode_strings(data, num_rows))
+                elif column_type == 'q':
+                    columns.append([EPOCH + datetime.timedelta(microseconds=micros) for micros in array.array('q', data)])
+                else:
+                    columns.append(array.array(column_type, data).tolist())
+            for values in zip(*columns):
+                yield AuditRecord(*values)
+
+
+AUDIT_SINKS = {
+    '.csv': CsvAuditSink,
+    '.jsonl': JsonlAuditSink,
+    '.columnar': ColumnarAuditSink,
+}
+
+
+# Picks the sink from the file extension (.csv, .jsonl or .columnar)
+def open_audit_sink(filename):
+    for extension, sink in AUDIT_SINKS.items():
+        if filename.endswith(extension):
+            return sink(filename)
+    raise ValueError('unsupported audit file: {}'.format(filename))
@@ -1,86 +1,200 @@
 #!/usr/local/bin/python3
 
-import csv
 import datetime
-import re
-import requests
+import functools
+import src.exchanges.instrumentation as instrumentation
+import src.exchanges.ohlc_store as ohlc_store
+import src.exchanges.price_cache as price_cache
+import src.exchanges.price_service as price_service
 import src.exchanges.utils as utils
 
 
 BINANCE_TRADES_FILE = 'binance_trades.csv'
 BINANCE_TRADES_CSV_FIELDS = ['Date(UTC)', 'Pair', 'Side', 'Price', 'Executed', 'Amount', 'Fee']
-BINANCE_COLUMN_PATTERN = r'^([0-9]+\.[0-9]+)(.*)$'
-KLINE_CACHE = {}
+BINANCE_NUMBER_CHARS = '0123456789.'
+BINANCE_KLINES_RANGE_ENDPOINT = 'https://api.binance.com/api/v3/klines?symbol={coin}USDT&interval=1m&startTime={start}&endTime={end}&limit={limit}'
+KLINE_LIMIT = 1000  # max candles per klines call
+STREAM_PREFETCH_ROWS = 10000
 
 
-def get_historical_price(symbol, date, use_max=True):
-    # Kline helps fetch historical data from binance for free
-    if symbol in utils.REBRANDED_TOKENS:
-        print('Using special value for ${} ({})'.format(symbol, date))
-        return -1
-    if (symbol, date, use_max,) in KLINE_CACHE:
-        return KLINE_CACHE[(symbol, date, use_max,)]
-    start = int(date.timestamp()) * 1000
+# Returns the (max, min) of the symbol's 1m candle starting at bucket, from
+# the offline OHLC store, the price cache or else the klines API
+def get_candle_extremes(symbol, bucket):
+    candle = ohlc_store.get_ohlc_store().get_candle(symbol, bucket)
+    if candle is not None:
+        return max(candle), min(candle)
+    cached = price_cache.get_price_cache().get_many([
+        (price_cache.BINANCE_KLINES, symbol, bucket, True,),
+        (price_cache.BINANCE_KLINES, symbol, bucket, False,),
+    ])
+    if len(cached) == 2:
+        return (cached[(price_cache.BINANCE_KLINES, symbol, bucket, True,)],
+                cached[(price_cache.BINANCE_KLINES, symbol, bucket, False,)],)
+    start = bucket * 1000
     end = start + 59999  # milliseconds
     kline_endpoint = 'https://api.binance.com/api/v3/klines?symbol={coin}USDT&interval=1m&startTime={start}&endTime={end}'.format(
         coin=symbol, start=start, end=end
     )
     j = utils.get_request_with_retry(kline_endpoint, {})
     assert len(j) == 1
+    candle_prices = [float(x) for x in j[0][1:5]]
+    max_price = max(candle_prices)
+    min_price = min(candle_prices)
+    # Both extremes come with the candle, so keep both for later lookups
+    price_cache.get_price_cache().put_many([
+        (price_cache.BINANCE_KLINES, symbol, bucket, True, max_price,),
+        (price_cache.BINANCE_KLINES, symbol, bucket, False, min_price,),
+    ])
+    return max_price, min_price
+
+
+def get_historical_price(symbol, date, use_max=True):
+    # Kline helps fetch historical data from binance for free
+    if symbol in utils.REBRANDED_TOKENS:
+        print('Using special value for ${} ({})'.format(symbol, date))
+        return -1
+    bucket = price_service.get_bucket(price_cache.BINANCE_KLINES, int(date.timestamp()))
     # Find the best moment during the 1m candle ;)
-    if use_max:
-        price = float(max(j[0][1:5]))
-    else:
-        price = float(min(j[0][1:5]))
-    KLINE_CACHE[(symbol, date, use_max,)] = price
-    return price
+    # Buys and sells of the same minute, and their fee legs, share one fetch
+    max_price, min_price = price_service.PRICE_SERVICE.get(
+        price_cache.BINANCE_KLINES, symbol, bucket, lambda: get_candle_extremes(symbol, bucket))
+    return max_price if use_max else min_price
 
 
-def prepare_rows_helper(row, trade_id_counter):
-    trade_id = 'BINANCE:{}'.format(trade_id_counter)
+# Splits a number-plus-symbol column such as "1,234.50BTC" into (1234.5, 'BTC')
+def split_amount(column):
+    column = column.strip('"').replace(',', '')
+    symbol = column.lstrip(BINANCE_NUMBER_CHARS)
+    return float(column[:len(column) - len(symbol)]), symbol
+
+
+# Dates only have minute precision, so most rows share a date string with another row
+@functools.lru_cache(maxsize=1 << 16)
+def parse_binance_date(date_string):
+    day, minute = date_string.split(' ')
+    month, day, year = day.split('/')
+    hour, minute = minute.split(':')
+    return datetime.datetime(int(year), int(month), int(day), int(hour), int(minute))
+
+
+# Splits a statement row into (action, date, price, size, asset, ref_asset_total,
+# ref_asset_symbol, fee_asset_total, fee_asset_symbol)
+def parse_row(row):
     action = row[2].upper()
-    date = datetime.datetime.strptime(
-        row[0], "%m/%d/%Y %H:%M")
+    date = parse_binance_date(row[0])
     price = float(row[3].replace(',', ''))
+    size, asset = split_amount(row[4])  # primary coin
+    ref_asset_total, ref_asset_symbol = split_amount(row[5])
+    fee_asset_total, fee_asset_symbol = split_amount(row[6])
+    return action, date, price, size, asset, ref_asset_total, ref_asset_symbol, fee_asset_total, fee_asset_symbol
+
+
+# How a row's reference and fee assets are priced, as (ref price, fee price):
+# each is either a known USD price (1.0 for USD, the trade's price for a fee
+# paid in the traded coin of a USD pair) or a (symbol, date, use_max)
+# get_historical_price lookup. prepare_rows_helper prices rows and
+# get_price_lookups prefetches from this one decision, so they cannot drift.
+def get_row_prices(action, date, price, asset, ref_asset_symbol, fee_asset_symbol):
+    use_max = action == 'BUY'
+    if 'USD' in ref_asset_symbol:
+        ref_price = 1.0
+    else:
+        ref_price = (ref_asset_symbol, date, use_max,)
+    if 'USD' in fee_asset_symbol:
+        fee_price = 1.0
+    elif fee_asset_symbol == asset and 'USD' in ref_asset_symbol:
+        fee_price = price
+    else:
+        fee_price = (fee_asset_symbol, date, use_max,)
+    return ref_price, fee_price
+
 
-    size_matcher = re.search(BINANCE_COLUMN_PATTERN, row[4].strip('"').replace(',', ''))
-    size = float(size_matcher.group(1))
-    asset = size_matcher.group(2)  # primary coin
+# Returns the (symbol, date, use_max) prices prepare_rows_helper will ask
+# get_historical_price for, without fetching anything.
+def get_price_lookups(row):
+    action, date, price, _, asset, _, ref_asset_symbol, _, fee_asset_symbol = parse_row(row)
+    return [lookup for lookup in get_row_prices(action, date, price, asset, ref_asset_symbol, fee_asset_symbol)
+            if isinstance(lookup, tuple)]
+
+
+# Fetches the 1m candles for every lookup up front, KLINE_LIMIT minutes per
+# klines call, so get_historical_price only has to read the price cache.
+# Minutes the offline OHLC store has, and rebranded tokens, are never fetched.
+# Returns the number of klines calls made.
+@instrumentation.timed('binance prefetch_historical_prices')
+def prefetch_historical_prices(lookups):
+    if not lookups:
+        return 0
+    cache = price_cache.get_price_cache()
+    buckets_by_symbol = {}
+    for symbol, date, _ in lookups:
+        if symbol in utils.REBRANDED_TOKENS:
+            continue
+        if symbol not in buckets_by_symbol:
+            buckets_by_symbol[symbol] = set()
+        buckets_by_symbol[symbol].add(int(date.timestamp()))
+
+    num_calls = 0
+    for symbol, buckets in sorted(buckets_by_symbol.items()):
+        buckets = sorted(buckets)
+        cached = cache.get_range(price_cache.BINANCE_KLINES, symbol, buckets[0], buckets[-1])
+        store = ohlc_store.get_ohlc_store()
+        missing = [bucket for bucket in buckets
+                   if ((bucket, True,) not in cached or (bucket, False,) not in cached)
+                   and store.get_candle(symbol, bucket) is None]
+        i = 0
+        while i < len(missing):
+            # Greedily cover as many missing minutes as one call allows
+            start = missing[i]
+            end = start + KLINE_LIMIT * price_cache.MINUTE - 1
+            kline_endpoint = BINANCE_KLINES_RANGE_ENDPOINT.format(
+                coin=symbol, start=start * 1000, end=end * 1000 + 999, limit=KLINE_LIMIT
+            )
+            j = utils.get_request_with_retry(kline_endpoint, {})
+            num_calls += 1
+            entries = []
+            for candle in j or []:
+                candle_prices = [float(x) for x in candle[1:5]]
+                bucket = candle[0] // 1000
+                entries.append((price_cache.BINANCE_KLINES, symbol, bucket, True, max(candle_prices),))
+                entries.append((price_cache.BINANCE_KLINES, symbol, bucket, False, min(candle_prices),))
+            cache.put_many(entries)
+            while i < len(missing) and missing[i] <= end:
+                i += 1
+    return num_calls
+
+
+@instrumentation.timed('binance prepare_rows_helper')
+def prepare_rows_helper(row, trade_id_counter):
+    trade_id = 'BINANCE:{}'.format(trade_id_counter)
+    (action, date, price, size, asset, ref_asset_total, ref_asset_symbol, fee_asset_total,
+     fee_asset_symbol) = parse_row(row)
     assert size is not None and asset
 
     # Asset = the primary coin, Ref_asset = the reference coin
     # e.g. with BTCBNB pair, asset = BTC, ref_asset = BNB
-    ref_asset_matcher = re.search(
-        BINANCE_COLUMN_PATTERN, row[5].strip('"').replace(',', ''))
-    ref_asset_total = float(ref_asset_matcher.group(1))
-    ref_asset_symbol = ref_asset_matcher.group(2)
     assert ref_asset_total is not None and ref_asset_symbol
-    add_reference_trade = False
-    if 'USD' in ref_asset_symbol:
-        ref_asset_price = 1.0
-    else:
-        ref_asset_price = get_historical_price(ref_asset_symbol, date, action == 'BUY')
-        assert ref_asset_price > 0
-        add_reference_trade = True
-
     # Fees could be paid in the primary coin or BNB if available, since BNB
     # provides discounted trades.
-    fee_matcher = re.search(BINANCE_COLUMN_PATTERN,
-                            row[6].strip('"').replace(',', ''))
-    fee_asset_total = float(fee_matcher.group(1))
-    fee_asset_symbol = fee_matcher.group(2)
     assert fee_asset_total is not None and fee_asset_symbol
-    if 'USD' in fee_asset_symbol:
-        fee_asset_price = 1.0
-    elif fee_asset_symbol == asset and 'USD' in ref_asset_symbol:
-        fee_asset_price = price
+    ref_price, fee_price = get_row_prices(action, date, price, asset, ref_asset_symbol, fee_asset_symbol)
+    add_reference_trade = False
+    if isinstance(ref_price, tuple):
+        ref_asset_price = get_historical_price(*ref_price)
+        assert ref_asset_price > 0
+        add_reference_trade = True
     else:
-        fee_asset_price = get_historical_price(fee_asset_symbol, date, action == 'BUY')
+        ref_asset_price = ref_price
+
+    if isinstance(fee_price, tuple):
+        fee_asset_price = get_historical_price(*fee_price)
         if fee_asset_price == -1:
             if fee_asset_symbol == asset:
                 fee_asset_price = price * fee_asset_total * ref_asset_price
             else:
                 assert False
+    else:
+        fee_asset_price = fee_price
     trading_fee = fee_asset_total * fee_asset_price
 
     if action == 'BUY':
@@ -113,18 +227,51 @@ def prepare_rows_helper(row, trade_id_counter):
     return ret
 
 
+@instrumentation.timed('binance get_standard_trades')
 def get_standard_trades(filename=BINANCE_TRADES_FILE):
     rows = []
-    with open(filename, 'r') as f:
-        reader = csv.reader(f)
-        assert next(reader) == BINANCE_TRADES_CSV_FIELDS
-        trade_id_counter = 0  # Binance does not provide an internal trade ID
-        for row in reader:
-            rows += prepare_rows_helper(row, trade_id_counter)
-            trade_id_counter += 1
+    csv_rows = []
+    for chunk in utils.read_csv_chunks(filename, BINANCE_TRADES_CSV_FIELDS):
+        csv_rows += chunk
+    lookups = []
+    for row in csv_rows:
+        lookups += get_price_lookups(row)
+    prefetch_historical_prices(lookups)
+    trade_id_counter = 0  # Binance does not provide an internal trade ID
+    for row in csv_rows:
+        rows += prepare_rows_helper(row, trade_id_counter)
+        trade_id_counter += 1
     return sorted(rows, key=lambda x: x[2])
 
 
+def get_binance_row_date(row):
+    return parse_binance_date(row[0])
+
+
+# Yields the same trades as get_standard_trades, oldest first, without loading
+# the file. Prices are prefetched STREAM_PREFETCH_ROWS rows at a time.
+def iter_standard_trades(filename=BINANCE_TRADES_FILE):
+    batch = []
+    for entry in utils.iter_statement_rows(filename, BINANCE_TRADES_CSV_FIELDS, get_binance_row_date):
+        batch.append(entry)
+        if len(batch) == STREAM_PREFETCH_ROWS:
+            yield from prepare_rows_batch(batch)
+            batch = []
+    yield from prepare_rows_batch(batch)
+
+
+def prepare_rows_batch(batch):
+    lookups = []
+    for _, row, _ in batch:
+        lookups += get_price_lookups(row)
+    prefetch_historical_prices(lookups)
+    for index, row, _ in batch:
+        # Trade IDs count rows from the top of the file, as in get_standard_trades
+        yield from prepare_rows_helper(row, index)
+
+
 if __name__ == '__main__':
+    instrumentation.enable_from_environment()
     rows = get_standard_trades()
+    price_service.PRICE_SERVICE.print_summary()
     utils.process_trades(rows)
@@ -1,45 +1,78 @@
 #!/usr/local/bin/python3
 
-import csv
 import datetime
-import utils
+import src.exchanges.instrumentation as instrumentation
+import src.exchanges.snapshot as snapshot
+import src.exchanges.utils as utils
 
 
 COINBASE_TRADES_FILE = 'coinbase_trades.csv'
 COINBASE_DEPOSITS_FILE = 'coinbase_deposits.csv'
 COINBASE_TRADES_CSV_FIELDS = ['portfolio', 'trade id', 'product', 'side', 'created at',
                               'size', 'size unit', 'price', 'fee', 'total', 'price/fee/total unit']
+COINBASE_DEPOSITS_CSV_FIELDS = ['portfolio', 'type', 'time', 'amount', 'balance', 'amount/balance unit',
+                                'transfer id', 'trade id', 'order id']
 
 
+def parse_coinbase_date(date_string):
+    try:
+        return datetime.datetime.fromisoformat(date_string[:-1])
+    except ValueError:
+        return datetime.datetime.strptime(date_string, "%Y-%m-%dT%H:%M:%S.%fz")
+
+
+def get_coinbase_row_date(row):
+    return parse_coinbase_date(row[4])
+
+
+def get_standard_trade(row, date):
+    assert 'USD' in row[10]
+    return ['COINBASE:{}'.format(row[1]), row[3].upper(), date,
+            float(row[5]), row[6], float(row[8]), abs(float(row[9]))]
+
+
+@instrumentation.timed('coinbase get_standard_trades')
 def get_standard_trades(filename=COINBASE_TRADES_FILE):
     rows = []
-    with open(filename, 'r') as f:
-        reader = csv.reader(f)
-        assert next(reader) == COINBASE_TRADES_CSV_FIELDS
-        for row in reader:
-            trade_id = 'COINBASE:{}'.format(row[1])
-            action = row[3].upper()
-            date = datetime.datetime.strptime(
-                row[4], "%Y-%m-%dT%H:%M:%S.%fz")
-            size = float(row[5])
-            asset = row[6]
-            trading_fee = float(row[8])
-            net_fiat = abs(float(row[9]))
-            assert 'USD' in row[10]
-            rows.append([trade_id, action, date, size, asset, trading_fee, net_fiat])
+    for chunk in utils.read_csv_chunks(filename, COINBASE_TRADES_CSV_FIELDS):
+        for row in chunk:
+            rows.append(get_standard_trade(row, parse_coinbase_date(row[4])))
     return sorted(rows, key=lambda x: x[2])
 
 
-# 1. obtain buy bases for every single wallet (XYZUSD are buy events and ABCXYZ are both buy and sell events)
-# 2. record deposits by inheriting bases from source wallet to the current wallet's buys (only share HIFO buy trades before the withdrawal event)
-# 3. record withdrawals by subtracting from current wallet's buys so that the destination wallet can use those bases (share HIFO trades)
-# 3. aggregate all sells into one chronological list, and iterate through them (follow the wallet they transacted on)
+# Yields the same trades as get_standard_trades, oldest first, without loading the file
+def iter_standard_trades(filename=COINBASE_TRADES_FILE):
+    for _, row, date in utils.iter_statement_rows(filename, COINBASE_TRADES_CSV_FIELDS, get_coinbase_row_date):
+        yield get_standard_trade(row, date)
+
+
+# Reads the crypto deposits and withdrawals of a Coinbase Pro account statement
+# as transfers (see src/exchanges/transfers.py), oldest first. Matches, fees and
+# USD transfers are skipped, they carry no lots.
+# Returns (deposits, withdrawals)
+@instrumentation.timed('coinbase get_deposits_and_withdrawals')
 def get_deposits_and_withdrawals(filename=COINBASE_DEPOSITS_FILE):
-    pass
+    deposits = []
+    withdrawals = []
+    for chunk in utils.read_csv_chunks(filename, COINBASE_DEPOSITS_CSV_FIELDS):
+        for row in chunk:
+            if row[1] not in ('deposit', 'withdrawal') or row[5] == 'USD':
+                continue
+            transfer = ['COINBASE:{}'.format(row[6]), row[1].upper(), parse_coinbase_date(row[2]),
+                        abs(float(row[3])), row[5], 0, 0]
+            if row[1] == 'deposit':
+                deposits.append(transfer)
+            else:
+                withdrawals.append(transfer)
+    return sorted(deposits, key=lambda x: x[2]), sorted(withdrawals, key=lambda x: x[2])
 
 
 if __name__ == '__main__':
+    instrumentation.enable_from_environment()
+    # 2019 is only replayed when its snapshot is missing or its CSV changed
+    snapshot_2019 = snapshot.get_snapshot_file('coinbase', 2019)
+    leftovers_2019 = snapshot.get_carryforward_trades(snapshot.load_or_build_snapshot(
+        snapshot_2019, ['coinbase_trades_2019.csv'], lambda: get_standard_trades(filename='coinbase_trades_2019.csv')))
     rows = get_standard_trades()
-    rows_2019 = get_standard_trades(filename='coinbase_trades_2019.csv')
-    leftovers_2019 = utils.get_previous_year_leftovers(rows_2019)
-    utils.process_trades(leftovers_2019 + rows)
+    utils.process_trades(leftovers_2019 + rows, year_snapshot=snapshot.YearSnapshot(
+        snapshot.get_snapshot_file('coinbase', 2020), [COINBASE_TRADES_FILE], previous_path=snapshot_2019))
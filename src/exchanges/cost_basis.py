@@ -0,0 +1,137 @@
+#!/usr/local/bin/python3
+
+import heapq
+
+from src.exchanges.lot_book import to_micros
+
+
+# Picks the eligible lot with the smallest sort key. Consumed lots are dropped
+# lazily, and lots dated on/after the current sale (only possible when sales
+# arrive out of order) are parked until the sale is done.
+class HeapSelector(object):
+
+    def __init__(self, sort_key):
+        self.sort_key = sort_key
+        self.heap = []
+        self.deferred = []
+
+    def push(self, lot):
+        heapq.heappush(self.heap, (self.sort_key(lot), lot))
+
+    def next_lot(self, sale_date, sale_trade_id):
+        heap = self.heap
+        while heap and not (heap[0][1][2] > 0 and heap[0][1][0] < sale_date):
+            entry = heapq.heappop(heap)
+            if entry[1][2] > 0:
+                self.deferred.append(entry)
+        if not heap:
+            return None
+        return heap[0][1]
+
+    def end_sale(self):
+        for entry in self.deferred:
+            heapq.heappush(self.heap, entry)
+        self.deferred = []
+
+    def compact(self):
+        self.heap = [entry for entry in self.heap if entry[1][2] > 0]
+        heapq.heapify(self.heap)
+
+
+# Draws the lots named for a sale first, in the order given, then falls back
+# to a heap strategy for whatever the named lots do not cover.
+class SpecificIdSelector(object):
+
+    def __init__(self, lot_ids, fallback_sort_key):
+        self.lot_ids = lot_ids
+        self.lots_by_trade_id = {}
+        self.cursors = {}
+        self.fallback = HeapSelector(fallback_sort_key)
+
+    def push(self, lot):
+        self.lots_by_trade_id[lot[3]] = lot
+        self.fallback.push(lot)
+
+    def next_lot(self, sale_date, sale_trade_id):
+        named = self.lot_ids.get(sale_trade_id, ())
+        cursor = self.cursors.get(sale_trade_id, 0)
+        while cursor < len(named):
+            lot = self.lots_by_trade_id.get(named[cursor])
+            if lot is not None and lot[2] > 0 and lot[0] < sale_date:
+                self.cursors[sale_trade_id] = cursor
+                return lot
+            cursor += 1
+        self.cursors[sale_trade_id] = cursor
+        return self.fallback.next_lot(sale_date, sale_trade_id)
+
+    def end_sale(self):
+        self.fallback.end_sale()
+
+    def compact(self):
+        self.lots_by_trade_id = {
+            trade_id: lot for trade_id, lot in self.lots_by_trade_id.items() if lot[2] > 0}
+        self.fallback.compact()
+
+
+class HeapStrategy(object):
+
+    def __init__(self, name, sort_key):
+        self.name = name
+        self.sort_key = sort_key
+
+    def new_selector(self):
+        return HeapSelector(self.sort_key)
+
+
+class SpecificIdStrategy(object):
+    name = 'specific_id'
+
+    # lot_ids maps a sale's trade ID to the trade IDs of the lots it sold
+    def __init__(self, lot_ids, fallback=None):
+        self.lot_ids = lot_ids
+        self.fallback = fallback or FIFO
+
+    def new_selector(self):
+        return SpecificIdSelector(self.lot_ids, self.fallback.sort_key)
+
+
+# Lot layout: [date, basis, size, trade_id, seq]. Ties fall back to seq, the
+# order the lots were recorded in. Sort keys are module-level functions so
+# strategies can be pickled into worker processes.
+def fifo_sort_key(lot):
+    return (to_micros(lot[0]), lot[4])
+
+
+def lifo_sort_key(lot):
+    return (-to_micros(lot[0]), lot[4])
+
+
+def hifo_sort_key(lot):
+    return (-lot[1], lot[4])
+
+
+def lofo_sort_key(lot):
+    return (lot[1], lot[4])
+
+
+FIFO = HeapStrategy('fifo', fifo_sort_key)
+LIFO = HeapStrategy('lifo', lifo_sort_key)
+HIFO = HeapStrategy('hifo', hifo_sort_key)
+LOFO = HeapStrategy('lofo', lofo_sort_key)
+
+COST_BASIS_STRATEGIES = {
+    FIFO.name: FIFO,
+    LIFO.name: LIFO,
+    HIFO.name: HIFO,
+    LOFO.name: LOFO,
+}
+
+
+def get_strategy(strategy, specific_lot_ids=None):
+    if not isinstance(strategy, str):
+        return strategy
+    if strategy == SpecificIdStrategy.name:
+        return SpecificIdStrategy(specific_lot_ids or {})
+    if strategy not in COST_BASIS_STRATEGIES:
+        raise ValueError('unsupported tax strategy: {}'.format(strategy))
+    return COST_BASIS_STRATEGIES[strategy]
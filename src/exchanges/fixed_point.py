@@ -0,0 +1,225 @@
+#!/usr/local/bin/python3
+
+import datetime
+import decimal
+
+from src.exchanges.audit import AuditRecord
+from src.exchanges.lot_book import COMPACT_MIN_LOTS, LotBook
+from src.exchanges.utils import TradeStream
+
+
+# Exact alternative to the float engine: sizes are counted in 1e-8 units and
+# dollars in 1e-6 USD, as Python ints (int64 range for any realistic
+# portfolio). A lot's cost and a sale's proceeds are split across partial
+# matches by cumulative floor division, so the parts always add back up to
+# the whole and nothing drifts. DECIMAL runs the same engine on
+# decimal.Decimal, for comparison (see the numeric_* benchmark cases).
+SIZE_SCALE = 10 ** 8
+USD_SCALE = 10 ** 6
+MICRO_USD = decimal.Decimal(1) / USD_SCALE
+ONE_YEAR = datetime.timedelta(days=365)
+
+
+class FixedPoint(object):
+    name = 'fixed_point'
+    zero = 0
+
+    def size(self, value):
+        return round(value * SIZE_SCALE)
+
+    def usd(self, value):
+        return round(value * USD_SCALE)
+
+    # The share of amount that part of whole stands for, rounded down
+    def prorate(self, amount, part, whole):
+        return amount * part // whole
+
+    # Micro USD per whole unit, only used to order lots
+    def basis(self, cost, size):
+        return cost * SIZE_SCALE // size
+
+    def size_to_float(self, size):
+        return size / SIZE_SCALE
+
+    def usd_to_float(self, amount):
+        return amount / USD_SCALE
+
+
+class DecimalPoint(object):
+    name = 'decimal'
+    zero = decimal.Decimal(0)
+
+    def size(self, value):
+        return decimal.Decimal(repr(value))
+
+    def usd(self, value):
+        return decimal.Decimal(repr(value)).quantize(MICRO_USD)
+
+    def prorate(self, amount, part, whole):
+        return (amount * part / whole).quantize(MICRO_USD, rounding=decimal.ROUND_FLOOR)
+
+    def basis(self, cost, size):
+        return cost / size
+
+    def size_to_float(self, size):
+        return float(size)
+
+    def usd_to_float(self, amount):
+        return float(amount)
+
+
+FIXED_POINT = FixedPoint()
+DECIMAL = DecimalPoint()
+NUMERIC_BACKENDS = {FIXED_POINT.name: FIXED_POINT, DECIMAL.name: DECIMAL}
+
+
+class ExactLotBook(LotBook):
+    # Lots are [date, basis, size, trade_id, seq, bought size, cost]; size is
+    # what is left of the bought size and basis only orders lots for the
+    # cost basis strategies.
+
+    def __init__(self, numbers):
+        super().__init__()
+        self.numbers = numbers
+
+    # size and cost in the book's numbers
+    def add_lot(self, date, size, cost, trade_id):
+        self.insert([date, self.numbers.basis(cost, size), size, trade_id, None, size, cost])
+
+    # Yields (date, trade_id, entry_size, entry_cost) for every lot used to
+    # cover the sale, consuming the lots as it goes, like LotBook.match
+    def match(self, strategy, sale_size, sale_date, sale_trade_id=None):
+        prorate = self.numbers.prorate
+        selector = self.admit(strategy, sale_date)
+        try:
+            while sale_size > 0:
+                lot = selector.next_lot(sale_date, sale_trade_id)
+                if lot is None:
+                    break
+                entry_size = min(lot[2], sale_size)
+                consumed = lot[5] - lot[2]
+                lot[2] -= entry_size
+                if lot[2] == 0:
+                    self.consumed += 1
+                sale_size -= entry_size
+                yield lot[0], lot[3], entry_size, (
+                    prorate(lot[6], consumed + entry_size, lot[5]) - prorate(lot[6], consumed, lot[5]))
+        finally:
+            selector.end_sale()
+            if self.consumed >= COMPACT_MIN_LOTS and self.consumed * 2 > len(self.lots):
+                self.compact()
+
+    # Returns the open lots as [date, size, remaining cost, trade_id] lists
+    def remaining_lots(self):
+        lots = []
+        for date, _, size, trade_id, _, bought_size, cost in self.lots:
+            if size > 0:
+                lots.append([date, size, cost - self.numbers.prorate(cost, bought_size - size, bought_size), trade_id])
+        return lots
+
+
+class FixedPointTradeStream(TradeStream):
+    # utils.TradeStream over ExactLotBooks in the given numeric backend. The
+    # totals are [short term, long term, sell fees, matched obligations] and
+    # the ledger [bought cost, consumed cost, sold proceeds, matched proceeds,
+    # proceeds with no basis], both in the backend's numbers.
+
+    def __init__(self, strategy='hifo', specific_lot_ids=None, numbers=FIXED_POINT, audit=None):
+        super().__init__(strategy, specific_lot_ids, audit)
+        self.numbers = numbers
+        self.totals = [numbers.zero] * 4
+        self.buy_fees = numbers.zero
+        self.ledger = [numbers.zero] * 5
+
+    def get_lot_book(self, key):
+        if key not in self.lot_books:
+            self.lot_books[key] = ExactLotBook(self.numbers)
+        return self.lot_books[key]
+
+    def add_buy(self, key, trade):
+        trade_id, action, date, size, asset, fee, net_fiat = trade
+        numbers = self.numbers
+        self.buy_fees += numbers.usd(fee)
+        size = numbers.size(size)
+        if size <= 0:
+            return
+        cost = numbers.usd(abs(net_fiat))
+        self.ledger[0] += cost
+        self.get_lot_book(key).add_lot(date, size, cost, trade_id)
+
+    def add_sale(self, key, trade, strategy):
+        trade_id, action, date, size, asset, fee, net_fiat = trade
+        numbers = self.numbers
+        to_float = numbers.usd_to_float
+        size_to_float = numbers.size_to_float
+        totals = self.totals
+        ledger = self.ledger
+        size = numbers.size(size)
+        if action == 'SELL':
+            totals[2] += numbers.usd(fee)
+            proceeds = numbers.usd(net_fiat)
+        else:
+            proceeds = numbers.zero
+        ledger[2] += proceeds
+        sold_size = numbers.zero
+        if key in self.lot_books and size > 0:
+            for entry_date, entry_trade_id, entry_size, entry_cost in self.lot_books[key].match(
+                    strategy, size, date, trade_id):
+                exit_proceeds = numbers.prorate(proceeds, sold_size + entry_size, size) - numbers.prorate(
+                    proceeds, sold_size, size)
+                sold_size += entry_size
+                obligation = exit_proceeds - entry_cost
+                ledger[1] += entry_cost
+                ledger[3] += exit_proceeds
+                if action == 'SELL':
+                    totals[0 if date - entry_date <= ONE_YEAR else 1] += obligation
+                    totals[3] += obligation
+                self.audit.write(AuditRecord(
+                    asset, action, entry_date, to_float(entry_cost) / size_to_float(entry_size),
+                    size_to_float(entry_size), entry_trade_id, date, to_float(exit_proceeds) / size_to_float(entry_size),
+                    size_to_float(entry_size), trade_id, to_float(obligation)))
+        if size <= 0:
+            ledger[4] += proceeds
+            return
+        ledger[4] += proceeds - numbers.prorate(proceeds, sold_size, size)
+        if action == 'SELL' and sold_size < size:
+            if asset not in self.sold_assets_with_no_basis:
+                self.sold_assets_with_no_basis[asset] = []
+            self.sold_assets_with_no_basis[asset].append(
+                (date, to_float(proceeds) / size_to_float(size), size_to_float(size - sold_size), trade_id,))
+
+    def get_totals(self):
+        to_float = self.numbers.usd_to_float
+        return to_float(self.totals[0]), to_float(self.totals[1]), to_float(self.buy_fees + self.totals[2])
+
+    def get_leftovers(self):
+        to_float = self.numbers.usd_to_float
+        size_to_float = self.numbers.size_to_float
+        leftovers = {}
+        for asset, lot_book in self.lot_books.items():
+            leftovers[asset] = [(date, to_float(cost) / size_to_float(size), size_to_float(size), trade_id,)
+                                for date, size, cost, trade_id in lot_book.remaining_lots()]
+        return leftovers
+
+    # Lot costs are either consumed or still open, sale proceeds either matched
+    # or left without basis, and the totals equal the matched obligations
+    def validate(self, short_term_obligation, long_term_obligation):
+        open_cost = self.numbers.zero
+        for lot_book in self.lot_books.values():
+            for _, _, cost, _ in lot_book.remaining_lots():
+                open_cost += cost
+        ledger = self.ledger
+        assert ledger[0] == ledger[1] + open_cost
+        assert ledger[2] == ledger[3] + ledger[4]
+        assert self.totals[3] == self.totals[0] + self.totals[1]
+
+
+# Same matching as utils.process_trade_stream over date-ordered trades, in the
+# given numeric backend (FIXED_POINT or DECIMAL). The audit records and the
+# returned (short term, long term) totals are floats converted from the exact
+# amounts, which are checked to reconcile (see FixedPointTradeStream.validate).
+def process_trades_fixed_point(trades, strategy='hifo', specific_lot_ids=None, numbers=FIXED_POINT, audit=None):
+    stream = FixedPointTradeStream(strategy, specific_lot_ids, numbers, audit)
+    for trade in trades:
+        stream.add(trade)
+    return stream.finish()
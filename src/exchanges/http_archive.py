@@ -0,0 +1,187 @@
+#!/usr/local/bin/python3
+
+import hashlib
+import io
+import json
+import os
+import src.exchanges.http_client as http_client
+import src.exchanges.instrumentation as instrumentation
+import struct
+import threading
+import urllib.parse
+import zlib
+
+
+# Record/replay of JSON responses for deterministic, offline runs. Set
+# TAX_CALCULATOR_HTTP_ARCHIVE=<dir> (or call enable()) and every
+# utils.get_request_with_retry goes through the archive:
+#   record: answers from the archive, fetches and appends what is missing
+#   replay: only answers from the archive, a missing URL raises ArchiveMissError
+# The archive is two append-only files: archive.bin holds records of
+#   sha256(normalized url), url length, body length, url, zlib(JSON body)
+# and archive.idx one (digest, offset, length) entry per record, so opening
+# it reads the index instead of the bodies. Records appended after the last
+# index entry (e.g. an interrupted run) are re-indexed on open; in replay mode
+# the archive is only read, so it can be a read-only copy, and torn writes
+# are skipped rather than repaired.
+HTTP_ARCHIVE_DIR = os.environ.get('TAX_CALCULATOR_HTTP_ARCHIVE')
+HTTP_ARCHIVE_MODE = os.environ.get('TAX_CALCULATOR_HTTP_MODE', 'record')
+HTTP_ARCHIVE_MODES = ['record', 'replay']
+DATA_FILE = 'archive.bin'
+INDEX_FILE = 'archive.idx'
+RECORD_HEADER = struct.Struct('<32sII')
+INDEX_ENTRY = struct.Struct('<32sQI')
+# Query parameters that hold credentials, left out of the archive keys
+SECRET_PARAMS = {'apikey', 'api_key', 'x_cg_demo_api_key', 'x_cg_pro_api_key'}
+ARCHIVE = None
+ARCHIVE_LOCK = threading.Lock()
+
+
+class ArchiveMissError(LookupError):
+    pass
+
+
+# Lowercases the scheme and host, sorts the query and drops credentials, so
+# the same request always maps to the same key
+def normalize_url(url):
+    parts = urllib.parse.urlsplit(url)
+    query = sorted((name, value) for name, value in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+                   if name.lower() not in SECRET_PARAMS)
+    return urllib.parse.urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path,
+                                    urllib.parse.urlencode(query), '',))
+
+
+def get_url_digest(url):
+    return hashlib.sha256(normalize_url(url).encode()).digest()
+
+
+class HttpArchive(object):
+
+    def __init__(self, directory, mode='record'):
+        if mode not in HTTP_ARCHIVE_MODES:
+            raise ValueError('unsupported http archive mode: {}'.format(mode))
+        self.directory = directory
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.index = {}
+        data_file = os.path.join(directory, DATA_FILE)
+        index_file = os.path.join(directory, INDEX_FILE)
+        if mode == 'replay':
+            self.data = open(data_file, 'rb')
+            self.index_file = open(index_file, 'rb') if os.path.exists(index_file) else io.BytesIO()
+        else:
+            os.makedirs(directory, exist_ok=True)
+            self.data = open(data_file, 'a+b')
+            self.index_file = open(index_file, 'a+b')
+        self.load_index()
+
+    def load_index(self):
+        writable = self.mode == 'record'
+        self.index_file.seek(0)
+        entries = self.index_file.read()
+        indexed_end = 0
+        for i in range(len(entries) // INDEX_ENTRY.size):
+            digest, offset, length = INDEX_ENTRY.unpack_from(entries, i * INDEX_ENTRY.size)
+            self.index[digest] = (offset, length,)
+            indexed_end = max(indexed_end, offset + length)
+        # Drop a torn index entry, then index the records it does not cover
+        if writable:
+            self.index_file.truncate(len(entries) - len(entries) % INDEX_ENTRY.size)
+        data_end = self.data.seek(0, os.SEEK_END)
+        if indexed_end > data_end:
+            # The index is ahead of the data it indexes, rebuild it
+            self.index = {}
+            if writable:
+                self.index_file.truncate(0)
+            indexed_end = 0
+        offset = indexed_end
+        while offset + RECORD_HEADER.size <= data_end:
+            self.data.seek(offset)
+            digest, url_length, body_length = RECORD_HEADER.unpack(self.data.read(RECORD_HEADER.size))
+            length = RECORD_HEADER.size + url_length + body_length
+            if offset + length > data_end:
+                break
+            if writable:
+                self.add_index_entry(digest, offset, length)
+            else:
+                self.index[digest] = (offset, length,)
+            offset += length
+        # Anything after the last whole record is a torn write
+        if writable:
+            self.data.truncate(offset)
+
+    def add_index_entry(self, digest, offset, length):
+        self.index[digest] = (offset, length,)
+        self.index_file.write(INDEX_ENTRY.pack(digest, offset, length))
+        self.index_file.flush()
+
+    def __contains__(self, url):
+        return get_url_digest(url) in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    # Returns the archived body of the url, raises ArchiveMissError if there is none
+    def get(self, url):
+        digest = get_url_digest(url)
+        with self.lock:
+            if digest not in self.index:
+                raise ArchiveMissError('{} is not in the http archive {}'.format(normalize_url(url), self.directory))
+            offset, length = self.index[digest]
+            self.data.seek(offset)
+            record = self.data.read(length)
+        _, url_length, _ = RECORD_HEADER.unpack_from(record)
+        return json.loads(zlib.decompress(record[RECORD_HEADER.size + url_length:]))
+
+    def put(self, url, body):
+        if self.mode == 'replay':
+            raise ValueError('the http archive {} is open for replay only'.format(self.directory))
+        normalized_url = normalize_url(url).encode()
+        digest = hashlib.sha256(normalized_url).digest()
+        compressed = zlib.compress(json.dumps(body, separators=(',', ':')).encode())
+        with self.lock:
+            offset = self.data.seek(0, os.SEEK_END)
+            self.data.write(RECORD_HEADER.pack(digest, len(normalized_url), len(compressed)))
+            self.data.write(normalized_url)
+            self.data.write(compressed)
+            self.data.flush()
+            self.add_index_entry(digest, offset, RECORD_HEADER.size + len(normalized_url) + len(compressed))
+
+    # get_json through the archive; failed requests (None) are not recorded
+    def get_json(self, url, headers, num_retries=6):
+        try:
+            body = self.get(url)
+            instrumentation.count('http replayed')
+            return body
+        except ArchiveMissError:
+            if self.mode == 'replay':
+                raise
+        body = http_client.get_json(url, headers, num_retries)
+        if body is not None:
+            self.put(url, body)
+            instrumentation.count('http recorded')
+        return body
+
+    def close(self):
+        with self.lock:
+            self.data.close()
+            self.index_file.close()
+
+
+def enable(directory, mode='record'):
+    global ARCHIVE
+    with ARCHIVE_LOCK:
+        if ARCHIVE is not None:
+            ARCHIVE.close()
+        ARCHIVE = HttpArchive(directory, mode)
+        return ARCHIVE
+
+
+# Returns the archive requests should go through, or None to go to the network
+def get_http_archive():
+    global ARCHIVE
+    if ARCHIVE is None and HTTP_ARCHIVE_DIR:
+        with ARCHIVE_LOCK:
+            if ARCHIVE is None:
+                ARCHIVE = HttpArchive(HTTP_ARCHIVE_DIR, HTTP_ARCHIVE_MODE)
+    return ARCHIVE
@@ -0,0 +1,111 @@
+#!/usr/local/bin/python3
+
+import email.utils
+import random
+import src.exchanges.instrumentation as instrumentation
+import src.exchanges.rate_limit as rate_limit
+import threading
+import time
+import urllib.parse
+
+
+# Max requests in flight per host; each host gets its own pooled session
+HOST_CONCURRENCY = {
+    'api.etherscan.io': 5,
+    'api.coingecko.com': 2,
+    'api.binance.com': 8,
+}
+DEFAULT_HOST_CONCURRENCY = 8
+BACKOFF_BASE_SECONDS = 1
+BACKOFF_MAX_SECONDS = 60
+
+HOSTS = {}
+HOSTS_LOCK = threading.Lock()
+HTTP_STATS = {}
+STATS_LOCK = threading.Lock()
+
+
+class PermanentHTTPError(Exception):
+    pass
+
+
+# requests takes ~100ms to import, so it is only imported once a request is made
+def get_host(host):
+    import requests
+    with HOSTS_LOCK:
+        if host not in HOSTS:
+            concurrency = HOST_CONCURRENCY.get(host, DEFAULT_HOST_CONCURRENCY)
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            HOSTS[host] = (session, threading.BoundedSemaphore(concurrency),)
+        return HOSTS[host]
+
+
+def record(host, counter, amount=1):
+    with STATS_LOCK:
+        if host not in HTTP_STATS:
+            HTTP_STATS[host] = {'requests': 0, 'retries': 0, 'sleep_seconds': 0, 'rate_limit_seconds': 0}
+        HTTP_STATS[host][counter] += amount
+    instrumentation.count('http {}'.format(counter), amount)
+
+
+# Returns {host: {'requests', 'retries', 'sleep_seconds', 'rate_limit_seconds'}}
+def get_http_stats():
+    with STATS_LOCK:
+        return {host: dict(stats) for host, stats in HTTP_STATS.items()}
+
+
+# Seconds to wait as requested by a Retry-After header (delta-seconds or HTTP date)
+def get_retry_after(response):
+    retry_after = response.headers.get('Retry-After')
+    if not retry_after:
+        return None
+    if retry_after.isdigit():
+        return int(retry_after)
+    try:
+        return max(0, email.utils.parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# Full jitter: a random wait of up to BACKOFF_BASE_SECONDS * 2**attempt
+def get_backoff(attempt):
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+# Returns the decoded JSON body, or None if the request failed for good.
+# 429s, 5xxs and connection errors are retried (honoring Retry-After);
+# any other 4xx is permanent and returned right away.
+@instrumentation.timed('http get_json')
+def get_json(url, headers, num_retries=6):
+    import requests
+    host = urllib.parse.urlsplit(url).hostname
+    session, semaphore = get_host(host)
+    for i in range(num_retries):
+        if i > 0:
+            record(host, 'retries')
+        wait = None
+        try:
+            record(host, 'rate_limit_seconds', rate_limit.acquire(url))
+            with semaphore:
+                record(host, 'requests')
+                response = session.get(url, headers=headers)
+            if response.status_code == 429 or response.status_code >= 500:
+                wait = get_retry_after(response)
+                response.raise_for_status()
+            if response.status_code >= 400:
+                raise PermanentHTTPError()
+            return response.json()
+        except PermanentHTTPError:
+            print('received a {} from {}'.format(response.status_code, url))
+            return None
+        except (requests.exceptions.RequestException, ValueError):
+            if i == num_retries - 1:
+                break
+            if wait is None:
+                wait = get_backoff(i)
+            record(host, 'sleep_seconds', wait)
+            time.sleep(wait)
+    return None
@@ -0,0 +1,374 @@
+#!/usr/local/bin/python3
+
+import collections
+import hashlib
+import os
+import pickle
+import sqlite3
+import src.exchanges.price_cache as price_cache
+import src.exchanges.utils as utils
+
+from src.exchanges.audit import AuditSink, LotMatch
+from src.exchanges.cost_basis import LOFO, get_strategy
+from src.exchanges.lot_book import LotBook, from_micros, to_micros
+
+
+# Ledger state kept between runs, so a daily re-import only matches the trades
+# it has not seen before. A run reads the hot state, i.e. each asset's open
+# lots and running totals, and the applied trade IDs. The buys and the sales
+# with their lot matches are only appended to, and read back from a date by
+# the replays of late trades.
+INCREMENTAL_STATE_FILE = os.path.join(price_cache.PRICE_CACHE_DIR, 'incremental.sqlite3')
+INCREMENTAL_STATE_VERSION = 1
+# Sources whose trade IDs are row positions in the export rather than real IDs,
+# so a re-export with new rows on top renumbers every trade
+POSITIONAL_TRADE_ID_PREFIXES = ('BINANCE:',)
+# Dates are stored as lot_book.to_micros integers and sales are numbered per
+# asset in the order they were matched (seq, shared with the buys). A sale's
+# short_term, long_term and remaining_size are its calculate_obligation_after_sale
+# result (NULL when it found no lots) and the total_ columns the asset's running
+# totals after it. lot_matches has the sale's LotMatch for each lot it drew from.
+INCREMENTAL_SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)',
+    'CREATE TABLE IF NOT EXISTS trade_ids (trade_id TEXT PRIMARY KEY) WITHOUT ROWID',
+    'CREATE TABLE IF NOT EXISTS assets (asset TEXT PRIMARY KEY, state BLOB)',
+    'CREATE TABLE IF NOT EXISTS buys ('
+    'asset TEXT, seq INTEGER, date INTEGER, trade_id TEXT, basis REAL, size REAL, PRIMARY KEY (asset, seq))',
+    'CREATE INDEX IF NOT EXISTS buys_by_date ON buys (asset, date)',
+    'CREATE INDEX IF NOT EXISTS buys_by_trade_id ON buys (asset, trade_id)',
+    'CREATE TABLE IF NOT EXISTS sales ('
+    'asset TEXT, seq INTEGER, date INTEGER, trade_id TEXT, action TEXT, size REAL, fee REAL, net_fiat REAL, '
+    'short_term REAL, long_term REAL, remaining_size REAL, '
+    'total_short_term REAL, total_long_term REAL, total_fees REAL, audit_total REAL, PRIMARY KEY (asset, seq))',
+    'CREATE INDEX IF NOT EXISTS sales_by_date ON sales (asset, date)',
+    'CREATE TABLE IF NOT EXISTS lot_matches ('
+    'asset TEXT, seq INTEGER, date INTEGER, trade_id TEXT, entry_date INTEGER, entry_basis REAL, entry_size REAL, '
+    'exit_basis REAL, exit_size REAL, obligation REAL)',
+    'CREATE INDEX IF NOT EXISTS lot_matches_by_lot ON lot_matches (asset, trade_id, date)',
+    'CREATE INDEX IF NOT EXISTS lot_matches_by_date ON lot_matches (asset, date)',
+]
+
+
+def trade_date(trade):
+    return trade[2]
+
+
+# Returns the row with a trade ID that survives a re-export: real IDs are kept,
+# positional ones become a hash of the trade's content plus how many identical
+# trades came before it. occurrences counts the hashes seen so far.
+def with_stable_trade_id(row, occurrences):
+    if not row[0].startswith(POSITIONAL_TRADE_ID_PREFIXES):
+        return row
+    trade_id, action, date, size, asset, fee, net_fiat = row
+    prefix = trade_id[:trade_id.find(':') + 1]
+    content = hashlib.sha1(repr((action, date.isoformat(), size, asset, net_fiat,)).encode()).hexdigest()[:16]
+    occurrence = occurrences.get(content, 0)
+    occurrences[content] = occurrence + 1
+    return ['{}{}:{}'.format(prefix, content, occurrence), action, date, size, asset, fee, net_fiat]
+
+
+class AssetLedger(object):
+    # One asset's hot state: the live lot book (None until its first buy), the
+    # running totals and the date of its latest trade. Its buys and its
+    # sells/burns with their calculate_obligation_after_sale results are rows
+    # of the ledger's database, written by save(). Sales dated before a late
+    # trade stay as they are; later ones are undone and matched again.
+
+    def __init__(self, asset, connection, state=None):
+        self.asset = asset
+        self.connection = connection
+        self.audit = AuditSink()
+        if state is None:
+            state = (None, None, 0, [0, 0, 0], 0, {}, 0,)
+        lots, self.last_date, self.buy_fees, self.totals, self.audit.total, self.no_basis, self.next_seq = state
+        self.lot_book = LotBook(lots) if lots is not None else None
+        self.new_buys = []
+        self.new_sales = []
+        self.new_lot_matches = []
+
+    def get_state(self):
+        lots = self.lot_book.remaining() if self.lot_book is not None else None
+        return lots, self.last_date, self.buy_fees, self.totals, self.audit.total, self.no_basis, self.next_seq
+
+    def save(self):
+        self.connection.executemany('INSERT INTO buys VALUES (?, ?, ?, ?, ?, ?)', self.new_buys)
+        self.connection.executemany(
+            'INSERT INTO sales VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', self.new_sales)
+        self.connection.executemany(
+            'INSERT INTO lot_matches VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', self.new_lot_matches)
+        self.connection.execute('INSERT OR REPLACE INTO assets VALUES (?, ?)', (
+            self.asset, pickle.dumps(self.get_state(), protocol=pickle.HIGHEST_PROTOCOL),))
+        self.new_buys = []
+        self.new_sales = []
+        self.new_lot_matches = []
+
+    # Returns the sales dated on/after start_date as trade rows, in the order
+    # they were matched
+    def get_sale_trades(self, start_date):
+        return [[trade_id, action, from_micros(date), size, self.asset, fee, net_fiat]
+                for date, trade_id, action, size, fee, net_fiat in self.connection.execute(
+                    'SELECT date, trade_id, action, size, fee, net_fiat FROM sales '
+                    'WHERE asset = ? AND date >= ? ORDER BY date, seq', (self.asset, to_micros(start_date),))]
+
+    # Yields [trade, obligation] for every saved sale dated on/after start_date
+    # (all of them without one), in the order they were matched
+    def get_sales(self, start_date=None):
+        start = to_micros(start_date) if start_date is not None else -2 ** 63  # before any date
+        matches = {}
+        for row in self.connection.execute(
+                'SELECT lot_matches.seq, entry_date, entry_basis, entry_size, lot_matches.trade_id, lot_matches.date, '
+                'exit_basis, exit_size, sales.trade_id, obligation FROM lot_matches '
+                'JOIN sales ON sales.asset = lot_matches.asset AND sales.seq = lot_matches.seq '
+                'WHERE lot_matches.asset = ? AND lot_matches.date >= ? ORDER BY lot_matches.rowid', (self.asset, start,)):
+            seq, entry_date, entry_basis, entry_size, entry_trade_id, date, exit_basis, exit_size, trade_id, obligation = row
+            if seq not in matches:
+                matches[seq] = []
+            matches[seq].append(LotMatch(from_micros(entry_date), entry_basis, entry_size, entry_trade_id,
+                                         from_micros(date), exit_basis, exit_size, trade_id, obligation))
+        for row in self.connection.execute(
+                'SELECT seq, date, trade_id, action, size, fee, net_fiat, short_term, long_term, remaining_size '
+                'FROM sales WHERE asset = ? AND date >= ? ORDER BY date, seq', (self.asset, start,)):
+            seq, date, trade_id, action, size, fee, net_fiat, short_term, long_term, remaining_size = row
+            obligation = None
+            if short_term is not None:
+                obligation = (short_term, long_term, remaining_size, matches.get(seq, []),)
+            yield [[trade_id, action, from_micros(date), size, self.asset, fee, net_fiat], obligation]
+
+    def match_sale(self, sale, strategy):
+        trade_id, action, date, size, asset, fee, net_fiat = sale[0]
+        obligation = None
+        if self.lot_book is not None:
+            # use lowest basis for non-transfer L1 fees ;)
+            obligation = utils.calculate_obligation_after_sale(
+                self.lot_book, LOFO if action == 'BURN' else strategy, size, net_fiat, date, trade_id)
+            utils.count_sale(obligation)
+        sale[1] = obligation
+
+    def record(self, sale):
+        trade, obligation = sale
+        utils.record_sale(trade, obligation, self.totals, self.audit, self.no_basis)
+        trade_id, action, date, size, asset, fee, net_fiat = trade
+        seq = self.next_seq
+        self.next_seq += 1
+        date = to_micros(date)
+        short_term, long_term, remaining_size = obligation[:3] if obligation else (None, None, None,)
+        self.new_sales.append((self.asset, seq, date, trade_id, action, size, fee, net_fiat,
+                               short_term, long_term, remaining_size,
+                               self.totals[0], self.totals[1], self.totals[2], self.audit.total,))
+        for match in (obligation[3] if obligation else ()):
+            self.new_lot_matches.append((self.asset, seq, date, match.entry_trade_id, to_micros(match.entry_date),
+                                         match.entry_basis, match.entry_size, match.exit_basis, match.exit_size,
+                                         match.obligation,))
+
+    def add_buy(self, trade):
+        trade_id, action, date, size, asset, fee, net_fiat = trade
+        self.buy_fees += fee
+        lot = (date, abs(net_fiat) / size, size, trade_id,)
+        self.new_buys.append((self.asset, self.next_seq, to_micros(date), trade_id, lot[1], size,))
+        self.next_seq += 1
+        if self.lot_book is None:
+            self.lot_book = LotBook()
+        self.lot_book.add(lot)
+
+    # trades are this asset's unseen trades, in date order
+    def apply(self, trades, strategy):
+        if self.last_date is None or trades[0][2] >= self.last_date:
+            self.append(trades, strategy)
+        else:
+            self.replay(trades, strategy)
+        self.last_date = max(self.last_date or trades[-1][2], trades[-1][2])
+        self.save()
+
+    def append(self, trades, strategy):
+        for trade in trades:
+            if trade[1] == 'BUY':
+                self.add_buy(trade)
+            else:
+                sale = [trade, None]
+                self.match_sale(sale, strategy)
+                self.record(sale)
+
+    # Rebuilds the lot book as it stood before the earliest new trade: the
+    # lots the undone sales drew from get back the size the earlier sales
+    # left them, and lots bought from then on are bought again. Then every
+    # sale from that date on is matched again, on top of the totals the last
+    # earlier sale recorded.
+    def replay(self, trades, strategy):
+        start_date = trades[0][2]
+        start = to_micros(start_date)
+        sales = [[trade, None] for trade in self.get_sale_trades(start_date)]
+        totals = self.connection.execute(
+            'SELECT total_short_term, total_long_term, total_fees, audit_total FROM sales '
+            'WHERE asset = ? AND date < ? ORDER BY date DESC, seq DESC LIMIT 1', (self.asset, start,)).fetchone()
+        # The lots bought before the replay that the undone sales drew from
+        touched = 'SELECT trade_id FROM lot_matches WHERE asset = ? AND date >= ? AND entry_date < ?'
+        touched_buys = self.connection.execute(
+            'SELECT trade_id, seq, date, basis, size FROM buys WHERE asset = ? AND trade_id IN ({})'.format(touched),
+            (self.asset, self.asset, start, start,)).fetchall()
+        touched_matches = self.connection.execute(
+            'SELECT trade_id, entry_size FROM lot_matches WHERE asset = ? AND date < ? AND trade_id IN ({}) '
+            'ORDER BY date, seq, rowid'.format(touched), (self.asset, start, self.asset, start, start,)).fetchall()
+        self.connection.execute('DELETE FROM sales WHERE asset = ? AND date >= ?', (self.asset, start,))
+        self.connection.execute('DELETE FROM lot_matches WHERE asset = ? AND date >= ?', (self.asset, start,))
+
+        lots = {}
+        if self.lot_book is not None:
+            lots = {lot[3]: lot for lot in self.lot_book.remaining() if lot[0] < start_date}
+        # Same arithmetic as LotBook.match, so the sizes come out bit for bit
+        sizes = {trade_id: size for trade_id, _, _, _, size in touched_buys}
+        for trade_id, entry_size in touched_matches:
+            size = sizes[trade_id]
+            sizes[trade_id] = 0 if entry_size >= size else size - entry_size
+        seqs = {}
+        for trade_id, seq, date, basis, _ in touched_buys:
+            seqs[trade_id] = seq
+            if sizes[trade_id] > 0:
+                lots[trade_id] = (from_micros(date), basis, sizes[trade_id], trade_id,)
+            else:
+                lots.pop(trade_id, None)
+        # Lots of the same date stay in the order they were bought
+        lots_per_date = collections.Counter(lot[0] for lot in lots.values())
+        tied_dates = set(lots[trade_id][0] for trade_id in seqs if trade_id in lots)
+        for date in [date for date in tied_dates if lots_per_date[date] > 1]:
+            seqs.update(self.connection.execute(
+                'SELECT trade_id, seq FROM buys WHERE asset = ? AND date = ?', (self.asset, to_micros(date),)))
+        lots = sorted(lots.values(), key=lambda lot: (lot[0], seqs.get(lot[3], 0),))
+        if self.lot_book is not None:
+            # The lots bought from then on all sort after the earlier ones
+            self.lot_book = LotBook(lots + [(from_micros(date), basis, size, trade_id,)
+                                            for date, basis, size, trade_id in self.connection.execute(
+                'SELECT date, basis, size, trade_id FROM buys WHERE asset = ? AND date >= ? ORDER BY date, seq',
+                (self.asset, start,))])
+
+        for trade in trades:
+            if trade[1] == 'BUY':
+                self.add_buy(trade)
+            else:
+                sales.append([trade, None])
+        sales.sort(key=lambda sale: sale[0][2])
+
+        self.totals = list(totals[:3]) if totals else [0, 0, 0]
+        self.audit.total = totals[3] if totals else 0
+        self.no_basis = {asset: [entry for entry in entries if entry[0] < start_date]
+                         for asset, entries in self.no_basis.items()}
+        for sale in sales:
+            self.match_sale(sale, strategy)
+            self.record(sale)
+
+
+class IncrementalLedger(object):
+    # Running lot books and obligations across runs, in the SQLite database at
+    # path (in memory by default). update() takes the full re-imported trade
+    # list, drops the trade IDs it has already applied (content keys for
+    # positional IDs, see with_stable_trade_id) before sorting what is left,
+    # and only touches the assets with new trades: trades dated on/after an
+    # asset's last trade are matched on top of its lot book, earlier ones
+    # replay the asset from the earliest new date. save() commits the update.
+
+    def __init__(self, strategy='hifo', specific_lot_ids=None, path=':memory:'):
+        self.strategy_name = strategy
+        self.strategy = get_strategy(strategy, specific_lot_ids)
+        self.connection = sqlite3.connect(path)
+        for statement in INCREMENTAL_SCHEMA:
+            self.connection.execute(statement)
+        meta = dict(self.connection.execute('SELECT key, value FROM meta'))
+        # Specific lot IDs can change between runs, so those ledgers start over too
+        if meta and (meta.get('version') != INCREMENTAL_STATE_VERSION or meta.get('strategy') != strategy
+                     or strategy == 'specific_id'):
+            for table in ['meta', 'trade_ids', 'assets', 'buys', 'sales', 'lot_matches']:
+                self.connection.execute('DELETE FROM {}'.format(table))
+        self.connection.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)', [
+            ('version', INCREMENTAL_STATE_VERSION,), ('strategy', strategy,)])
+        self.assets = {asset: AssetLedger(asset, self.connection, pickle.loads(state))
+                       for asset, state in self.connection.execute('SELECT asset, state FROM assets')}
+        self.trade_ids = None
+
+    # Returns the set of applied trade IDs, read from the database once
+    def get_trade_ids(self):
+        if self.trade_ids is None:
+            self.trade_ids = {row[0] for row in self.connection.execute('SELECT trade_id FROM trade_ids')}
+        return self.trade_ids
+
+    # Returns the assets that had new trades
+    def update(self, rows):
+        trade_ids = self.get_trade_ids()
+        occurrences = {}
+        new_rows = []
+        for row in rows:
+            if row[0].startswith(POSITIONAL_TRADE_ID_PREFIXES):
+                row = with_stable_trade_id(row, occurrences)
+            if row[0] not in trade_ids:
+                trade_ids.add(row[0])
+                new_rows.append(row)
+        # Identical trades share a date, so the stable sort keeps them in the
+        # order their occurrences were counted
+        new_rows.sort(key=trade_date)
+        self.connection.executemany('INSERT INTO trade_ids VALUES (?)', [(row[0],) for row in new_rows])
+        new_trades = {}
+        for row in new_rows:
+            if row[4] not in new_trades:
+                new_trades[row[4]] = []
+            new_trades[row[4]].append(row)
+        for asset, trades in new_trades.items():
+            if asset not in self.assets:
+                self.assets[asset] = AssetLedger(asset, self.connection)
+            self.assets[asset].apply(trades, self.strategy)
+        return set(new_trades)
+
+    # Yields [trade, obligation] for the asset's sales dated on/after start_date
+    def get_sales(self, asset, start_date=None):
+        if asset in self.assets:
+            yield from self.assets[asset].get_sales(start_date)
+
+    # Returns (short_term_obligation, long_term_obligation, fee_total)
+    def get_totals(self):
+        short_term_obligation = sum(ledger.totals[0] for ledger in self.assets.values())
+        long_term_obligation = sum(ledger.totals[1] for ledger in self.assets.values())
+        fee_total = sum(ledger.totals[2] + ledger.buy_fees for ledger in self.assets.values())
+        return short_term_obligation, long_term_obligation, fee_total
+
+    # Returns the open lots in the basis_dict form, {asset: [(date, basis, size, trade_id)]}
+    def get_open_lots(self):
+        return {asset: ledger.lot_book.remaining()
+                for asset, ledger in self.assets.items() if ledger.lot_book is not None}
+
+    def print_report(self):
+        short_term_obligation, long_term_obligation, fee_total = self.get_totals()
+        sold_assets_with_no_basis = {}
+        for ledger in self.assets.values():
+            sold_assets_with_no_basis.update(ledger.no_basis)
+        leftovers = self.get_open_lots()
+        utils.print_report(short_term_obligation, long_term_obligation, fee_total, sold_assets_with_no_basis, leftovers)
+        validation = sum(ledger.audit.total for ledger in self.assets.values())
+        assert(int(validation) == int(short_term_obligation + long_term_obligation))
+
+    def save(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    # Returns the ledger saved at path, or a new one if there is none for this
+    # strategy (or the file is not a ledger)
+    @classmethod
+    def load(cls, path=INCREMENTAL_STATE_FILE, strategy='hifo', specific_lot_ids=None):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        try:
+            return cls(strategy, specific_lot_ids, path)
+        except (sqlite3.DatabaseError, pickle.UnpicklingError):
+            os.remove(path)
+            return cls(strategy, specific_lot_ids, path)
+
+
+# Incremental counterpart of process_trades: rows is the full trade history,
+# but only trades not seen by the previous run are matched.
+def process_trades_incremental(rows, strategy='hifo', specific_lot_ids=None, state_file=INCREMENTAL_STATE_FILE):
+    ledger = IncrementalLedger.load(state_file, strategy, specific_lot_ids)
+    try:
+        ledger.update(rows)
+        ledger.print_report()
+        ledger.save()
+        short_term_obligation, long_term_obligation, _ = ledger.get_totals()
+    finally:
+        ledger.close()
+    return short_term_obligation, long_term_obligation
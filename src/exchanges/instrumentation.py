@@ -0,0 +1,141 @@
+#!/usr/local/bin/python3
+
+import atexit
+import cProfile
+import functools
+import os
+import signal
+import threading
+import time
+
+
+# Per stage timers and counters, off unless TAX_CALCULATOR_INSTRUMENT=1 (or
+# enable() is called). When off, count() and timed functions return after one
+# flag check. TAX_CALCULATOR_PROFILE=<file> also profiles the whole run, once
+# an entry point calls enable_from_environment(): a .folded file gets sampled
+# stacks in flamegraph.pl's collapsed format, anything else a cProfile dump
+# (read it with pstats or snakeviz).
+ENABLED = os.environ.get('TAX_CALCULATOR_INSTRUMENT', '') not in ('', '0')
+PROFILE_FILE = os.environ.get('TAX_CALCULATOR_PROFILE')
+SAMPLE_INTERVAL_SECONDS = 0.001
+
+TIMERS = {}
+COUNTERS = {}
+LOCK = threading.Lock()
+PROFILER = None
+
+
+def count(name, amount=1):
+    if not ENABLED:
+        return
+    with LOCK:
+        COUNTERS[name] = COUNTERS.get(name, 0) + amount
+
+
+def add_time(name, seconds):
+    with LOCK:
+        calls, total = TIMERS.get(name, (0, 0,))
+        TIMERS[name] = (calls + 1, total + seconds,)
+
+
+# Decorator timing every call of a function under the given stage name
+def timed(name):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                add_time(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def reset():
+    with LOCK:
+        TIMERS.clear()
+        COUNTERS.clear()
+
+
+def print_summary():
+    if not ENABLED:
+        return
+    with LOCK:
+        timers = sorted(TIMERS.items(), key=lambda item: -item[1][1])
+        counters = sorted(COUNTERS.items())
+    print('=====================================')
+    print('{:<40}{:>10}{:>14}{:>14}'.format('stage', 'calls', 'seconds', 'ms/call'))
+    for name, (calls, seconds) in timers:
+        print('{:<40}{:>10}{:>14.4f}{:>14.4f}'.format(name, calls, seconds, seconds * 1000 / calls))
+    print('{:<40}{:>10}'.format('counter', 'value'))
+    for name, value in counters:
+        if isinstance(value, float):
+            print('{:<40}{:>10.3f}'.format(name, value))
+        else:
+            print('{:<40}{:>10}'.format(name, value))
+
+
+class StackSampler(object):
+    # Samples the main thread's stack on a CPU time interval timer (Unix
+    # only) and writes one "outer;...;inner count" line per distinct stack.
+
+    def __init__(self, interval=SAMPLE_INTERVAL_SECONDS):
+        self.interval = interval
+        self.stacks = {}
+
+    def sample(self, signum, frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append('{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+            frame = frame.f_back
+        stack = ';'.join(reversed(names))
+        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def enable(self):
+        signal.signal(signal.SIGPROF, self.sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def disable(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+
+    def dump_stats(self, filename):
+        with open(filename, 'w') as f:
+            for stack, samples in sorted(self.stacks.items()):
+                f.write('{} {}\n'.format(stack, samples))
+
+
+def start_profiler(filename):
+    global PROFILER
+    if PROFILER is not None:
+        return
+    PROFILER = StackSampler() if filename.endswith('.folded') else cProfile.Profile()
+    PROFILER.enable()
+    atexit.register(stop_profiler, filename)
+
+
+def stop_profiler(filename):
+    global PROFILER
+    if PROFILER is None:
+        return
+    PROFILER.disable()
+    PROFILER.dump_stats(filename)
+    PROFILER = None
+    print('Profile written to {}'.format(filename))
+
+
+def enable(profile_file=None):
+    global ENABLED
+    ENABLED = True
+    if profile_file:
+        start_profiler(profile_file)
+
+
+# Called by the entry points (not on import) to apply TAX_CALCULATOR_PROFILE
+def enable_from_environment():
+    if PROFILE_FILE:
+        enable(PROFILE_FILE)
@@ -1,8 +1,9 @@
 #!/usr/local/bin/python3
 
-import csv
 import datetime
-import utils
+import functools
+import src.exchanges.instrumentation as instrumentation
+import src.exchanges.utils as utils
 
 
 KRAKEN_TRADES_FILE = 'kraken_trades.csv'
@@ -10,35 +11,64 @@ KRAKEN_TRADES_CSV_FIELDS = ['txid', 'ordertxid', 'pair', 'time', 'type',
                             'ordertype', 'price', 'cost', 'fee', 'vol', 'margin', 'misc', 'ledgers']
 
 
+def parse_kraken_date(date_string):
+    try:
+        return datetime.datetime.fromisoformat(date_string)
+    except ValueError:
+        return datetime.datetime.strptime(date_string, "%Y-%m-%d %H:%M:%S.%f")
+
+
+@functools.lru_cache(maxsize=None)
+def parse_kraken_asset(pair):
+    asset = pair.split('USD')[0]
+    if asset.startswith('X'):
+        asset = asset[1:]
+    if asset.endswith('Z'):
+        asset = asset[:-1]
+    if asset == 'XBT':
+        asset = 'BTC'
+    return asset
+
+
+def get_kraken_row_date(row):
+    return parse_kraken_date(row[3])
+
+
+# Returns None for rows that are not USD trades
+def get_standard_trade(row, date):
+    asset = parse_kraken_asset(row[2])
+    if not asset:
+        return None
+    action = row[4].upper()
+    trading_fee = float(row[8])
+    if action == 'BUY':
+        total_dollars = float(row[7]) + trading_fee
+    else:
+        total_dollars = float(row[7]) - trading_fee
+    return ['KRAKEN:{}:{}'.format(row[0], row[1]), action, date,
+            float(row[9]), asset, trading_fee, total_dollars]
+
+
+@instrumentation.timed('kraken get_standard_trades')
 def get_standard_trades(filename=KRAKEN_TRADES_FILE):
     rows = []
-    with open(filename, 'r') as f:
-        reader = csv.reader(f)
-        assert next(reader) == KRAKEN_TRADES_CSV_FIELDS
-        for row in reader:
-            trade_id = 'KRAKEN:{}:{}'.format(row[0], row[1])
-            action = row[4].upper()
-            date = datetime.datetime.strptime(
-                row[3], "%Y-%m-%d %H:%M:%S.%f")
-            size = float(row[9])
-            asset = row[2].split('USD')[0]
-            if asset.startswith('X'):
-                asset = asset[1:]
-            if asset.endswith('Z'):
-                asset = asset[:-1]
-            if asset == 'XBT':
-                asset = 'BTC'
-            if not asset:
-                continue
-            trading_fee = float(row[8])
-            if action == 'BUY':
-                total_dollars = float(row[7]) + trading_fee
-            else:
-                total_dollars = float(row[7]) - trading_fee
-            rows.append([trade_id, action, date, size, asset, trading_fee, total_dollars])
+    for chunk in utils.read_csv_chunks(filename, KRAKEN_TRADES_CSV_FIELDS):
+        for row in chunk:
+            trade = get_standard_trade(row, parse_kraken_date(row[3]))
+            if trade:
+                rows.append(trade)
     return sorted(rows, key=lambda x: x[2])
 
 
+# Yields the same trades as get_standard_trades, oldest first, without loading the file
+def iter_standard_trades(filename=KRAKEN_TRADES_FILE):
+    for _, row, date in utils.iter_statement_rows(filename, KRAKEN_TRADES_CSV_FIELDS, get_kraken_row_date):
+        trade = get_standard_trade(row, date)
+        if trade:
+            yield trade
+
+
 if __name__ == '__main__':
+    instrumentation.enable_from_environment()
     rows = get_standard_trades()
     utils.process_trades(rows)
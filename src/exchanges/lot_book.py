@@ -0,0 +1,118 @@
+#!/usr/local/bin/python3
+
+import bisect
+import datetime
+
+
+# Consumed lots are dropped once they make up over half of a book this size
+COMPACT_MIN_LOTS = 1024
+EPOCH = datetime.datetime(1970, 1, 1)
+ONE_MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+def to_micros(date):
+    return (date - EPOCH) // ONE_MICROSECOND
+
+
+def from_micros(micros):
+    return EPOCH + datetime.timedelta(microseconds=micros)
+
+
+def lot_date(lot):
+    return lot[0]
+
+
+# Lots are kept sorted by date. New lots go after any lots with the same date,
+# so equal timestamps keep the order they were recorded in.
+def insert_lot(lots, lot):
+    bisect.insort_right(lots, lot, key=lot_date)
+
+
+# Number of lots acquired strictly before the given date, i.e. the cutoff
+# index of the lots a sale on that date may draw from.
+def count_lots_before(lots, date, lo=0):
+    return bisect.bisect_left(lots, date, lo=lo, key=lot_date)
+
+
+class LotBook(object):
+    # Open lots for a single asset. Lots are stored once, as mutable
+    # [date, basis, size, trade_id, seq] lists, in date order. Each cost basis
+    # strategy that draws from the book gets its own selector (see
+    # src/exchanges/cost_basis.py) over the lots dated before the latest sale
+    # it has seen, so picking the next lot is O(log n) and partial sales shrink
+    # the lot in place instead of copying the book.
+
+    def __init__(self, lots=()):
+        self.lots = []
+        for date, basis, size, trade_id in lots:
+            self.lots.append([date, basis, size, trade_id, len(self.lots)])
+        self.next_seq = len(self.lots)
+        self.selectors = {}
+        self.consumed = 0
+
+    def add(self, lot):
+        date, basis, size, trade_id = lot
+        self.insert([date, basis, size, trade_id, None])
+
+    # Stores a new lot record (anything laid out like [date, basis, size,
+    # trade_id, seq, ...]), numbering it after the lots recorded so far
+    def insert(self, new_lot):
+        new_lot[4] = self.next_seq
+        self.next_seq += 1
+        index = bisect.bisect_right(self.lots, new_lot[0], key=lot_date)
+        self.lots.insert(index, new_lot)
+        # A lot landing inside a selector's admitted prefix is eligible right away
+        for selector_state in self.selectors.values():
+            if index < selector_state[1]:
+                selector_state[0].push(new_lot)
+                selector_state[1] += 1
+
+    def admit(self, strategy, sale_date):
+        if strategy.name not in self.selectors:
+            self.selectors[strategy.name] = [strategy.new_selector(), 0]
+        selector_state = self.selectors[strategy.name]
+        selector, admitted = selector_state
+        cutoff = count_lots_before(self.lots, sale_date, lo=admitted)
+        for lot in self.lots[admitted:cutoff]:
+            if lot[2] > 0:
+                selector.push(lot)
+        selector_state[1] = max(admitted, cutoff)
+        return selector
+
+    # Yields (date, basis, entry_size, trade_id) for every lot used to cover
+    # the sale, consuming the lots as it goes. Only lots dated strictly
+    # before the sale are eligible.
+    def match(self, strategy, sale_size, sale_date, sale_trade_id=None):
+        selector = self.admit(strategy, sale_date)
+        try:
+            while sale_size > 0:
+                lot = selector.next_lot(sale_date, sale_trade_id)
+                if lot is None:
+                    break
+                date, basis, size, trade_id = lot[:4]
+                if size >= sale_size:
+                    yield date, basis, sale_size, trade_id
+                    lot[2] = size - sale_size
+                    if lot[2] <= 0:
+                        self.consumed += 1
+                    sale_size = 0
+                else:
+                    yield date, basis, size, trade_id
+                    lot[2] = 0
+                    self.consumed += 1
+                    sale_size -= size
+        finally:
+            selector.end_sale()
+            if self.consumed >= COMPACT_MIN_LOTS and self.consumed * 2 > len(self.lots):
+                self.compact()
+
+    # Drops fully consumed lots from the book and every selector
+    def compact(self):
+        for selector_state in self.selectors.values():
+            selector_state[1] = sum(1 for lot in self.lots[:selector_state[1]] if lot[2] > 0)
+            selector_state[0].compact()
+        self.lots = [lot for lot in self.lots if lot[2] > 0]
+        self.consumed = 0
+
+    def remaining(self):
+        return [(date, basis, size, trade_id,) for date, basis, size, trade_id, _ in self.lots if size > 0]
@@ -0,0 +1,181 @@
+#!/usr/local/bin/python3
+
+import argparse
+import array
+import bisect
+import csv
+import mmap
+import os
+import src.exchanges.price_cache as price_cache
+import struct
+import sys
+import threading
+
+
+# Offline candles imported from bulk OHLC files (e.g. Binance's monthly 1m
+# kline dumps from data.binance.vision, or any timestamp,open,high,low,close
+# CSV), checked by the price lookups before any API. One file per symbol:
+#   magic, int64 candle count, int64 interval (seconds),
+#   int64 open times (epoch seconds, sorted), float64 opens, highs, lows, closes
+# Files are memory-mapped, so a lookup is a binary search over the mapped
+# timestamps with no parsing. Import with
+#   PYTHONPATH=. python src/exchanges/ohlc_store.py BTC BTCUSDT-1m-2020-12.csv ...
+OHLC_STORE_DIR = os.environ.get('TAX_CALCULATOR_OHLC_DIR', os.path.join(price_cache.PRICE_CACHE_DIR, 'ohlc'))
+OHLC_MAGIC = b'OHLCSTO1'
+OHLC_HEADER = struct.Struct('<8sqq')
+OHLC_STORE = None
+OHLC_STORE_LOCK = threading.Lock()
+
+
+def get_symbol_file(directory, symbol):
+    return os.path.join(directory, '{}.ohlc'.format(symbol.upper()))
+
+
+# Binance dumps use milliseconds (microseconds since 2025), others seconds
+def to_epoch_seconds(timestamp):
+    while timestamp >= 10 ** 11:
+        timestamp //= 1000
+    return timestamp
+
+
+# Yields (open time, open, high, low, close) from a CSV with or without a header
+def read_ohlc_csv(filename):
+    with open(filename, newline='') as f:
+        for row in csv.reader(f):
+            if not row or not row[0].strip().isdigit():
+                continue
+            yield (to_epoch_seconds(int(row[0])), float(row[1]), float(row[2]), float(row[3]), float(row[4]),)
+
+
+class OhlcSeries(object):
+    # One symbol's mapped file. timestamps and the price columns are
+    # memoryviews over the mapping, indexed like lists.
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, self.interval = OHLC_HEADER.unpack_from(self.mmap)
+        if magic != OHLC_MAGIC:
+            raise ValueError('{} is not an OHLC store file'.format(path))
+        view = memoryview(self.mmap)
+        columns = []
+        for i in range(5):
+            start = OHLC_HEADER.size + i * count * 8
+            columns.append(view[start:start + count * 8].cast('q' if i == 0 else 'd'))
+        self.timestamps, self.opens, self.highs, self.lows, self.closes = columns
+
+    # Returns (open, high, low, close) of the candle covering timestamp, or None
+    def get_candle(self, timestamp):
+        i = bisect.bisect_right(self.timestamps, timestamp) - 1
+        if i < 0 or timestamp >= self.timestamps[i] + self.interval:
+            return None
+        return self.opens[i], self.highs[i], self.lows[i], self.closes[i]
+
+    # Returns the open of the first candle in [start, end), or None
+    def get_first_open(self, start, end):
+        i = bisect.bisect_left(self.timestamps, start)
+        if i == len(self.timestamps) or self.timestamps[i] >= end:
+            return None
+        return self.opens[i]
+
+    # Returns every (open time, open, high, low, close)
+    def read_all(self):
+        return list(zip(self.timestamps, self.opens, self.highs, self.lows, self.closes))
+
+    def close(self):
+        for column in [self.timestamps, self.opens, self.highs, self.lows, self.closes]:
+            column.release()
+        self.mmap.close()
+
+
+class OhlcStore(object):
+    # Symbols without a file are remembered as missing, so runs without a
+    # store pay one os.path.exists per symbol.
+
+    def __init__(self, directory=OHLC_STORE_DIR):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def get_series(self, symbol):
+        symbol = symbol.upper()
+        if symbol not in self.series:
+            with self.lock:
+                if symbol not in self.series:
+                    path = get_symbol_file(self.directory, symbol)
+                    self.series[symbol] = OhlcSeries(path) if os.path.exists(path) else None
+        return self.series[symbol]
+
+    # Returns (open, high, low, close) of the symbol's candle covering timestamp,
+    # only from candles at most max_interval seconds long
+    def get_candle(self, symbol, timestamp, max_interval=price_cache.MINUTE):
+        series = self.get_series(symbol)
+        if series is None or series.interval > max_interval:
+            return None
+        return series.get_candle(timestamp)
+
+    # Returns the symbol's price at the start of the day (its first open that day)
+    def get_day_price(self, symbol, day_start):
+        series = self.get_series(symbol)
+        if series is None:
+            return None
+        return series.get_first_open(day_start, day_start + price_cache.DAY)
+
+    # Adds candles ((open time, open, high, low, close) tuples) to the symbol's
+    # file, replacing candles with the same open time. interval defaults to
+    # the smallest gap between candles. Returns the number of candles stored.
+    def import_candles(self, symbol, candles, interval=None):
+        symbol = symbol.upper()
+        path = get_symbol_file(self.directory, symbol)
+        with self.lock:
+            merged = {}
+            series = self.series.pop(symbol, None) or (OhlcSeries(path) if os.path.exists(path) else None)
+            if series is not None:
+                interval = interval or series.interval
+                for candle in series.read_all():
+                    merged[candle[0]] = candle
+                series.close()
+            for candle in candles:
+                merged[candle[0]] = candle
+            timestamps = sorted(merged)
+            if interval is None:
+                gaps = [b - a for a, b in zip(timestamps, timestamps[1:])]
+                interval = min(gaps) if gaps else price_cache.MINUTE
+            os.makedirs(self.directory, exist_ok=True)
+            temp_file = '{}.{}.tmp'.format(path, os.getpid())
+            with open(temp_file, 'wb') as f:
+                f.write(OHLC_HEADER.pack(OHLC_MAGIC, len(timestamps), interval))
+                array.array('q', timestamps).tofile(f)
+                for column in range(1, 5):
+                    array.array('d', [merged[timestamp][column] for timestamp in timestamps]).tofile(f)
+            os.replace(temp_file, path)
+        return len(timestamps)
+
+    def import_files(self, symbol, filenames, interval=None):
+        candles = []
+        for filename in filenames:
+            candles.extend(read_ohlc_csv(filename))
+        return self.import_candles(symbol, candles, interval)
+
+
+def get_ohlc_store():
+    global OHLC_STORE
+    with OHLC_STORE_LOCK:
+        if OHLC_STORE is None:
+            OHLC_STORE = OhlcStore(OHLC_STORE_DIR)
+        return OHLC_STORE
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Import bulk OHLC CSVs into the offline price store.')
+    parser.add_argument('symbol', help='e.g. BTC for BTCUSDT klines')
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--interval', type=int, help='candle length in seconds (default: smallest gap)')
+    args = parser.parse_args(argv)
+    count = get_ohlc_store().import_files(args.symbol, args.files, args.interval)
+    print('{} candles stored in {}'.format(count, get_symbol_file(OHLC_STORE_DIR, args.symbol)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
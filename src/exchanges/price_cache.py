@@ -0,0 +1,120 @@
+#!/usr/local/bin/python3
+
+import atexit
+import os
+import src.exchanges.instrumentation as instrumentation
+import sqlite3
+import threading
+import time
+
+
+# Historical prices never change, so they are kept across runs in a SQLite file
+# under the cache dir (relative to the base dir, like the CSV files).
+PRICE_CACHE_DIR = os.environ.get('TAX_CALCULATOR_CACHE_DIR', '.tax_calculator_cache')
+PRICE_CACHE_FILE = 'prices.sqlite3'
+PRICE_CACHE_MAX_ENTRIES = int(os.environ.get('TAX_CALCULATOR_PRICE_CACHE_MAX_ENTRIES', 5000000))
+PRICE_CACHE = None
+PRICE_CACHE_LOCK = threading.Lock()
+
+# Sources and their bucket sizes (in seconds)
+BINANCE_KLINES = 'binance'
+COINGECKO_HISTORY = 'coingecko'
+MINUTE = 60
+DAY = 24 * 60 * 60
+
+
+class PriceCache(object):
+    # Prices are keyed by (source, symbol, bucket, use_max) where bucket is the
+    # epoch second the price's candle/day starts at. Once the cache holds more
+    # than max_entries, the least recently used tenth is evicted.
+
+    def __init__(self, path, max_entries=PRICE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.touched = []
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS prices ('
+            'source TEXT, symbol TEXT, bucket INTEGER, use_max INTEGER, price REAL, last_used INTEGER, '
+            'PRIMARY KEY (source, symbol, bucket, use_max))')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS prices_last_used ON prices (last_used)')
+        self.connection.commit()
+        self.size = self.connection.execute('SELECT COUNT(*) FROM prices').fetchone()[0]
+
+    def get(self, source, symbol, bucket, use_max=True):
+        return self.get_many([(source, symbol, bucket, use_max,)]).get((source, symbol, bucket, use_max,))
+
+    # Returns {(source, symbol, bucket, use_max): price} for the keys found
+    def get_many(self, keys):
+        found = {}
+        with self.lock:
+            for key in keys:
+                source, symbol, bucket, use_max = key
+                row = self.connection.execute(
+                    'SELECT price FROM prices WHERE source = ? AND symbol = ? AND bucket = ? AND use_max = ?',
+                    (source, symbol, bucket, int(use_max),)).fetchone()
+                if row is not None:
+                    found[key] = row[0]
+                    self.touched.append((source, symbol, bucket, int(use_max),))
+            if len(self.touched) > 10000:
+                self.flush_touched()
+        instrumentation.count('price cache hits', len(found))
+        instrumentation.count('price cache misses', len(keys) - len(found))
+        return found
+
+    # Returns {(bucket, use_max): price} for every cached bucket in [start, end]
+    def get_range(self, source, symbol, start, end):
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT bucket, use_max, price FROM prices WHERE source = ? AND symbol = ? AND bucket BETWEEN ? AND ?',
+                (source, symbol, start, end,)).fetchall()
+        return {(bucket, bool(use_max),): price for bucket, use_max, price in rows}
+
+    def put(self, source, symbol, bucket, use_max, price):
+        self.put_many([(source, symbol, bucket, use_max, price,)])
+
+    # entries are (source, symbol, bucket, use_max, price) tuples
+    def put_many(self, entries):
+        now = int(time.time())
+        with self.lock:
+            before = self.connection.total_changes
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO prices VALUES (?, ?, ?, ?, ?, ?)',
+                [(source, symbol, bucket, int(use_max), price, now,)
+                 for source, symbol, bucket, use_max, price in entries])
+            self.size += self.connection.total_changes - before
+            if self.size > self.max_entries:
+                self.evict()
+            self.connection.commit()
+
+    def flush_touched(self):
+        now = int(time.time())
+        self.connection.executemany(
+            'UPDATE prices SET last_used = ? WHERE source = ? AND symbol = ? AND bucket = ? AND use_max = ?',
+            [(now,) + key for key in self.touched])
+        self.connection.commit()
+        self.touched = []
+
+    def evict(self):
+        self.flush_touched()
+        excess = self.size - self.max_entries * 9 // 10
+        self.connection.execute(
+            'DELETE FROM prices WHERE rowid IN (SELECT rowid FROM prices ORDER BY last_used LIMIT ?)', (excess,))
+        self.size = self.connection.execute('SELECT COUNT(*) FROM prices').fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.flush_touched()
+            self.connection.close()
+
+
+def get_price_cache():
+    global PRICE_CACHE
+    with PRICE_CACHE_LOCK:
+        if PRICE_CACHE is None:
+            os.makedirs(PRICE_CACHE_DIR, exist_ok=True)
+            PRICE_CACHE = PriceCache(os.path.join(PRICE_CACHE_DIR, PRICE_CACHE_FILE))
+            atexit.register(PRICE_CACHE.close)
+        return PRICE_CACHE
@@ -0,0 +1,73 @@
+#!/usr/local/bin/python3
+
+import concurrent.futures
+import src.exchanges.instrumentation as instrumentation
+import src.exchanges.price_cache as price_cache
+import threading
+
+
+# Bucket size (in seconds) of each price source, a price is the same for
+# every moment of its bucket
+BUCKET_SECONDS = {
+    price_cache.BINANCE_KLINES: price_cache.MINUTE,
+    price_cache.COINGECKO_HISTORY: price_cache.DAY,
+}
+
+
+def get_bucket(source, timestamp):
+    return timestamp - timestamp % BUCKET_SECONDS[source]
+
+
+class PriceService(object):
+    # Coalesces price lookups: the first lookup of a (source, symbol, bucket)
+    # runs its fetch, concurrent lookups of the same key wait on that fetch
+    # and later ones reuse its result. So the reference leg, the fee leg and
+    # the auxiliary trades of a minute (or a day of transfers) cost one fetch.
+    # A failed fetch is forgotten, so the next lookup retries it.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.futures = {}
+        self.lookups = 0
+        self.fetches = 0
+
+    # fetch is called without arguments and returns the bucket's price(s)
+    def get(self, source, symbol, bucket, fetch):
+        key = (source, symbol, bucket,)
+        with self.lock:
+            self.lookups += 1
+            future = self.futures.get(key)
+            owner = future is None
+            if owner:
+                future = concurrent.futures.Future()
+                self.futures[key] = future
+                self.fetches += 1
+        if not owner:
+            instrumentation.count('price fetches saved')
+            return future.result()
+        try:
+            value = fetch()
+        except BaseException as e:
+            with self.lock:
+                del self.futures[key]
+            future.set_exception(e)
+            raise
+        future.set_result(value)
+        return value
+
+    @property
+    def saved(self):
+        return self.lookups - self.fetches
+
+    def clear(self):
+        with self.lock:
+            self.futures = {}
+            self.lookups = 0
+            self.fetches = 0
+
+    def print_summary(self):
+        if self.lookups:
+            print('Price lookups: {}, fetches: {}, saved: {}'.format(self.lookups, self.fetches, self.saved))
+
+
+PRICE_SERVICE = PriceService()
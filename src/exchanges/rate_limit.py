@@ -0,0 +1,47 @@
+#!/usr/local/bin/python3
+
+import threading
+import time
+import urllib.parse
+
+
+class TokenBucket(object):
+    # Allows `rate` requests per second on average, with bursts of up to
+    # `capacity` requests. Safe to share between threads.
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    # Blocks until a request may be made, returns the number of seconds waited
+    def acquire(self):
+        waited = 0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+# Free tier quotas of the APIs we call, per host
+RATE_LIMITS = {
+    'api.etherscan.io': TokenBucket(5, capacity=5),  # 5 calls/second
+    'api.coingecko.com': TokenBucket(50 / 60),  # 50 calls/minute
+    'api.binance.com': TokenBucket(20, capacity=20),  # 1200 request weight/minute
+}
+
+
+def acquire(url):
+    host = urllib.parse.urlsplit(url).hostname
+    if host not in RATE_LIMITS:
+        return 0
+    return RATE_LIMITS[host].acquire()
@@ -0,0 +1,181 @@
+#!/usr/local/bin/python3
+
+import datetime
+import hashlib
+import json
+import os
+import src.exchanges.price_cache as price_cache
+import src.exchanges.utils as utils
+
+
+# End of year lot books, so a year only needs its own CSVs plus the previous
+# year's snapshot. Each snapshot records a content hash of its CSVs, the
+# strategy and the previous year's hash; when any of those changed the
+# snapshot is stale. The CSVs' (size, mtime) signatures are kept next to
+# their hashes, so a CSV is only hashed again when it changed. Loading trusts
+# the previous year's stored hash instead of re-checking the whole chain:
+# load or build the years oldest first (load_or_build_snapshot) and a changed
+# year gets a new hash, which makes every later year stale in turn.
+SNAPSHOT_DIR = os.path.join(price_cache.PRICE_CACHE_DIR, 'snapshots')
+SNAPSHOT_VERSION = 2
+HASH_CHUNK_BYTES = 1024 * 1024
+
+
+class StaleSnapshotError(Exception):
+    pass
+
+
+def get_snapshot_file(name, year):
+    return os.path.join(SNAPSHOT_DIR, '{}_{}.json'.format(name, year))
+
+
+def hash_file(filename):
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        while True:
+            chunk = f.read(HASH_CHUNK_BYTES)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_source_signature(filename):
+    stat = os.stat(filename)
+    return '{}:{}'.format(stat.st_size, stat.st_mtime_ns)
+
+
+# Returns a [filename, signature, hash] list per source file. Files whose
+# signature is the one recorded in known (the same kind of lists) keep their
+# recorded hash instead of being read again.
+def get_source_hashes(source_files, known=()):
+    known = {filename: (signature, file_hash,) for filename, signature, file_hash in known}
+    source_hashes = []
+    for filename in source_files:
+        signature = get_source_signature(filename)
+        if filename in known and known[filename][0] == signature:
+            file_hash = known[filename][1]
+        else:
+            file_hash = hash_file(filename)
+        source_hashes.append([filename, signature, file_hash])
+    return source_hashes
+
+
+def get_content_hash(source_hashes, strategy, previous_hash):
+    digest = hashlib.sha256()
+    digest.update(json.dumps([SNAPSHOT_VERSION, strategy, previous_hash]).encode())
+    for _, _, file_hash in source_hashes:
+        digest.update(file_hash.encode())
+    return digest.hexdigest()
+
+
+def dump_lots(lots_by_asset):
+    return {asset: [[date.isoformat(), basis, size, trade_id] for date, basis, size, trade_id in lots]
+            for asset, lots in lots_by_asset.items()}
+
+
+def parse_lots(lots_by_asset):
+    return {asset: [(datetime.datetime.fromisoformat(date), basis, size, trade_id,) for date, basis, size, trade_id in lots]
+            for asset, lots in lots_by_asset.items()}
+
+
+class YearSnapshot(object):
+    # Pass as process_trades(..., year_snapshot=...) to save the year's
+    # leftover lots and unmatched sells once its trades are processed.
+    # source_files are the CSVs the year's trades were read from.
+
+    def __init__(self, path, source_files, previous_path=None):
+        self.path = path
+        self.source_files = list(source_files)
+        self.previous_path = previous_path
+        self.previous_hash = None
+
+    # Raises StaleSnapshotError if the previous year's snapshot is stale, so
+    # process_trades fails before doing the year's work rather than after
+    def check_previous(self):
+        if self.previous_path:
+            self.previous_hash = validate_snapshot(self.previous_path)['content_hash']
+
+    def write(self, strategy, basis_dict, sold_assets_with_no_basis):
+        if self.previous_path and self.previous_hash is None:
+            self.check_previous()
+        source_hashes = get_source_hashes(self.source_files)
+        snapshot = {
+            'version': SNAPSHOT_VERSION,
+            'content_hash': get_content_hash(source_hashes, strategy, self.previous_hash),
+            'previous_path': self.previous_path,
+            'previous_hash': self.previous_hash,
+            'source_files': source_hashes,
+            'strategy': strategy,
+            'basis_dict': dump_lots(basis_dict),
+            'sold_assets_with_no_basis': dump_lots(sold_assets_with_no_basis),
+        }
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        temp_file = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(temp_file, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(temp_file, self.path)
+
+
+def read_snapshot(path):
+    try:
+        with open(path) as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        raise StaleSnapshotError('no snapshot at {}'.format(path))
+    if snapshot.get('version') != SNAPSHOT_VERSION:
+        raise StaleSnapshotError('{} was written by another version'.format(path))
+    return snapshot
+
+
+# Returns the snapshot as stored, raises StaleSnapshotError if it is missing,
+# out of date with its CSVs or the previous year's snapshot changed since
+def validate_snapshot(path):
+    snapshot = read_snapshot(path)
+    previous_hash = None
+    if snapshot['previous_path']:
+        previous_hash = read_snapshot(snapshot['previous_path'])['content_hash']
+    if previous_hash != snapshot['previous_hash']:
+        raise StaleSnapshotError('{} is out of date with {}'.format(path, snapshot['previous_path']))
+    try:
+        source_hashes = get_source_hashes([source[0] for source in snapshot['source_files']], snapshot['source_files'])
+    except OSError:
+        raise StaleSnapshotError('the source files of {} are missing'.format(path))
+    if get_content_hash(source_hashes, snapshot['strategy'], previous_hash) != snapshot['content_hash']:
+        raise StaleSnapshotError('{} is out of date with its source files'.format(path))
+    return snapshot
+
+
+# Returns the snapshot with its basis_dict and sold_assets_with_no_basis in the
+# usual (date, basis, size, trade_id) form. Raises StaleSnapshotError if it is
+# stale (see validate_snapshot).
+def load_snapshot(path):
+    snapshot = validate_snapshot(path)
+    snapshot['basis_dict'] = parse_lots(snapshot['basis_dict'])
+    snapshot['sold_assets_with_no_basis'] = parse_lots(snapshot['sold_assets_with_no_basis'])
+    return snapshot
+
+
+# Loads the snapshot, or rebuilds it by running process_trades over get_rows()
+# if it is stale. Returns the loaded snapshot. A stale previous year raises
+# StaleSnapshotError before any trade is processed; rebuild it first.
+def load_or_build_snapshot(path, source_files, get_rows, strategy='hifo', previous_path=None):
+    try:
+        return load_snapshot(path)
+    except StaleSnapshotError:
+        pass
+    year_snapshot = YearSnapshot(path, source_files, previous_path)
+    year_snapshot.check_previous()
+    utils.process_trades(get_rows(), strategy, year_snapshot=year_snapshot)
+    return load_snapshot(path)
+
+
+# The snapshot's leftover lots as 0 fee BUY trades to seed the next year with
+def get_carryforward_trades(snapshot):
+    previous_year_buys = []
+    for asset, basis_info in snapshot['basis_dict'].items():
+        for date, basis, size, trade_id in basis_info:
+            previous_year_buys.append(
+                [trade_id, 'BUY', date, size, asset, 0, basis * size]  # 0 fee for the previous year
+            )
+    return previous_year_buys
@@ -0,0 +1,106 @@
+#!/usr/local/bin/python3
+
+import array
+import datetime
+
+from src.exchanges.lot_book import EPOCH, to_micros
+
+
+ACTIONS = ['BUY', 'SELL', 'BURN']
+ACTION_CODES = {action: code for code, action in enumerate(ACTIONS)}
+
+
+class TradeTable(object):
+    # Standard trades stored column by column instead of as 7-element lists:
+    # int64 epoch microseconds, float64 sizes/fees/dollars, interned asset and
+    # action codes, and trade IDs packed into one bytearray. Iterating yields
+    # the usual [trade_id, action, date, size, asset, fee, net_fiat] rows, so
+    # process_buys, process_sells and process_trades accept it as is.
+
+    def __init__(self):
+        self.trade_id_bytes = bytearray()
+        self.trade_id_ends = array.array('Q')
+        self.actions = array.array('b')
+        self.timestamps = array.array('q')
+        self.sizes = array.array('d')
+        self.assets = array.array('I')
+        self.fees = array.array('d')
+        self.net_fiat = array.array('d')
+        self.asset_names = []
+        self.asset_codes = {}
+
+    @classmethod
+    def from_rows(cls, rows):
+        table = cls()
+        for row in rows:
+            table.append(row)
+        return table
+
+    def append(self, row):
+        trade_id, action, date, size, asset, fee, net_fiat = row
+        if asset not in self.asset_codes:
+            self.asset_codes[asset] = len(self.asset_names)
+            self.asset_names.append(asset)
+        self.trade_id_bytes += trade_id.encode()
+        self.trade_id_ends.append(len(self.trade_id_bytes))
+        self.actions.append(ACTION_CODES[action])
+        self.timestamps.append(to_micros(date))
+        self.sizes.append(size)
+        self.assets.append(self.asset_codes[asset])
+        self.fees.append(fee)
+        self.net_fiat.append(net_fiat)
+
+    def __len__(self):
+        return len(self.actions)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        start = self.trade_id_ends[i - 1] if i > 0 else 0
+        return [
+            self.trade_id_bytes[start:self.trade_id_ends[i]].decode(),
+            ACTIONS[self.actions[i]],
+            EPOCH + datetime.timedelta(microseconds=self.timestamps[i]),
+            self.sizes[i],
+            self.asset_names[self.assets[i]],
+            self.fees[i],
+            self.net_fiat[i],
+        ]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    # Returns a new table with the given rows, in the given order
+    def take(self, indices):
+        table = TradeTable()
+        table.asset_names = list(self.asset_names)
+        table.asset_codes = dict(self.asset_codes)
+        for i in indices:
+            start = self.trade_id_ends[i - 1] if i > 0 else 0
+            table.trade_id_bytes += self.trade_id_bytes[start:self.trade_id_ends[i]]
+            table.trade_id_ends.append(len(table.trade_id_bytes))
+            table.actions.append(self.actions[i])
+            table.timestamps.append(self.timestamps[i])
+            table.sizes.append(self.sizes[i])
+            table.assets.append(self.assets[i])
+            table.fees.append(self.fees[i])
+            table.net_fiat.append(self.net_fiat[i])
+        return table
+
+    def sorted_by_date(self):
+        return self.take(sorted(range(len(self)), key=self.timestamps.__getitem__))
+
+    def split_buys_and_sells(self):
+        buy = ACTION_CODES['BUY']
+        return (self.take(i for i, action in enumerate(self.actions) if action == buy),
+                self.take(i for i, action in enumerate(self.actions) if action != buy),)
+
+    # Returns {asset: TradeTable} with each asset's rows in order
+    def group_by_asset(self):
+        indices_by_asset = {}
+        for i, asset in enumerate(self.assets):
+            if asset not in indices_by_asset:
+                indices_by_asset[asset] = []
+            indices_by_asset[asset].append(i)
+        return {self.asset_names[asset]: self.take(indices) for asset, indices in indices_by_asset.items()}
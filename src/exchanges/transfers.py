@@ -0,0 +1,153 @@
+#!/usr/local/bin/python3
+
+import bisect
+import datetime
+import src.exchanges.instrumentation as instrumentation
+
+from src.exchanges.audit import LotMatch
+from src.exchanges.utils import TradeStream, calculate_obligation, record_sale
+
+
+# Transfers are standard rows whose action is DEPOSIT or WITHDRAWAL:
+#   [transfer_id, action, date, size, asset, fee, net_fiat]
+# A withdrawal from one venue pairs with a deposit of the same asset on another
+# venue at most TRANSFER_WINDOW later, whose size is within TRANSFER_TOLERANCE
+# (relative) of the withdrawn size; the difference is the network fee, burnt
+# from the moved lots.
+TRANSFER_WINDOW = datetime.timedelta(days=3)
+TRANSFER_TOLERANCE = 0.02
+
+
+def transfer_date(entry):
+    return entry[0]
+
+
+# transfers_by_venue maps a venue name (e.g. a cli source) to its transfers.
+# Deposits are indexed per asset by date, so each withdrawal bisects to the
+# deposits inside its window instead of scanning every deposit. Withdrawals
+# are paired oldest first, each with the earliest unpaired deposit that fits.
+# Returns [(withdrawal venue, withdrawal, deposit venue, deposit)]
+@instrumentation.timed('match_transfers')
+def match_transfers(transfers_by_venue, window=TRANSFER_WINDOW, tolerance=TRANSFER_TOLERANCE):
+    deposits_by_asset = {}
+    withdrawals = []
+    for venue, transfers in transfers_by_venue.items():
+        for transfer in transfers:
+            if transfer[1] == 'DEPOSIT':
+                asset = transfer[4].upper()
+                if asset not in deposits_by_asset:
+                    deposits_by_asset[asset] = []
+                deposits_by_asset[asset].append((transfer[2], venue, transfer,))
+            elif transfer[1] == 'WITHDRAWAL':
+                withdrawals.append((transfer[2], venue, transfer,))
+            else:
+                raise ValueError('transfer {} is neither a DEPOSIT nor a WITHDRAWAL'.format(transfer[0]))
+    for deposits in deposits_by_asset.values():
+        deposits.sort(key=transfer_date)
+    paired = set()
+    pairs = []
+    for date, venue, withdrawal in sorted(withdrawals, key=transfer_date):
+        if withdrawal[3] <= 0:
+            continue
+        asset = withdrawal[4].upper()
+        deposits = deposits_by_asset.get(asset, [])
+        start = bisect.bisect_left(deposits, date, key=transfer_date)
+        end = bisect.bisect_right(deposits, date + window, key=transfer_date)
+        for i in range(start, end):
+            _, deposit_venue, deposit = deposits[i]
+            if (asset, i,) in paired or deposit_venue == venue:
+                continue
+            if abs(deposit[3] - withdrawal[3]) <= tolerance * withdrawal[3]:
+                paired.add((asset, i,))
+                pairs.append((venue, withdrawal, deposit_venue, deposit,))
+                break
+    instrumentation.count('transfers matched', len(pairs))
+    return pairs
+
+
+class VenueTradeStream(TradeStream):
+    # Lot books are keyed by (venue, asset). deposits maps id() of each paired
+    # withdrawal to its deposit; the lots a withdrawal takes wait in in_transit
+    # until the deposit.
+
+    def __init__(self, deposits, strategy='hifo', specific_lot_ids=None, audit=None):
+        super().__init__(strategy, specific_lot_ids, audit)
+        self.deposits = deposits
+        self.in_transit = {}
+
+    def add_transfer(self, key, row):
+        trade_id, action, date, size, asset, fee, net_fiat = row
+        if action == 'WITHDRAWAL':
+            deposit = self.deposits[id(row)]
+            moved = list(self.lot_books[key].match(self.strategy, size, date, trade_id)) if key in self.lot_books else []
+            ratio = min(1.0, deposit[3] / size)
+            self.in_transit[id(deposit)] = (moved, ratio,)
+            self.burn_network_fee(row, moved, ratio)
+        elif action == 'DEPOSIT':
+            moved, ratio = self.in_transit.pop(id(row))
+            lot_book = self.get_lot_book(key)
+            for lot_date, basis, lot_size, lot_trade_id in moved:
+                lot_book.add((lot_date, basis, lot_size * ratio, lot_trade_id,))
+        else:
+            super().add_transfer(key, row)
+
+    # The units a transfer loses to the network fee leave every moved lot in
+    # proportion, as a BURN at the withdrawal (valued at the withdrawal's
+    # net_fiat), so their basis shows up in the audit instead of vanishing.
+    def burn_network_fee(self, withdrawal, moved, ratio):
+        trade_id, action, date, size, asset, fee, net_fiat = withdrawal
+        exit_basis = net_fiat / size
+        matches = []
+        for lot_date, basis, lot_size, lot_trade_id in moved:
+            burned = lot_size - lot_size * ratio
+            if burned > 0:
+                obligation, _ = calculate_obligation(basis, exit_basis, burned, burned, lot_date, date)
+                matches.append(LotMatch(lot_date, basis, burned, lot_trade_id, date, exit_basis, burned, trade_id,
+                                        obligation))
+        if matches:
+            burned = sum(match.entry_size for match in matches)
+            burn = [trade_id, 'BURN', date, burned, asset, 0, burned * exit_basis]
+            record_sale(burn, (0, 0, 0, matches,), self.totals, self.audit, self.sold_assets_with_no_basis)
+
+    def get_leftovers(self):
+        leftovers = {}
+        for (venue, asset), lot_book in self.lot_books.items():
+            if asset not in leftovers:
+                leftovers[asset] = []
+            leftovers[asset] += lot_book.remaining()
+        return leftovers
+
+
+# Like utils.process_trade_stream, but every venue keeps its own lot book per
+# asset and sales only draw from the lots of the venue they happened on.
+# trades_by_venue maps a venue name to its date-sorted trades, transfers_by_venue
+# to its deposits and withdrawals. At a paired withdrawal the strategy picks
+# the lots to move (specific_lot_ids may name them by the withdrawal's ID); they
+# reach the destination's book at the deposit, keeping their original dates and
+# bases, scaled down to the deposited size; the rest is burnt at the withdrawal
+# (see burn_network_fee). Unpaired transfers move no lots.
+def process_venue_trades(trades_by_venue, transfers_by_venue, strategy='hifo', specific_lot_ids=None, audit=None,
+                         window=TRANSFER_WINDOW, tolerance=TRANSFER_TOLERANCE):
+    pairs = match_transfers(transfers_by_venue, window, tolerance)
+
+    # Trades sort before transfers of the same date, otherwise the (stable)
+    # sort keeps every venue's own order
+    events = []
+    for venue, trades in trades_by_venue.items():
+        for trade in trades:
+            events.append((trade[2], 0, venue, trade,))
+    deposits = {}
+    for withdrawal_venue, withdrawal, deposit_venue, deposit in pairs:
+        events.append((withdrawal[2], 1, withdrawal_venue, withdrawal,))
+        events.append((deposit[2], 1, deposit_venue, deposit,))
+        deposits[id(withdrawal)] = deposit
+    events.sort(key=lambda event: event[:2])
+
+    stream = VenueTradeStream(deposits, strategy, specific_lot_ids, audit)
+    for _, _, venue, row in events:
+        stream.add(row, (venue, row[4],))
+
+    num_withdrawals = sum(1 for transfers in transfers_by_venue.values()
+                          for transfer in transfers if transfer[1] == 'WITHDRAWAL')
+    print('Matched {} of {} withdrawals to deposits'.format(len(pairs), num_withdrawals))
+    return stream.finish()
@@ -1,9 +1,18 @@
 #!/usr/local/bin/python3
 
-import copy
+import concurrent.futures
+import csv
 import datetime
-import requests
-import time
+import heapq
+import os
+import src.exchanges.http_archive as http_archive
+import src.exchanges.http_client as http_client
+import src.exchanges.instrumentation as instrumentation
+
+from src.exchanges.audit import AuditList, AuditRecord, AuditSink, LotMatch
+from src.exchanges.cost_basis import COST_BASIS_STRATEGIES, LOFO, get_strategy
+from src.exchanges.lot_book import LotBook, insert_lot
+from src.exchanges.trade_table import TradeTable
 
 
 # Date should be standardized in UTC
@@ -11,21 +20,99 @@ STANDARD_CSV_FIELDS = ['trade id', 'action', 'date', 'size', 'asset', 'trading_f
 REBRANDED_TOKENS = {
     'LEND': 'AAVE',
 }
+CSV_CHUNK_BYTES = 16 * 1024 * 1024
 
 
+# Reads a statement in large chunks of lines and yields each chunk's parsed rows.
+# Exchange statements have no quoted newlines, so chunks can split on any line.
+def read_csv_chunks(filename, expected_fields, chunk_bytes=CSV_CHUNK_BYTES):
+    with open(filename, 'r') as f:
+        assert next(csv.reader([f.readline()])) == expected_fields
+        while True:
+            lines = f.readlines(chunk_bytes)
+            if not lines:
+                break
+            rows = list(csv.reader(lines))
+            instrumentation.count('rows parsed', len(rows))
+            yield rows
+
+
+# Yields the lines of a file last to first, reading it backwards in blocks
+def read_lines_reversed(filename, block_bytes=CSV_CHUNK_BYTES):
+    with open(filename, 'rb') as f:
+        position = f.seek(0, os.SEEK_END)
+        tail = b''
+        while position > 0:
+            size = min(block_bytes, position)
+            position -= size
+            f.seek(position)
+            lines = (f.read(size) + tail).split(b'\n')
+            tail = lines[0]
+            for line in reversed(lines[1:]):
+                yield line.decode().rstrip('\r')
+        yield tail.decode().rstrip('\r')
+
+
+def read_csv_rows_reversed(filename, get_date, block_bytes=CSV_CHUNK_BYTES):
+    index = sum(1 for line in read_lines_reversed(filename, block_bytes) if line) - 1
+    run = []
+    for line in read_lines_reversed(filename, block_bytes):
+        if not line:
+            continue
+        if index == 0:
+            break  # header
+        index -= 1
+        instrumentation.count('rows parsed')
+        row = next(csv.reader([line]))
+        date = get_date(row)
+        # Flip runs of equal dates back, so ties keep the order of the file
+        if run and date != run[0][2]:
+            yield from reversed(run)
+            run = []
+        run.append((index, row, date,))
+    yield from reversed(run)
+
+
+# Yields (index in file, row, date) for every row of a statement sorted by
+# date either way, oldest first, without loading it. Newest-first statements
+# are read backwards; ties come out in file order, like sorted() would.
+# Raises ValueError if the statement is not sorted.
+def iter_statement_rows(filename, expected_fields, get_date, chunk_bytes=CSV_CHUNK_BYTES):
+    with open(filename, 'r') as f:
+        assert next(csv.reader([f.readline()])) == expected_fields
+        first_line = f.readline()
+    if not first_line.strip():
+        return
+    last_line = next(line for line in read_lines_reversed(filename) if line)
+    if get_date(next(csv.reader([first_line]))) <= get_date(next(csv.reader([last_line]))):
+        rows = ((index, row, get_date(row),) for index, row in enumerate(
+            row for chunk in read_csv_chunks(filename, expected_fields, chunk_bytes) for row in chunk))
+    else:
+        rows = read_csv_rows_reversed(filename, get_date, chunk_bytes)
+    previous_date = None
+    for index, row, date in rows:
+        if previous_date is not None and date < previous_date:
+            raise ValueError('{} is not sorted by date (row {})'.format(filename, index + 1))
+        previous_date = date
+        yield index, row, date
+
+
+# k-way merge of date-ordered trade streams (iter_standard_trades generators or
+# sorted lists) into one date-ordered stream. Ties keep the order of streams.
+def merge_trade_streams(*streams):
+    return heapq.merge(*streams, key=lambda row: row[2])
+
+
+# Goes through the HTTP record/replay archive when one is enabled (see
+# src/exchanges/http_archive.py)
 def get_request_with_retry(url, headers, num_retries=6):
-    for i in range(num_retries):
-        try:
-            response = requests.get(url, headers=headers)
-            if response.status_code >= 400 and response.status_code < 500:
-                print('received a {} from {}'.format(response.status_code, url))
-            response.raise_for_status()
-            return response.json()
-        except Exception:
-            time.sleep(2**i)
-    return None
+    archive = http_archive.get_http_archive()
+    if archive is not None:
+        return archive.get_json(url, headers, num_retries)
+    return http_client.get_json(url, headers, num_retries)
 
 
+@instrumentation.timed('process_buys')
 def process_buys(buys):
     basis_dict = {}
     fee_total = 0
@@ -36,86 +123,146 @@ def process_buys(buys):
         basis = abs(net_fiat) / size
         if asset not in basis_dict:
             basis_dict[asset] = []
+        insert_lot(basis_dict[asset], (date, basis, size, trade_id,))
 
-        index = 0
-        for curr_date, curr_price, curr_size, curr_trade_id in basis_dict[asset]:
-            if date < curr_date:
-                break
-            index += 1
-
-        if index > -1:
-            basis_dict[asset].insert(index, (date, basis, size, trade_id,))
-    
     return basis_dict, fee_total
 
 
-def process_sells(sells, basis_dict):
-    specific_id_audit = []
+# Matches one asset's sells against its lots. Assets never share lots, so every
+# asset can be matched independently, possibly in a worker process.
+# Returns the calculate_obligation_after_sale result of every sell, in order,
+# the asset's remaining lots (None if the asset had no lots to begin with) and
+# the (sales matched, lots matched) counts for the parent's instrumentation.
+def match_asset_sells(asset_sells, lots, strategy, specific_lot_ids=None):
+    strategy = get_strategy(strategy, specific_lot_ids)
+    lot_book = LotBook(lots or [])
+    results = []
+    sales_matched = 0
+    lots_matched = 0
+    for trade_id, action, date, size, asset, fee, net_fiat in asset_sells:
+        if action == 'BURN':
+            # use lowest basis for non-transfer L1 fees ;)
+            obligation = calculate_obligation_after_sale(lot_book, LOFO, size, net_fiat, date, trade_id)
+        elif lots is None:
+            results.append(None)
+            continue
+        else:
+            obligation = calculate_obligation_after_sale(lot_book, strategy, size, net_fiat, date, trade_id)
+        results.append(obligation)
+        sales_matched += 1
+        lots_matched += len(obligation[3]) if obligation else 0
+    counts = (sales_matched, lots_matched,)
+    if lots is None:
+        return results, None, counts
+    return results, lot_book.remaining(), counts
+
+
+def match_asset_sells_job(job):
+    return match_asset_sells(*job)
+
+
+# Adds one sell's calculate_obligation_after_sale result to the running
+# [short_term_obligation, long_term_obligation, fee_total] totals, writes its
+# AuditRecords to the audit sink and records any part of it sold with no basis.
+def record_sale(sell, obligation, totals, audit, sold_assets_with_no_basis):
+    trade_id, action, date, size, asset, fee, net_fiat = sell
+    if action == 'BURN':
+        if not obligation:
+            return
+        for match in obligation[3]:
+            audit.write(AuditRecord(asset, action, *match))
+        return
+
+    assert action == 'SELL'
+    totals[2] += fee
+    basis = net_fiat / size
+    if asset not in sold_assets_with_no_basis:
+        sold_assets_with_no_basis[asset] = []
+
+    # Obtained the asset somewhere else, e.g. in a prior year OR desposited in
+    if not obligation:
+        sold_assets_with_no_basis[asset].append(
+            (date, basis, size, trade_id,))
+        return
+    curr_short, curr_long, remaining_size, specific_entries = obligation
+    totals[0] += curr_short
+    totals[1] += curr_long
+    if remaining_size > 0 and basis * remaining_size >= 0.01:  # only record assets worth more than 1 cent
+        sold_assets_with_no_basis[asset].append(
+            (date, basis, remaining_size, trade_id,))
+    for match in specific_entries:
+        audit.write(AuditRecord(asset, action, *match))
+
+
+# strategy is a name from cost_basis.COST_BASIS_STRATEGIES or 'specific_id', in which
+# case specific_lot_ids maps each sell's trade ID to the trade IDs of the lots it sold.
+# With parallel=True assets are matched in a process pool. Either way the totals
+# are summed in sell order, so they are identical to the serial run.
+# Every lot match is written to the audit sink (see src/exchanges/audit.py), which
+# is returned; by default an AuditList that keeps the records. An asset's matches
+# are written as soon as the asset is matched, so only one asset's matches are
+# held at a time and the audit is grouped by asset rather than in sell order:
+# serially the assets come in the order of their first sale, in the pool largest
+# first, each in sell order. process_trade_stream writes them in date order.
+@instrumentation.timed('process_sells')
+def process_sells(sells, basis_dict, strategy='hifo', specific_lot_ids=None, parallel=False, max_workers=None,
+                  audit=None):
+    if audit is None:
+        audit = AuditList()
     sold_assets_with_no_basis = {}
     short_term_obligation = 0
     long_term_obligation = 0
     fee_total = 0
-    # Process sells
-    for sell in sells:
-        trade_id, action, date, size, asset, fee, net_fiat = sell
-        if action == 'BURN':
-            lowifo = None
-            prev_bases = basis_dict[asset]
-            i = len(prev_bases) - 1
-            while i >= 0:
-                curr_date, curr_basis, curr_size, curr_trade_id = prev_bases[i]
-                if curr_date < date:
-                    lowifo = calculate_obligation_after_sale(
-                        prev_bases, i+1, 'lowifo', size, net_fiat, date, trade_id)
-                    break
-                i -= 1
-            _, _, remaining_bases, remaining_size, specific_entries = lowifo  # use lowest basis for non-transfer L1 fees ;)
-            basis_dict[asset] = remaining_bases
-            for entry in specific_entries:
-                csv_line = '{},{},BURN'.format(asset, entry)
-                specific_id_audit.append(csv_line)
-            continue
 
-        assert action == 'SELL'
-        fee_total += fee
-        basis = net_fiat / size
-        if asset not in sold_assets_with_no_basis:
-            sold_assets_with_no_basis[asset] = []
-
-        # Obtained the asset somewhere else, e.g. in a prior year OR desposited in
-        if asset not in basis_dict:
-            sold_assets_with_no_basis[asset].append(
-                (date, basis, size, trade_id,))
-            continue
-        prev_bases = basis_dict[asset]
-
-        # v1: HIFO support only for sells
-        hifo = None
-        i = len(prev_bases) - 1
-        while i >= 0:
-            curr_date, curr_basis, curr_size, curr_trade_id = prev_bases[i]
-            if curr_date < date:
-                hifo = calculate_obligation_after_sale(
-                    prev_bases, i+1, 'hifo', size, net_fiat, date, trade_id)
-                break
-            i -= 1
+    if isinstance(sells, TradeTable):
+        sells_by_asset = sells.group_by_asset()
+    else:
+        sells_by_asset = {}
+        for sell in sells:
+            if sell[4] not in sells_by_asset:
+                sells_by_asset[sell[4]] = []
+            sells_by_asset[sell[4]].append(sell)
+    # Assets in the order of their first sale, so the audit stays close to sell order
+    jobs = []
+    for asset, asset_sells in sells_by_asset.items():
+        jobs.append((asset_sells, basis_dict.get(asset), strategy, specific_lot_ids,))
+    executor = None
+    if parallel and len(jobs) > 1:
+        # Largest assets first so a busy asset does not end up last in the pool
+        jobs.sort(key=lambda job: -len(job[0]))
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers)
+        job_results = executor.map(match_asset_sells_job, jobs)
+    else:
+        job_results = map(match_asset_sells_job, jobs)
+
+    # Write each asset's matches, keeping only the obligations for the totals
+    results_by_asset = {}
+    try:
+        for job, (results, remaining_bases, (sales_matched, lots_matched)) in zip(jobs, job_results):
+            # Counted here, workers' counters never reach the summary
+            instrumentation.count('sales matched', sales_matched)
+            instrumentation.count('lots matched', lots_matched)
+            asset_sells = job[0]
+            asset = asset_sells[0][4]
+            for i, (sell, obligation) in enumerate(zip(asset_sells, results)):
+                if obligation:
+                    for match in obligation[3]:
+                        audit.write(AuditRecord(asset, sell[1], *match))
+                    results[i] = obligation[:3] + ((),)
+            results_by_asset[asset] = iter(results)
+            if remaining_bases is not None:
+                basis_dict[asset] = remaining_bases
+    finally:
+        if executor is not None:
+            executor.shutdown()
 
-        if not hifo:
-            sold_assets_with_no_basis[asset].append(
-                (date, basis, size, trade_id,))
-            continue
-        curr_short, curr_long, remaining_bases, remaining_size, specific_entries = hifo
-        short_term_obligation += curr_short
-        long_term_obligation += curr_long
-        if remaining_size > 0 and basis * remaining_size >= 0.01:  # only record assets worth more than 1 cent
-            sold_assets_with_no_basis[asset].append(
-                (date, basis, remaining_size, trade_id,))
-        basis_dict[asset] = remaining_bases
-        for entry in specific_entries:
-            csv_line = '{},{}'.format(asset, entry)
-            specific_id_audit.append(csv_line)
+    # Process sells
+    totals = [short_term_obligation, long_term_obligation, fee_total]
+    for sell in sells:
+        record_sale(sell, next(results_by_asset[sell[4]]), totals, audit, sold_assets_with_no_basis)
+    short_term_obligation, long_term_obligation, fee_total = totals
 
-    return short_term_obligation, long_term_obligation, specific_id_audit, sold_assets_with_no_basis, fee_total
+    return short_term_obligation, long_term_obligation, audit, sold_assets_with_no_basis, fee_total
 
 
 # Returns (amount, bool,) where bool represents whether the obligation is short-term
@@ -126,40 +273,22 @@ def calculate_obligation(entry_basis, exit_basis, entry_size, exit_size, entry_d
     return ((exit_basis * exit_size) - (entry_basis * entry_size), short_term,)
 
 
-# Returns (short_term_amount, long_term_amount,
-#          remaining entry trades after HIFO eviction, remaining exit size,
-#          specific IDs of entry trades)
-def calculate_obligation_after_sale(all_bases, end_index, strategy, sale_size, net_fiat, sale_date, sale_trade_id):
-    bases_copy = copy.deepcopy(all_bases[:end_index])
+# Consumes the strategy's preferred lots dated before the sale from the lot book, in place.
+# Callers count the result with count_sale (it may run in a worker process).
+# Returns None if the book holds no such lots, otherwise
+#         (short_term_amount, long_term_amount, remaining exit size,
+#          audit.LotMatch of every entry trade used)
+@instrumentation.timed('calculate_obligation_after_sale')
+def calculate_obligation_after_sale(lot_book, strategy, sale_size, net_fiat, sale_date, sale_trade_id):
+    strategy = get_strategy(strategy)
     exit_basis = net_fiat / sale_size
-    done = False
-    deleted_state = {}
     short_term_obligation = 0
     long_term_obligation = 0
     specific_entry_ids = []
 
-    while sale_size > 0 and len(deleted_state) != end_index:
-        if strategy == 'hifo':
-            strategy_index = bases_copy.index(max(
-                bases_copy, key=lambda x: x[0]))
-        elif strategy == 'lowifo':
-            strategy_index = bases_copy.index(min(
-                bases_copy, key=lambda x: x[0]))
-        else:
-            raise ValueError('unsupported tax strategy: {}'.format(strategy))
-        curr_date, curr_basis, curr_size, curr_trade_id = bases_copy[strategy_index]
-
-        if curr_size >= sale_size:
-            entry_size = sale_size
-            exit_size = sale_size
-            deleted_state[curr_trade_id] = sale_size
-        else:
-            entry_size = curr_size
-            exit_size = curr_size
-            deleted_state[curr_trade_id] = curr_size
-            bases_copy.pop(strategy_index)
-
-        sale_size -= curr_size
+    for curr_date, curr_basis, entry_size, curr_trade_id in lot_book.match(strategy, sale_size, sale_date, sale_trade_id):
+        exit_size = entry_size
+        sale_size -= entry_size
         obligation, short_term = calculate_obligation(
             curr_basis, exit_basis, entry_size, exit_size, curr_date, sale_date)
         if short_term:
@@ -167,27 +296,26 @@ def calculate_obligation_after_sale(all_bases, end_index, strategy, sale_size, n
         else:
             long_term_obligation += obligation
         assert(sale_date > curr_date)
-        specific_entry_ids.append('{},{},{},{},{},{},{},{},{}'.format(
+        specific_entry_ids.append(LotMatch(
             curr_date, curr_basis, entry_size, curr_trade_id,
             sale_date, exit_basis, exit_size, sale_trade_id, obligation
         ))
 
-    remaining_bases = []
-    for entry in all_bases:
-        curr_date, curr_basis, curr_size, curr_trade_id = entry
-        if curr_trade_id not in deleted_state:
-            remaining_bases.append(entry)
-            continue
-        new_size = curr_size - deleted_state[curr_trade_id]
-        if new_size > 0:
-            remaining_bases.append(
-                (curr_date, curr_basis, new_size, curr_trade_id,))
+    if not specific_entry_ids:
+        return None
+    return short_term_obligation, long_term_obligation, sale_size, specific_entry_ids
 
-    return short_term_obligation, long_term_obligation, remaining_bases, sale_size, specific_entry_ids
 
+# Adds a calculate_obligation_after_sale result to the instrumentation counters
+def count_sale(obligation):
+    instrumentation.count('sales matched')
+    instrumentation.count('lots matched', len(obligation[3]) if obligation else 0)
 
-# Get 2019's leftover assets to find bases for sells and withdrawals in 2020.
-def get_previous_year_leftovers(rows):
+
+# rows are standard 7-element lists or a TradeTable
+def split_buys_and_sells(rows):
+    if isinstance(rows, TradeTable):
+        return rows.split_buys_and_sells()
     buys = []
     sells = []
     for row in rows:
@@ -195,12 +323,18 @@ def get_previous_year_leftovers(rows):
             buys.append(row)
         else:
             sells.append(row)
+    return buys, sells
+
+
+# Get 2019's leftover assets to find bases for sells and withdrawals in 2020.
+def get_previous_year_leftovers(rows, strategy='hifo'):
+    buys, sells = split_buys_and_sells(rows)
 
     # Process buys
     basis_dict, _ = process_buys(buys)
 
     # Process sells
-    _, _, _, _, _ = process_sells(sells, basis_dict)
+    _, _, _, _, _ = process_sells(sells, basis_dict, strategy, audit=AuditSink())
 
     previous_year_buys = []
     for asset, basis_info in basis_dict.items():
@@ -211,23 +345,121 @@ def get_previous_year_leftovers(rows):
     return previous_year_buys
 
 
-def process_trades(rows):
+# year_snapshot (a snapshot.YearSnapshot) saves the leftover lots for the next year,
+# audit (a fresh audit.AuditSink, e.g. audit.open_audit_sink('audit.csv')) streams the lot matches
+def process_trades(rows, strategy='hifo', specific_lot_ids=None, parallel=False, max_workers=None, year_snapshot=None,
+                   audit=None):
     # v1: Assume we only have 1 default portfolio, denominated in USD/USD stable.
-    buys = []
-    sells = []
-    for row in rows:
-        if row[1] == 'BUY':
-            buys.append(row)
-        else:
-            sells.append(row)
+    if audit is None:
+        audit = AuditSink()
+    if year_snapshot:
+        year_snapshot.check_previous()
+    buys, sells = split_buys_and_sells(rows)
 
     # Process buys
     basis_dict, buy_fees = process_buys(buys)
 
     # Process sells
-    short_term_obligation, long_term_obligation, specific_id_audit, sold_assets_with_no_basis, sell_fees = process_sells(sells, basis_dict)
+    short_term_obligation, long_term_obligation, audit, sold_assets_with_no_basis, sell_fees = process_sells(
+        sells, basis_dict, strategy, specific_lot_ids, parallel, max_workers, audit)
     fee_total = buy_fees + sell_fees
 
+    print_report(short_term_obligation, long_term_obligation, fee_total, sold_assets_with_no_basis, basis_dict)
+    assert(int(audit.total) == int(short_term_obligation + long_term_obligation))
+    instrumentation.print_summary()
+    if year_snapshot:
+        year_snapshot.write(strategy, basis_dict, sold_assets_with_no_basis)
+    return short_term_obligation, long_term_obligation
+
+
+class TradeStream(object):
+    # The date-ordered matching shared by process_trade_stream,
+    # transfers.process_venue_trades and fixed_point.process_trades_fixed_point,
+    # so the engines cannot drift apart. add() takes one trade at a time: buys
+    # become lots in the lot book of their key (the asset by default), sells
+    # and burns (always LOFO) are matched against that book and recorded, and
+    # other actions go to add_transfer. finish() prints the report. Subclasses
+    # change how lots are stored and matched, or what the keys are.
+
+    def __init__(self, strategy='hifo', specific_lot_ids=None, audit=None):
+        self.strategy = get_strategy(strategy, specific_lot_ids)
+        self.audit = AuditSink() if audit is None else audit
+        self.lot_books = {}
+        # short term obligation, long term obligation, sell fees
+        self.totals = [0, 0, 0]
+        self.buy_fees = 0
+        self.sold_assets_with_no_basis = {}
+        self.previous_date = None
+
+    def add(self, trade, key=None):
+        trade_id, action, date = trade[:3]
+        if self.previous_date is not None and date < self.previous_date:
+            raise ValueError('trade {} is out of date order'.format(trade_id))
+        self.previous_date = date
+        if key is None:
+            key = trade[4]
+        if action == 'BUY':
+            self.add_buy(key, trade)
+        elif action in ('SELL', 'BURN'):
+            # use lowest basis for non-transfer L1 fees ;)
+            self.add_sale(key, trade, LOFO if action == 'BURN' else self.strategy)
+        else:
+            self.add_transfer(key, trade)
+
+    def get_lot_book(self, key):
+        if key not in self.lot_books:
+            self.lot_books[key] = LotBook()
+        return self.lot_books[key]
+
+    def add_buy(self, key, trade):
+        trade_id, action, date, size, asset, fee, net_fiat = trade
+        self.buy_fees += fee
+        self.get_lot_book(key).add((date, abs(net_fiat) / size, size, trade_id,))
+
+    def add_sale(self, key, trade, strategy):
+        trade_id, action, date, size, asset, fee, net_fiat = trade
+        obligation = None
+        if key in self.lot_books:
+            obligation = calculate_obligation_after_sale(
+                self.lot_books[key], strategy, size, net_fiat, date, trade_id)
+            count_sale(obligation)
+        record_sale(trade, obligation, self.totals, self.audit, self.sold_assets_with_no_basis)
+
+    def add_transfer(self, key, trade):
+        raise ValueError('trade {} has an unsupported action {}'.format(trade[0], trade[1]))
+
+    # Returns (short_term_obligation, long_term_obligation, fee_total)
+    def get_totals(self):
+        return self.totals[0], self.totals[1], self.buy_fees + self.totals[2]
+
+    # Returns the open lots in the basis_dict form
+    def get_leftovers(self):
+        return {asset: lot_book.remaining() for asset, lot_book in self.lot_books.items()}
+
+    def validate(self, short_term_obligation, long_term_obligation):
+        assert(int(self.audit.total) == int(short_term_obligation + long_term_obligation))
+
+    # Prints the report, returns (short_term_obligation, long_term_obligation)
+    def finish(self):
+        short_term_obligation, long_term_obligation, fee_total = self.get_totals()
+        print_report(short_term_obligation, long_term_obligation, fee_total, self.sold_assets_with_no_basis,
+                     self.get_leftovers())
+        self.validate(short_term_obligation, long_term_obligation)
+        instrumentation.print_summary()
+        return short_term_obligation, long_term_obligation
+
+
+# Same as process_trades, but consumes date-ordered trades one at a time (e.g.
+# from merge_trade_streams), so memory is bounded by the open lots rather than
+# the whole history. Gives the same totals as process_trades.
+def process_trade_stream(trades, strategy='hifo', specific_lot_ids=None, audit=None):
+    stream = TradeStream(strategy, specific_lot_ids, audit)
+    for trade in trades:
+        stream.add(trade)
+    return stream.finish()
+
+
+def print_report(short_term_obligation, long_term_obligation, fee_total, sold_assets_with_no_basis, leftovers):
     print('Total short term obligation: ${}'.format(short_term_obligation))
     print('Total long term obligation: ${}'.format(long_term_obligation))
     print('Fees paid to the exchange: ${}'.format(fee_total))
@@ -241,18 +473,29 @@ def process_trades(rows):
 
     print('================')
     print('Leftover assets:')
-    for asset, basis_info in basis_dict.items():
+    for asset, basis_info in leftovers.items():
         if sum(x[1] * x[2] for x in basis_info) < 0.01:
             continue
         print('{} {}'.format(sum(x[2] for x in basis_info), asset))
 
-    validation = 0
-    for line in specific_id_audit:
-        validation += float(line.split(',')[-1])
-    assert(int(validation) == int(short_term_obligation + long_term_obligation))
+
+# Runs the same trades through every strategy to compare the resulting liability.
+def compare_strategies(rows, strategies=tuple(COST_BASIS_STRATEGIES)):
+    buys, sells = split_buys_and_sells(rows)
+    results = {}
+    print('strategy,short term,long term,total')
+    for strategy in strategies:
+        basis_dict, _ = process_buys(buys)
+        short_term_obligation, long_term_obligation, _, _, _ = process_sells(
+            sells, basis_dict, strategy, audit=AuditSink())
+        results[strategy] = (short_term_obligation, long_term_obligation,)
+        print('{},{},{},{}'.format(
+            strategy, short_term_obligation, long_term_obligation, short_term_obligation + long_term_obligation))
+    return results
 
 
 if __name__ == '__main__':
+    instrumentation.enable_from_environment()
     rows = [
         ['COINBASE:558031', 'BUY', datetime.datetime(2020, 4, 10, 7, 8, 43, 44000), 5515.2, 'KNC', 2.6307504, 2633.3811504],
         ['COINBASE:558081', 'BUY', datetime.datetime(2020, 4, 10, 7, 28, 20, 101000), 3879.1, 'KNC', 1.8503307, 1852.1810307],
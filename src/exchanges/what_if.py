@@ -0,0 +1,93 @@
+#!/usr/local/bin/python3
+
+import bisect
+import collections
+import datetime
+
+from src.exchanges.cost_basis import HeapStrategy, get_strategy
+
+
+ONE_YEAR = datetime.timedelta(days=365)
+
+# The outcome of a simulated sale. matched_size is the part of the size
+# covered by open lots; the rest would be sold with no basis and is left out
+# of the gains, as process_sells does.
+WhatIf = collections.namedtuple('WhatIf', [
+    'asset', 'size', 'price', 'matched_size', 'short_term_size', 'long_term_size',
+    'short_term_cost', 'long_term_cost', 'short_term_gain', 'long_term_gain'])
+
+
+class SaleIndex(object):
+    # One asset's open lots in the order a strategy would sell them, with
+    # running totals of size, short term size/cost and long term size/cost
+    # (prefix i covers the first i lots), so a sale of any size is one bisect.
+
+    def __init__(self, lots, strategy, as_of):
+        records = [[date, basis, size, trade_id, seq]
+                   for seq, (date, basis, size, trade_id) in enumerate(lots) if size > 0 and date < as_of]
+        records.sort(key=strategy.sort_key)
+        self.bases = []
+        self.long_term = []
+        self.sizes = [0]
+        self.short_term_sizes = [0]
+        self.short_term_costs = [0]
+        self.long_term_sizes = [0]
+        self.long_term_costs = [0]
+        for date, basis, size, _, _ in records:
+            long_term = as_of - date > ONE_YEAR
+            self.bases.append(basis)
+            self.long_term.append(long_term)
+            self.sizes.append(self.sizes[-1] + size)
+            self.short_term_sizes.append(self.short_term_sizes[-1] + (0 if long_term else size))
+            self.short_term_costs.append(self.short_term_costs[-1] + (0 if long_term else basis * size))
+            self.long_term_sizes.append(self.long_term_sizes[-1] + (size if long_term else 0))
+            self.long_term_costs.append(self.long_term_costs[-1] + (basis * size if long_term else 0))
+
+    # Returns (matched size, short term size, short term cost, long term size, long term cost)
+    def take(self, size):
+        # Lots before index i are sold whole, lot i (if any) covers the rest
+        i = bisect.bisect_right(self.sizes, size) - 1
+        short_term_size = self.short_term_sizes[i]
+        short_term_cost = self.short_term_costs[i]
+        long_term_size = self.long_term_sizes[i]
+        long_term_cost = self.long_term_costs[i]
+        rest = size - self.sizes[i]
+        if i < len(self.bases) and rest > 0:
+            if self.long_term[i]:
+                long_term_size += rest
+                long_term_cost += rest * self.bases[i]
+            else:
+                short_term_size += rest
+                short_term_cost += rest * self.bases[i]
+        return short_term_size + long_term_size, short_term_size, short_term_cost, long_term_size, long_term_cost
+
+
+class SaleSimulator(object):
+    # Read-only "what if I sold" queries against open lots as of a sale date
+    # (default now): lots_by_asset is a basis_dict, e.g. the one process_sells
+    # leaves behind, a snapshot's (snapshot.load_snapshot(path)['basis_dict'])
+    # or IncrementalLedger.get_open_lots(). The lots are never changed. Each
+    # (asset, strategy) is indexed on its first query in O(n log n), every
+    # query after that takes O(log n).
+
+    def __init__(self, lots_by_asset, as_of=None):
+        self.lots_by_asset = lots_by_asset
+        self.as_of = as_of or datetime.datetime.now()
+        self.indexes = {}
+
+    def get_index(self, asset, strategy):
+        strategy = get_strategy(strategy)
+        if not isinstance(strategy, HeapStrategy):
+            raise ValueError('what-if sales need an ordering strategy, not {}'.format(strategy.name))
+        key = (asset, strategy.name,)
+        if key not in self.indexes:
+            self.indexes[key] = SaleIndex(self.lots_by_asset.get(asset, []), strategy, self.as_of)
+        return self.indexes[key]
+
+    # The gains of selling size units of the asset at price (USD per unit)
+    def simulate(self, asset, size, price, strategy='hifo'):
+        matched_size, short_term_size, short_term_cost, long_term_size, long_term_cost = (
+            self.get_index(asset, strategy).take(size))
+        return WhatIf(asset, size, price, matched_size, short_term_size, long_term_size,
+                      short_term_cost, long_term_cost,
+                      price * short_term_size - short_term_cost, price * long_term_size - long_term_cost)
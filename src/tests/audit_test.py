@@ -0,0 +1,78 @@
+from src.exchanges.audit import (AUDIT_FIELDS, AuditList, AuditRecord, ColumnarAuditSink, open_audit_sink,
+                                 read_columnar_audit)
+from src.exchanges.utils import process_trades
+
+import csv
+import datetime
+import json
+import mock
+import os
+import tempfile
+import unittest
+
+
+class AuditTest(unittest.TestCase):
+
+    def setUp(self):
+        date_1 = datetime.datetime(2020, 4, 25, 8)
+        date_2 = datetime.datetime(2020, 4, 25, 9, 30, 0, 125000)
+        self.records = [
+            AuditRecord('BTC', 'SELL', date_1, 100.0, 1.0, 'trade_1', date_2, 200.0, 1.0, 'trade_3', 100.0),
+            AuditRecord('ETH', 'BURN', date_1, 10.0, 0.01, 'trade_2', date_2, 0.0, 0.01, 'trade_4', -0.1),
+            AuditRecord('BTC', 'SELL', date_1, 300.0, 0.5, 'trade_5', date_2, 200.0, 0.5, 'trade_3', -50.0),
+        ]
+        audit_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(audit_dir.cleanup)
+        self.audit_dir = audit_dir.name
+
+    def write(self, sink):
+        with sink:
+            for record in self.records:
+                sink.write(record)
+        return sink
+
+    def test_running_total_skips_burns(self):
+        sink = self.write(AuditList())
+        self.assertEqual(50.0, sink.total)
+        self.assertEqual(3, sink.count)
+        self.assertEqual(self.records, sink.records)
+
+    def test_csv_and_jsonl_sinks(self):
+        csv_file = os.path.join(self.audit_dir, 'audit.csv')
+        jsonl_file = os.path.join(self.audit_dir, 'audit.jsonl')
+        self.write(open_audit_sink(csv_file))
+        self.write(open_audit_sink(jsonl_file))
+        with open(csv_file) as f:
+            lines = list(csv.reader(f))
+        self.assertEqual(AUDIT_FIELDS, lines[0])
+        self.assertEqual(['BTC', 'SELL', '2020-04-25 08:00:00', '100.0', '1.0', 'trade_1',
+                          '2020-04-25 09:30:00.125000', '200.0', '1.0', 'trade_3', '100.0'], lines[1])
+        with open(jsonl_file) as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual(3, len(lines))
+        self.assertEqual('2020-04-25T09:30:00.125000', lines[1]['exit_date'])
+        self.assertEqual('BURN', lines[1]['action'])
+        with self.assertRaises(ValueError):
+            open_audit_sink(os.path.join(self.audit_dir, 'audit.txt'))
+
+    def test_columnar_sink_round_trips_across_row_groups(self):
+        filename = os.path.join(self.audit_dir, 'audit.columnar')
+        self.write(ColumnarAuditSink(filename, row_group_size=2))
+        self.assertEqual(self.records, list(read_columnar_audit(filename)))
+
+    @mock.patch('builtins.print')
+    def test_process_trades_streams_to_sink(self, _):
+        date = datetime.datetime(2020, 1, 1)
+        rows = [
+            ['trade_1', 'BUY', date, 2.0, 'BTC', 0, 200.0],
+            ['trade_2', 'SELL', date + datetime.timedelta(days=1), 1.0, 'BTC', 0, 150.0],
+            ['trade_3', 'BURN', date + datetime.timedelta(days=2), 0.5, 'BTC', 0, 0],
+        ]
+        filename = os.path.join(self.audit_dir, 'audit.columnar')
+        with open_audit_sink(filename) as sink:
+            self.assertEqual((50.0, 0,), process_trades(rows, audit=sink))
+        self.assertEqual(['SELL', 'BURN'], [record.action for record in read_columnar_audit(filename)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+from src.benchmarks.suite import find_regressions, generate_trades, get_fake_klines, iter_trades, main, run, run_replayed
+from src.cli import load_source
+from src.exchanges.binance import BINANCE_TRADES_CSV_FIELDS
+from src.exchanges.http_archive import HttpArchive
+from src.exchanges.ohlc_store import OhlcStore
+from src.exchanges.price_cache import PriceCache
+from src.exchanges.price_service import PriceService
+
+import datetime
+import mock
+import os
+import tempfile
+import unittest
+
+
+class BenchmarkSuiteTest(unittest.TestCase):
+
+    def test_generate_trades(self):
+        rows = generate_trades(1000, assets=['BTC', 'ETH'], fills_per_order=4, buy_ratio=1.0)
+        self.assertEqual(1000, len(rows))
+        self.assertEqual({'BTC', 'ETH'}, set(row[4] for row in rows))
+        self.assertEqual({'BUY'}, set(row[1] for row in rows))
+        self.assertEqual(sorted(rows, key=lambda x: x[2]), rows)
+        # Fills of an order land a second apart
+        fills = sorted(row for row in rows if row[0] in ('BENCHMARK:0', 'BENCHMARK:1'))
+        self.assertEqual(datetime.timedelta(seconds=1), fills[1][2] - fills[0][2])
+
+        sells = [row for row in generate_trades(1000, buy_ratio=0.0, holding_days=(800, 900)) if row[1] == 'SELL']
+        self.assertEqual(1000, len(sells))
+        self.assertTrue(all(row[2] >= datetime.datetime(2018, 1, 1) + datetime.timedelta(days=800) for row in sells))
+
+    def test_iter_trades(self):
+        trades = iter_trades(1000, assets=['BTC', 'ETH'], fills_per_order=4)
+        self.assertEqual('BENCHMARK:0', next(trades)[0])
+        rows = [next(trades)] + list(trades)
+        self.assertEqual(999, len(rows))
+        self.assertEqual(sorted(rows, key=lambda x: x[2]), rows)
+        self.assertEqual({'BUY', 'SELL'}, set(row[1] for row in rows))
+
+        sells = [row for row in iter_trades(1000, buy_ratio=0.0, holding_days=(800, 900)) if row[1] == 'SELL']
+        self.assertEqual(1000, len(sells))
+        self.assertTrue(all(row[2] >= datetime.datetime(2018, 1, 1) + datetime.timedelta(days=800) for row in sells))
+        self.assertEqual(sorted(sells, key=lambda x: x[2]), sells)
+
+    @mock.patch('builtins.print')
+    def test_missing_baseline_fails(self, _):
+        with tempfile.TemporaryDirectory() as work_dir:
+            args = ['--sizes', '100', '--cases', 'process_buys,trade_stream', '--output',
+                    os.path.join(work_dir, 'results.json'), '--baseline']
+            self.assertEqual(2, main(args + [os.path.join(work_dir, 'missing.json')]))
+            self.assertEqual(0, main(args + ['none']))
+
+    @mock.patch('builtins.print')
+    def test_run(self, _):
+        results = run([200], ['process_buys', 'process_sells', 'price_lookups', 'incremental_append'], repeat=1)
+        self.assertEqual({'process_buys', 'process_sells', 'price_lookups', 'incremental_append'}, set(results))
+        self.assertGreater(results['process_sells']['200']['seconds'], 0)
+
+    @mock.patch('builtins.print')
+    def test_run_replayed(self, _):
+        with tempfile.TemporaryDirectory() as work_dir:
+            filename = os.path.join(work_dir, 'binance_trades.csv')
+            with open(filename, 'w') as f:
+                f.write(','.join(BINANCE_TRADES_CSV_FIELDS) + '\n')
+                f.write('1/5/2021 10:00,ETHBTC,BUY,0.03,"1.0000ETH","0.0300BTC",0.00100000ETH\n')
+                f.write('1/6/2021 11:30,ETHBTC,SELL,0.03,"0.5000ETH","0.0150BTC",0.00001500BTC\n')
+            archive_dir = os.path.join(work_dir, 'recordings')
+            # Record the loader's requests from a cold cache
+            archive = HttpArchive(archive_dir, 'record')
+            with mock.patch('src.exchanges.http_archive.ARCHIVE', archive), \
+                    mock.patch('src.exchanges.price_cache.PRICE_CACHE', PriceCache(':memory:')), \
+                    mock.patch('src.exchanges.price_service.PRICE_SERVICE', PriceService()), \
+                    mock.patch('src.exchanges.ohlc_store.OHLC_STORE', OhlcStore(work_dir)), \
+                    mock.patch('src.exchanges.http_client.get_json',
+                               side_effect=lambda url, headers, num_retries: get_fake_klines(url, headers)):
+                trades, _, _, _ = load_source('binance', filename)
+            archive.close()
+            self.assertGreater(len(archive), 0)
+
+            with mock.patch('src.exchanges.http_client.get_json') as get_json_mock:
+                results = run_replayed(archive_dir, [('binance', filename,)], repeat=2)
+            get_json_mock.assert_not_called()
+            self.assertEqual([str(len(trades))], list(results['replay binance:{}'.format(filename)]))
+
+    def test_find_regressions(self):
+        baseline = {'process_sells': {'1000': {'seconds': 1.0}}, 'process_buys': {'1000': {'seconds': 1.0}}}
+        results = {
+            'process_sells': {'1000': {'seconds': 1.3}, '10000': {'seconds': 9.0}},
+            'process_buys': {'1000': {'seconds': 1.1}},
+        }
+        self.assertEqual([('process_sells', '1000', 1.0, 1.3)], find_regressions(results, baseline))
+        self.assertEqual([], find_regressions(results, baseline, threshold=0.5))
+        # Millisecond cases need to lose more than the slack too
+        baseline = {'calculate_obligation_after_sale': {'1000': {'seconds': 0.0049}}}
+        results = {'calculate_obligation_after_sale': {'1000': {'seconds': 0.0064}}}
+        self.assertEqual([], find_regressions(results, baseline))
+        self.assertEqual([('calculate_obligation_after_sale', '1000', 0.0049, 0.0064)],
+                         find_regressions(results, baseline, slack=0))
+
+
+if __name__ == '__main__':
+    unittest.main()
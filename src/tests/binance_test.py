@@ -1,14 +1,27 @@
-from src.exchanges.binance import prepare_rows_helper
+from src.exchanges.binance import (get_price_lookups, get_standard_trades, parse_binance_date, prepare_rows_helper,
+                                   split_amount)
+from src.exchanges.price_cache import PriceCache
+from src.exchanges.price_service import PriceService
 from src.exchanges.utils import get_request_with_retry
 
 import datetime
 import mock
+import os
+import tempfile
 import unittest
 
 STANDARD_CSV_FIELDS = ['trade id', 'action', 'date',
                        'size', 'asset', 'trading_fee', 'total_dollars']
 class BinanceTest(unittest.TestCase):
 
+    def setUp(self):
+        price_cache_patcher = mock.patch('src.exchanges.price_cache.PRICE_CACHE', PriceCache(':memory:'))
+        price_cache_patcher.start()
+        self.addCleanup(price_cache_patcher.stop)
+        price_service_patcher = mock.patch('src.exchanges.price_service.PRICE_SERVICE', PriceService())
+        price_service_patcher.start()
+        self.addCleanup(price_service_patcher.stop)
+
     @mock.patch('src.exchanges.utils.get_request_with_retry')
     def test_simple_buy_row(self, request_mock):
         row = '6/23/2020 17:12,KAVAUSDT,BUY,0.50,4.000KAVA,2.000USDT,0.04000KAVA'.split(',')
@@ -42,6 +55,58 @@ class BinanceTest(unittest.TestCase):
 
         self.assertEqual(prepare_rows_helper(row, 1), expected)
 
+    @mock.patch('src.exchanges.utils.get_request_with_retry')
+    def test_prices_are_prefetched_in_ranges(self, request_mock):
+        def klines(url, headers):
+            params = dict(param.split('=') for param in url.split('?')[1].split('&'))
+            start = int(params['startTime'])
+            price = '1000' if params['symbol'] == 'BTCUSDT' else '20'
+            return [[open_time, price, price, price, price] for open_time in range(
+                start, int(params['endTime']) + 1, 60000)][:int(params['limit'])]
+        request_mock.side_effect = klines
+
+        lines = [
+            'Date(UTC),Pair,Side,Price,Executed,Amount,Fee',
+            '6/23/2020 17:12,ETHBTC,BUY,0.02,1.000ETH,0.0200BTC,0.0010BNB',
+            '6/23/2020 19:40,ETHBTC,SELL,0.02,1.000ETH,0.0200BTC,0.0010BNB',
+            '6/24/2020 9:03,KAVAUSDT,BUY,0.50,4.000KAVA,2.000USDT,0.04000KAVA',
+        ]
+        with tempfile.TemporaryDirectory() as csv_dir:
+            filename = os.path.join(csv_dir, 'binance_trades.csv')
+            with open(filename, 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+            rows = get_standard_trades(filename)
+
+        # One call per symbol covers both trades, none per row
+        self.assertEqual(2, request_mock.call_count)
+        self.assertEqual(['BINANCE:0', 'BINANCE:0-AUXILIARY', 'BINANCE:1', 'BINANCE:1-AUXILIARY', 'BINANCE:2'],
+                         [row[0] for row in rows])
+        self.assertEqual(20.0, rows[0][6])
+        self.assertEqual(0.02, rows[1][5])
+
+    @mock.patch('src.exchanges.binance.get_historical_price')
+    def test_price_lookups_match_the_prices_used(self, price_mock):
+        price_mock.return_value = 10.0
+        rows = [
+            '6/23/2020 17:12,KAVAUSDT,BUY,0.50,4.000KAVA,2.000USDT,0.04000KAVA',
+            '6/23/2020 17:12,KAVAUSDT,SELL,0.50,4.000KAVA,2.000USDT,0.00100BNB',
+            '4/25/2020 19:54,LENDBTC,BUY,0.05,40.000LEND,0.1000BTC,0.1000LEND',
+            '6/23/2020 19:40,ETHBTC,SELL,0.02,1.000ETH,0.0200BTC,0.0010BNB',
+            '6/23/2020 19:40,BTCUSDT,SELL,9000,1.000BTC,9000USDT,9.000USDT',
+        ]
+        for row in rows:
+            price_mock.reset_mock()
+            prepare_rows_helper(row.split(','), 1)
+            self.assertEqual([call[0] for call in price_mock.call_args_list], get_price_lookups(row.split(',')))
+
+    def test_split_amount(self):
+        self.assertEqual((1234.5, 'BTC'), split_amount('"1,234.50BTC"'))
+        self.assertEqual((10.01, 'INCH'), split_amount('10.01INCH'))
+
+    def test_parse_binance_date(self):
+        for date_string in ['6/3/2020 7:02', '12/23/2020 17:12']:
+            self.assertEqual(datetime.datetime.strptime(date_string, "%m/%d/%Y %H:%M"), parse_binance_date(date_string))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,60 @@
+from src.cli import main, parse_source
+from src.exchanges.coinbase import COINBASE_TRADES_CSV_FIELDS
+from src.exchanges.kraken import KRAKEN_TRADES_CSV_FIELDS
+
+import argparse
+import csv
+import mock
+import os
+import tempfile
+import unittest
+
+
+class CliTest(unittest.TestCase):
+
+    def test_parse_source(self):
+        self.assertEqual(('coinbase', 'trades.csv',), parse_source('coinbase:trades.csv'))
+        self.assertEqual(('kraken', '',), parse_source('kraken'))
+        with self.assertRaises(argparse.ArgumentTypeError):
+            parse_source('mtgox:trades.csv')
+        with self.assertRaises(argparse.ArgumentTypeError):
+            parse_source('etherscan')
+
+    @mock.patch('builtins.print')
+    def test_sources_are_merged_into_one_run(self, print_mock):
+        coinbase_lines = [
+            ','.join(COINBASE_TRADES_CSV_FIELDS),
+            'default,1,BTC-USD,BUY,2021-01-01T10:00:00.000Z,0.1,BTC,30000,0.0,-3000.0,USD',
+        ]
+        kraken_lines = [
+            ','.join(KRAKEN_TRADES_CSV_FIELDS),
+            'T1,O1,XXBTZUSD,2021-01-02 10:00:00.0,sell,limit,40000.0,4000.0,0.0,0.1,0.00000000,,L1',
+        ]
+        with tempfile.TemporaryDirectory() as csv_dir:
+            coinbase_file = os.path.join(csv_dir, 'coinbase_trades.csv')
+            kraken_file = os.path.join(csv_dir, 'kraken_trades.csv')
+            audit_file = os.path.join(csv_dir, 'audit.csv')
+            with open(coinbase_file, 'w') as f:
+                f.write('\n'.join(coinbase_lines) + '\n')
+            with open(kraken_file, 'w') as f:
+                f.write('\n'.join(kraken_lines) + '\n')
+            self.assertEqual(0, main(['coinbase:{}'.format(coinbase_file), 'kraken:{}'.format(kraken_file),
+                                      '--audit', audit_file]))
+            with open(audit_file) as f:
+                audit = list(csv.reader(f))
+        printed = [call[0][0] for call in print_mock.call_args_list if call[0]]
+        self.assertIn('Total short term obligation: $1000.0', printed)
+        self.assertTrue(any(line.startswith('startup,') for line in printed))
+        self.assertEqual(['BTC', 'SELL'], audit[1][:2])
+        self.assertEqual(['COINBASE:1', 'KRAKEN:T1:O1'], [audit[1][5], audit[1][9]])
+
+    @mock.patch('sys.stderr')
+    def test_unsupported_flag_combinations_are_rejected(self, _):
+        for flags in [['--match-transfers', '--parallel'], ['--match-transfers', '--arithmetic', 'decimal'],
+                      ['--arithmetic', 'fixed_point', '--parallel']]:
+            with self.assertRaises(SystemExit):
+                main(['coinbase:coinbase_trades.csv'] + flags)
+
+
+if __name__ == '__main__':
+    unittest.main()
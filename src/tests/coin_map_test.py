@@ -0,0 +1,60 @@
+from src.wallets import coin_map
+
+import json
+import mock
+import os
+import tempfile
+import unittest
+
+
+class CoinMapTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.source_file = os.path.join(self.temp_dir.name, 'coin_map.json')
+        self.index_file = os.path.join(self.temp_dir.name, 'coin_map.sqlite3')
+
+    def write_coin_map(self, coin_map_json):
+        with open(self.source_file, 'w') as f:
+            f.write(json.dumps(coin_map_json))
+
+    def lookup(self, symbol):
+        connection = coin_map.open_index(self.source_file, self.index_file)
+        rows = connection.execute(
+            'SELECT name, id FROM coins WHERE symbol = ? ORDER BY position', (symbol,)).fetchall()
+        connection.close()
+        return rows
+
+    def test_index_keeps_entry_order(self):
+        self.write_coin_map({'UNI': [['UNISWAP', 'uniswap'], ['UNICORN', 'unicorn-token']]})
+        self.assertEqual([('UNISWAP', 'uniswap'), ('UNICORN', 'unicorn-token')], self.lookup('UNI'))
+        self.assertEqual([], self.lookup('ETH'))
+
+    def test_index_is_rebuilt_when_the_source_changes(self):
+        self.write_coin_map({'UNI': [['UNISWAP', 'uniswap']]})
+        self.assertEqual([('UNISWAP', 'uniswap')], self.lookup('UNI'))
+        self.write_coin_map({'UNI': [['UNISWAP', 'uniswap']], 'ETH': [['ETHEREUM', 'ethereum']]})
+        os.utime(self.source_file, ns=(0, 0))
+        self.assertEqual([('ETHEREUM', 'ethereum')], self.lookup('ETH'))
+
+    def test_resolve_id(self):
+        self.write_coin_map({
+            'UNI': [['UNISWAP', 'uniswap'], ['UNICORN', 'unicorn-token']],
+            'ETH': [['ETHEREUM', 'ethereum']],
+        })
+        coin_map.get_entries.cache_clear()
+        coin_map.resolve_id.cache_clear()
+        self.addCleanup(coin_map.get_entries.cache_clear)
+        self.addCleanup(coin_map.resolve_id.cache_clear)
+        with mock.patch('src.wallets.coin_map.COIN_MAP_FILE', self.source_file), \
+                mock.patch('src.wallets.coin_map.COIN_MAP_INDEX', None), \
+                mock.patch('src.exchanges.price_cache.PRICE_CACHE_DIR', self.temp_dir.name):
+            self.assertEqual('unicorn-token', coin_map.resolve_id('UNI', 'UNICORN TOKEN'))
+            self.assertEqual('ethereum', coin_map.resolve_id('ETH', 'WRAPPED ETHER'))
+            self.assertIsNone(coin_map.resolve_id('UNI', 'UNIFI'))
+            self.assertEqual((), coin_map.get_entries('BTC'))
+            self.assertIsNone(coin_map.resolve_id('BTC', 'BITCOIN'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,29 @@
+from src.exchanges.coinbase import COINBASE_TRADES_CSV_FIELDS, get_standard_trades
+
+import datetime
+import os
+import tempfile
+import unittest
+
+
+class CoinbaseTest(unittest.TestCase):
+
+    def test_get_standard_trades(self):
+        lines = [
+            ','.join(COINBASE_TRADES_CSV_FIELDS),
+            'default,558082,KNC-USD,BUY,2020-04-10T07:28:31.374Z,1044.7,KNC,0.477,0.4983219,-498.8202219,USD',
+            'default,558031,KNC-USD,BUY,2020-04-10T07:08:43.44Z,5515.2,KNC,0.477,2.6307504,-2633.3811504,USD',
+        ]
+        with tempfile.TemporaryDirectory() as csv_dir:
+            filename = os.path.join(csv_dir, 'coinbase_trades.csv')
+            with open(filename, 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+            rows = get_standard_trades(filename)
+        self.assertEqual([
+            ['COINBASE:558031', 'BUY', datetime.datetime(2020, 4, 10, 7, 8, 43, 440000), 5515.2, 'KNC', 2.6307504, 2633.3811504],
+            ['COINBASE:558082', 'BUY', datetime.datetime(2020, 4, 10, 7, 28, 31, 374000), 1044.7, 'KNC', 0.4983219, 498.8202219],
+        ], rows)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+from src.exchanges.utils import process_buys, process_sells
+
+import datetime
+import unittest
+
+
+class CostBasisTest(unittest.TestCase):
+
+    def setUp(self):
+        self.date_1 = datetime.datetime(2019, 1, 10)
+        self.date_2 = datetime.datetime(2020, 3, 10)
+        self.date_3 = datetime.datetime(2020, 6, 10)
+        self.sale_date = datetime.datetime(2020, 7, 1)
+        self.buys = [
+            ['trade_1', 'BUY', self.date_1, 1.0, 'ETH', 0, 200.0],
+            ['trade_2', 'BUY', self.date_2, 1.0, 'ETH', 0, 100.0],
+            ['trade_3', 'BUY', self.date_3, 1.0, 'ETH', 0, 300.0],
+        ]
+        self.sells = [['trade_4', 'SELL', self.sale_date, 1.5, 'ETH', 0, 375.0]]
+
+    def sold_lots(self, strategy, specific_lot_ids=None):
+        basis_dict, _ = process_buys(self.buys)
+        short_term, long_term, audit, _, _ = process_sells(self.sells, basis_dict, strategy, specific_lot_ids)
+        return [(record.entry_trade_id, record.entry_size,) for record in audit.records], short_term, long_term
+
+    def test_fifo(self):
+        self.assertEqual(([('trade_1', 1.0), ('trade_2', 0.5)], 75.0, 50.0), self.sold_lots('fifo'))
+
+    def test_lifo(self):
+        self.assertEqual(([('trade_3', 1.0), ('trade_2', 0.5)], 25.0, 0), self.sold_lots('lifo'))
+
+    def test_hifo(self):
+        self.assertEqual(([('trade_3', 1.0), ('trade_1', 0.5)], -50.0, 25.0), self.sold_lots('hifo'))
+
+    def test_lofo(self):
+        self.assertEqual(([('trade_2', 1.0), ('trade_1', 0.5)], 150.0, 25.0), self.sold_lots('lofo'))
+
+    def test_specific_id_falls_back_to_fifo(self):
+        self.assertEqual(([('trade_3', 1.0), ('trade_1', 0.5)], -50.0, 25.0),
+                         self.sold_lots('specific_id', {'trade_4': ['trade_3']}))
+
+    def test_unknown_strategy(self):
+        with self.assertRaises(ValueError):
+            self.sold_lots('random')
+
+
+if __name__ == '__main__':
+    unittest.main()
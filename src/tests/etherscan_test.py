@@ -0,0 +1,110 @@
+import http.server
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import types
+import urllib.parse
+
+# The etherscan module reads the wallet and API key from the user's secrets.py
+if 'src.wallets.secrets' not in sys.modules:
+    secrets = types.ModuleType('src.wallets.secrets')
+    secrets.PRIMARY_WALLET_ADDRESS = '0xwallet'
+    secrets.ETHERSCAN_API_KEY = 'key'
+    sys.modules['src.wallets.secrets'] = secrets
+
+from src.wallets.etherscan import ETHERSCAN_CSV_FIELDS, get_standard_trades_deposits_withdrawals
+
+import mock
+import unittest
+
+WALLET = '0xwallet'
+
+
+def stub_transfers(block):
+    return [
+        {'hash': '0x{}'.format(block), 'blockNumber': str(block), 'logIndex': '0', 'from': WALLET, 'to': '0xpool',
+         'tokenSymbol': 'eth', 'tokenName': 'Ether', 'tokenDecimal': '18', 'value': str(10 ** 18), 'timeStamp': '0'},
+        {'hash': '0x{}'.format(block), 'blockNumber': str(block), 'logIndex': '1', 'from': '0xpool', 'to': WALLET,
+         'tokenSymbol': 'eth', 'tokenName': 'Ether', 'tokenDecimal': '18', 'value': str(2 * 10 ** 18), 'timeStamp': '0'},
+    ]
+
+
+class StubEtherscanHandler(http.server.BaseHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        params = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+        start_block = int(params['startblock'][0])
+        end_block = int(params['endblock'][0])
+        self.requests.append((start_block, end_block,))
+        if start_block == end_block:
+            # Later blocks answer first, so results complete out of CSV order
+            time.sleep((10 - start_block) * 0.01)
+            transfers = stub_transfers(start_block)
+        else:
+            transfers = []
+            for block in range(start_block, end_block + 1):
+                transfers += stub_transfers(block)
+            transfers = transfers[:int(params['offset'][0])]
+        body = json.dumps({'message': 'OK', 'result': transfers}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class EtherscanTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StubEtherscanHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.csv_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.csv_dir.cleanup)
+
+    def write_csv(self, blocks):
+        filename = os.path.join(self.csv_dir.name, 'etherscan.csv')
+        with open(filename, 'w') as f:
+            f.write(','.join('"{}"'.format(field) for field in ETHERSCAN_CSV_FIELDS) + '\n')
+            for block in blocks:
+                f.write('0x{block},{block},0,2021-01-01 00:00:00,{wallet},0xpool,,0,0,0,0.01,20,2000,,\n'.format(
+                    block=block, wallet=WALLET))
+        return filename
+
+    def get_trades(self, blocks, **kwargs):
+        filename = self.write_csv(blocks)
+        port = self.server.server_address[1]
+        endpoint = 'http://127.0.0.1:{}/api?module=account&action=tokentx&address={{wallet}}&startblock={{block}}&endblock={{block}}&apikey={{token}}'.format(port)
+        range_endpoint = 'http://127.0.0.1:{}/api?module=account&action=tokentx&address={{wallet}}&startblock={{start}}&endblock={{end}}&page=1&offset={{offset}}&sort=asc&apikey={{token}}'.format(port)
+        StubEtherscanHandler.requests = []
+        with mock.patch('src.wallets.etherscan.ETHERSCAN_PRIMARY_TRADES_FILE', filename), \
+                mock.patch('src.wallets.etherscan.ETHERSCAN_TRANSACTION_API_ENDPOINT', endpoint), \
+                mock.patch('src.wallets.etherscan.ETHERSCAN_TRANSACTIONS_RANGE_API_ENDPOINT', range_endpoint), \
+                mock.patch('src.wallets.etherscan.ETHERSCAN_PAGE_SIZE', 5):
+            return get_standard_trades_deposits_withdrawals(WALLET, max_workers=8, **kwargs)
+
+    def check_trades(self, trades, deposits, withdrawals):
+        self.assertEqual(16, len(trades))
+        self.assertEqual(['0x{}:{}'.format(block, counter) for block in range(1, 9) for counter in range(2)],
+                         [trade[0] for trade in trades])
+        # The gas fee is charged to the sell side
+        self.assertEqual(['SELL', 2000 - 20.0, 'BUY', 4000.0], [trades[0][1], trades[0][6], trades[1][1], trades[1][6]])
+        self.assertEqual(([], [],), (deposits, withdrawals,))
+
+    def test_concurrent_lookups_keep_csv_order(self):
+        self.check_trades(*self.get_trades(range(1, 9), range_queries=False))
+        self.assertEqual(8, len(StubEtherscanHandler.requests))
+
+    def test_range_queries_page_through_the_block_range(self):
+        self.check_trades(*self.get_trades(range(1, 9)))
+        self.assertEqual([(1, 8), (3, 8), (5, 8), (7, 8)], StubEtherscanHandler.requests)
+
+if __name__ == '__main__':
+    unittest.main()
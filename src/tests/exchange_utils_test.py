@@ -1,7 +1,16 @@
-from src.exchanges.utils import process_buys, process_sells, calculate_hifo_obligation_after_sale
+from src.exchanges.audit import AuditRecord
+from src.exchanges.coinbase import COINBASE_TRADES_CSV_FIELDS
+from src.exchanges.kraken import KRAKEN_TRADES_CSV_FIELDS
+from src.exchanges.utils import (match_asset_sells, merge_trade_streams, process_buys, process_sells, process_trade_stream,
+                                 process_trades)
+
+import src.exchanges.coinbase as coinbase
+import src.exchanges.kraken as kraken
 
 import datetime
 import mock
+import os
+import tempfile
 import unittest
 
 
@@ -28,6 +37,123 @@ class ExchangeUtilsTest(unittest.TestCase):
         expected_fee = 1.40
         self.assertEqual((expected_bases, expected_fee,), process_buys(buys))
 
+    def test_process_sells_consumes_lots_in_place(self):
+        date_1 = datetime.datetime.strptime('4/25/2020 8:00', "%m/%d/%Y %H:%M")
+        date_2 = datetime.datetime.strptime('4/25/2020 9:00', "%m/%d/%Y %H:%M")
+        date_3 = datetime.datetime.strptime('4/25/2020 10:00', "%m/%d/%Y %H:%M")
+        date_4 = datetime.datetime.strptime('4/25/2020 11:00', "%m/%d/%Y %H:%M")
+        basis_dict = {
+            'BTC': [
+                (date_1, 100.0, 2.0, 'trade_1'),
+                (date_2, 300.0, 1.0, 'trade_2'),
+                (date_4, 500.0, 1.0, 'trade_4'),
+            ],
+        }
+        sells = [
+            ['trade_3', 'SELL', date_3, 2.0, 'BTC', 1.0, 400.0],
+            ['trade_5', 'SELL', date_4, 2.0, 'ETH', 1.0, 40.0],
+        ]
+        short_term, long_term, audit, no_basis, fees = process_sells(sells, basis_dict)
+        self.assertEqual(0.0, short_term)
+        self.assertEqual(0, long_term)
+        self.assertEqual([
+            AuditRecord('BTC', 'SELL', date_2, 300.0, 1.0, 'trade_2', date_3, 200.0, 1.0, 'trade_3', -100.0),
+            AuditRecord('BTC', 'SELL', date_1, 100.0, 1.0, 'trade_1', date_3, 200.0, 1.0, 'trade_3', 100.0),
+        ], audit.records)
+        self.assertEqual(0, audit.total)
+        self.assertEqual({'BTC': [], 'ETH': [(date_4, 20.0, 2.0, 'trade_5')]}, no_basis)
+        self.assertEqual(2.0, fees)
+        # The partially sold lot keeps its place, lots dated after the sale are untouched
+        self.assertEqual({
+            'BTC': [
+                (date_1, 100.0, 1.0, 'trade_1'),
+                (date_4, 500.0, 1.0, 'trade_4'),
+            ],
+        }, basis_dict)
+
+    def test_parallel_process_sells_matches_serial(self):
+        start = datetime.datetime(2019, 1, 1)
+        buys = []
+        sells = []
+        for i in range(200):
+            asset = ['BTC', 'ETH', 'KNC', 'LINK'][i % 4]
+            date = start + datetime.timedelta(hours=7 * i)
+            buys.append(['buy_{}'.format(i), 'BUY', date, 1.0 + i % 3, asset, 0.1, 10.0 + (i * 37) % 101])
+            sells.append(['sell_{}'.format(i), 'SELL', date + datetime.timedelta(days=i % 400),
+                          0.7 + i % 2, asset, 0.1, 12.0 + (i * 53) % 89])
+        sells.sort(key=lambda x: x[2])
+
+        serial_bases, _ = process_buys(buys)
+        serial = process_sells(sells, serial_bases)
+        parallel_bases, _ = process_buys(buys)
+        parallel = process_sells(sells, parallel_bases, parallel=True, max_workers=2)
+        self.assertEqual(repr(serial[:2] + serial[3:]), repr(parallel[:2] + parallel[3:]))
+        self.assertEqual(repr(serial[2].records), repr(parallel[2].records))
+        self.assertEqual(repr(serial_bases), repr(parallel_bases))
+
+    def test_process_sells_writes_each_asset_as_it_is_matched(self):
+        date_1 = datetime.datetime(2020, 1, 1)
+        date_2 = datetime.datetime(2020, 2, 1)
+        basis_dict = {'BTC': [(date_1, 100.0, 1.0, 'buy_1')], 'ETH': [(date_1, 10.0, 2.0, 'buy_2')]}
+        sells = [
+            ['sell_1', 'SELL', date_2, 1.0, 'ETH', 0, 20.0],
+            ['sell_2', 'SELL', date_2, 0.5, 'BTC', 0, 60.0],
+            ['sell_3', 'SELL', date_2, 0.5, 'BTC', 0, 70.0],
+        ]
+        events = []
+        audit = mock.Mock(write=lambda record: events.append(record.exit_trade_id))
+        with mock.patch('src.exchanges.utils.match_asset_sells',
+                        side_effect=lambda asset_sells, *args: events.append(asset_sells[0][4]) or
+                        match_asset_sells(asset_sells, *args)):
+            short_term, _, _, _, _ = process_sells(sells, basis_dict, audit=audit)
+        # Only one asset's matches are held at a time, assets in the order of their first sale
+        self.assertEqual(['ETH', 'sell_1', 'BTC', 'sell_2', 'sell_3'], events)
+        self.assertEqual(10.0 + 20.0 + 10.0, short_term)
+
+    @mock.patch('builtins.print')
+    @mock.patch('src.exchanges.lot_book.COMPACT_MIN_LOTS', 8)
+    def test_process_trade_stream_matches_process_trades(self, _):
+        start = datetime.datetime(2019, 1, 1)
+        rows = []
+        for i in range(300):
+            asset = ['BTC', 'ETH', 'KNC'][i % 3]
+            date = start + datetime.timedelta(hours=5 * i)
+            rows.append(['buy_{}'.format(i), 'BUY', date, 1.0 + i % 3, asset, 0.1, 10.0 + (i * 37) % 101])
+            rows.append(['sell_{}'.format(i), 'SELL', date + datetime.timedelta(days=i % 500),
+                         0.5 + i % 4, asset, 0.1, 12.0 + (i * 53) % 89])
+            rows.append(['burn_{}'.format(i), 'BURN', date + datetime.timedelta(hours=1), 0.01, asset, 0, 0])
+        rows.append(['sell_doge', 'SELL', start, 1.0, 'DOGE', 0.1, 1.0])
+        rows.sort(key=lambda x: x[2])
+        for strategy in ['fifo', 'lifo', 'hifo', 'lofo']:
+            self.assertEqual(process_trades(rows, strategy), process_trade_stream(iter(rows), strategy))
+        with self.assertRaises(ValueError):
+            process_trade_stream(reversed(rows))
+
+    def test_merge_trade_streams(self):
+        coinbase_lines = [
+            ','.join(COINBASE_TRADES_CSV_FIELDS),
+            'default,1,BTC-USD,BUY,2021-01-01T10:00:00.000Z,0.1,BTC,30000,1.5,-3001.5,USD',
+            'default,2,BTC-USD,SELL,2021-01-03T10:00:00.000Z,0.1,BTC,40000,2.0,3998.0,USD',
+        ]
+        kraken_lines = [
+            ','.join(KRAKEN_TRADES_CSV_FIELDS),
+            'T2,O2,XXBTZUSD,2021-01-04 10:00:00.0,sell,limit,40000.0,4000.0,7.8,0.1,0.00000000,,L2',
+            'T1,O1,XXBTZUSD,2021-01-02 10:00:00.0,buy,limit,30000.0,3000.0,7.8,0.1,0.00000000,,L1',
+        ]
+        with tempfile.TemporaryDirectory() as csv_dir:
+            coinbase_file = os.path.join(csv_dir, 'coinbase_trades.csv')
+            kraken_file = os.path.join(csv_dir, 'kraken_trades.csv')
+            with open(coinbase_file, 'w') as f:
+                f.write('\n'.join(coinbase_lines) + '\n')
+            with open(kraken_file, 'w') as f:
+                f.write('\n'.join(kraken_lines) + '\n')
+            merged = list(merge_trade_streams(
+                coinbase.iter_standard_trades(coinbase_file), kraken.iter_standard_trades(kraken_file)))
+            expected = sorted(coinbase.get_standard_trades(coinbase_file) + kraken.get_standard_trades(kraken_file),
+                              key=lambda x: x[2])
+        self.assertEqual(expected, merged)
+        self.assertEqual(['COINBASE:1', 'KRAKEN:T1:O1', 'COINBASE:2', 'KRAKEN:T2:O2'], [row[0] for row in merged])
+
 
 if __name__ == '__main__':
     unittest.main()
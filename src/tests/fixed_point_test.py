@@ -0,0 +1,53 @@
+from src.benchmarks.suite import generate_trades
+from src.exchanges.audit import AuditList
+from src.exchanges.cost_basis import FIFO
+from src.exchanges.fixed_point import DECIMAL, FIXED_POINT, ExactLotBook, process_trades_fixed_point
+from src.exchanges.utils import process_trade_stream
+
+import datetime
+import mock
+import unittest
+
+DATE = datetime.datetime(2020, 1, 1)
+
+
+class FixedPointTest(unittest.TestCase):
+
+    @mock.patch('builtins.print')
+    def test_lots_are_consumed_exactly(self, print_mock):
+        rows = [
+            ['T1', 'BUY', DATE, 0.1, 'BTC', 0, 1000.0],
+            ['T2', 'BUY', DATE + datetime.timedelta(hours=1), 0.2, 'BTC', 0, 2000.0],
+            ['T3', 'SELL', DATE + datetime.timedelta(days=1), 0.3, 'BTC', 0, 3300.0],
+        ]
+        for numbers in [FIXED_POINT, DECIMAL]:
+            print_mock.reset_mock()
+            audit = AuditList()
+            self.assertEqual((300.0, 0.0,), process_trades_fixed_point(rows, 'fifo', numbers=numbers, audit=audit))
+            self.assertEqual([0.1, 0.2], [record.entry_size for record in audit.records])
+            self.assertEqual([100.0, 200.0], [record.obligation for record in audit.records])
+            printed = [call[0][0] for call in print_mock.call_args_list if call[0]]
+            self.assertEqual('Leftover assets:', printed[-1])
+
+    def test_partial_sales_split_the_cost_without_drift(self):
+        lot_book = ExactLotBook(FIXED_POINT)
+        lot_book.add_lot(DATE, 3, 100, 'T1')
+        costs = []
+        for i in range(3):
+            sale_date = DATE + datetime.timedelta(days=i + 1)
+            costs += [entry_cost for _, _, _, entry_cost in lot_book.match(FIFO, 1, sale_date, 'S{}'.format(i))]
+        self.assertEqual([33, 33, 34], costs)
+        self.assertEqual([], lot_book.remaining_lots())
+
+    @mock.patch('builtins.print')
+    def test_backends_agree_with_floats_to_the_cent(self, _):
+        rows = generate_trades(2000, assets=['BTC', 'ETH'], fills_per_order=3)
+        for strategy in ['fifo', 'hifo']:
+            expected = process_trade_stream(rows, strategy)
+            for numbers in [FIXED_POINT, DECIMAL]:
+                for total, expected_total in zip(process_trades_fixed_point(rows, strategy, numbers=numbers), expected):
+                    self.assertAlmostEqual(expected_total, total, delta=0.01)
+
+
+if __name__ == '__main__':
+    unittest.main()
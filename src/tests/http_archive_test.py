@@ -0,0 +1,92 @@
+from src.exchanges.http_archive import DATA_FILE, INDEX_FILE, ArchiveMissError, HttpArchive, normalize_url
+from src.exchanges.utils import get_request_with_retry
+
+import mock
+import os
+import tempfile
+import unittest
+
+KLINES_URL = 'https://api.binance.com/api/v3/klines?symbol=BTCUSDT&interval=1m&startTime=1&endTime=2'
+
+
+class HttpArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.archive_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.archive_dir.cleanup)
+
+    def open_archive(self, mode='record'):
+        archive = HttpArchive(self.archive_dir.name, mode)
+        self.addCleanup(archive.close)
+        return archive
+
+    def test_normalize_url(self):
+        self.assertEqual(
+            'https://api.etherscan.io/api?action=tokentx&address=0xabc&module=account',
+            normalize_url('HTTPS://API.Etherscan.io/api?module=account&apikey=SECRET&address=0xabc&action=tokentx'))
+
+    @mock.patch('src.exchanges.http_client.get_json')
+    def test_record_then_replay(self, get_json_mock):
+        get_json_mock.side_effect = lambda url, headers, num_retries: [[url.count('&')]]
+        archive = self.open_archive()
+        self.assertEqual([[3]], archive.get_json(KLINES_URL, {}))
+        # The same request with its parameters reordered is a hit
+        self.assertEqual([[3]], archive.get_json(
+            'https://api.binance.com/api/v3/klines?endTime=2&startTime=1&interval=1m&symbol=BTCUSDT', {}))
+        self.assertEqual(1, get_json_mock.call_count)
+
+        get_json_mock.side_effect = None
+        get_json_mock.return_value = None
+        self.assertIsNone(archive.get_json('https://api.binance.com/api/v3/missing', {}))
+        self.assertEqual(1, len(archive))
+
+        replay = self.open_archive('replay')
+        self.assertEqual([[3]], replay.get_json(KLINES_URL, {}))
+        with self.assertRaises(ArchiveMissError):
+            replay.get_json('https://api.binance.com/api/v3/missing', {})
+        self.assertEqual(2, get_json_mock.call_count)
+
+    def test_interrupted_writes_are_recovered(self):
+        archive = self.open_archive()
+        archive.put(KLINES_URL, {'a': 1})
+        archive.put(KLINES_URL + '&limit=1', {'b': 2})
+        archive.close()
+        # Lose the index and leave half a record behind
+        os.remove(os.path.join(self.archive_dir.name, INDEX_FILE))
+        with open(os.path.join(self.archive_dir.name, DATA_FILE), 'ab') as f:
+            f.write(b'\x00' * 10)
+        archive = self.open_archive()
+        self.assertEqual({'b': 2}, archive.get(KLINES_URL + '&limit=1'))
+        self.assertEqual(2, len(archive))
+        archive.put(KLINES_URL + '&limit=2', {'c': 3})
+        self.assertEqual({'c': 3}, self.open_archive('replay').get(KLINES_URL + '&limit=2'))
+
+    def test_replay_only_reads_the_archive(self):
+        archive = self.open_archive()
+        archive.put(KLINES_URL, {'a': 1})
+        archive.close()
+        data_file = os.path.join(self.archive_dir.name, DATA_FILE)
+        os.remove(os.path.join(self.archive_dir.name, INDEX_FILE))
+        with open(data_file, 'ab') as f:
+            f.write(b'\x00' * 10)
+        size = os.path.getsize(data_file)
+        os.chmod(data_file, 0o444)
+        archive = self.open_archive('replay')
+        self.assertEqual({'a': 1}, archive.get(KLINES_URL))
+        with self.assertRaises(ValueError):
+            archive.put(KLINES_URL + '&limit=1', {'b': 2})
+        # The torn write is skipped, not repaired
+        self.assertEqual(size, os.path.getsize(data_file))
+        self.assertFalse(os.path.exists(os.path.join(self.archive_dir.name, INDEX_FILE)))
+
+    @mock.patch('src.exchanges.http_client.get_json')
+    def test_get_request_with_retry_goes_through_the_archive(self, get_json_mock):
+        archive = self.open_archive()
+        archive.put(KLINES_URL, [[1]])
+        with mock.patch('src.exchanges.http_archive.ARCHIVE', archive):
+            self.assertEqual([[1]], get_request_with_retry(KLINES_URL, {}))
+        get_json_mock.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+from src.exchanges import http_client
+
+import mock
+import requests
+import threading
+import unittest
+
+
+def fake_response(status_code, body=None, headers=None):
+    response = mock.Mock()
+    response.status_code = status_code
+    response.headers = headers or {}
+    response.json.return_value = body
+    if status_code >= 400:
+        response.raise_for_status.side_effect = requests.exceptions.HTTPError(str(status_code))
+    return response
+
+
+class HttpClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.session = mock.Mock()
+        host_patcher = mock.patch('src.exchanges.http_client.get_host',
+                                  return_value=(self.session, threading.BoundedSemaphore(1)))
+        host_patcher.start()
+        self.addCleanup(host_patcher.stop)
+        stats_patcher = mock.patch('src.exchanges.http_client.HTTP_STATS', {})
+        stats_patcher.start()
+        self.addCleanup(stats_patcher.stop)
+
+    @mock.patch('time.sleep')
+    def test_permanent_client_errors_are_not_retried(self, sleep_mock):
+        self.session.get.return_value = fake_response(404)
+        self.assertIsNone(http_client.get_json('https://example.com/missing', {}))
+        self.assertEqual(1, self.session.get.call_count)
+        sleep_mock.assert_not_called()
+
+    @mock.patch('time.sleep')
+    def test_rate_limited_requests_wait_for_retry_after(self, sleep_mock):
+        self.session.get.side_effect = [fake_response(429, headers={'Retry-After': '3'}), fake_response(200, [1])]
+        self.assertEqual([1], http_client.get_json('https://example.com/prices', {}))
+        sleep_mock.assert_called_once_with(3)
+        self.assertEqual({'requests': 2, 'retries': 1, 'sleep_seconds': 3, 'rate_limit_seconds': 0},
+                         http_client.get_http_stats()['example.com'])
+
+    @mock.patch('random.uniform', return_value=0.5)
+    @mock.patch('time.sleep')
+    def test_server_errors_back_off_with_jitter(self, sleep_mock, uniform_mock):
+        self.session.get.side_effect = [fake_response(503), fake_response(502), fake_response(200, [])]
+        self.assertEqual([], http_client.get_json('https://example.com/prices', {}))
+        self.assertEqual([mock.call(0, 1), mock.call(0, 2)], uniform_mock.call_args_list)
+        self.assertEqual([mock.call(0.5), mock.call(0.5)], sleep_mock.call_args_list)
+
+    @mock.patch('time.sleep')
+    def test_gives_up_after_the_last_retry(self, sleep_mock):
+        self.session.get.return_value = fake_response(500)
+        self.assertIsNone(http_client.get_json('https://example.com/prices', {}, num_retries=3))
+        self.assertEqual(3, self.session.get.call_count)
+        self.assertEqual(2, sleep_mock.call_count)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+from src.exchanges.incremental import IncrementalLedger, process_trades_incremental
+from src.exchanges.utils import process_buys, process_sells, split_buys_and_sells
+
+import datetime
+import mock
+import os
+import random
+import tempfile
+import unittest
+
+
+class IncrementalTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = random.Random(1)
+        start = datetime.datetime(2019, 1, 1)
+        self.rows = []
+        for i in range(1500):
+            date = start + datetime.timedelta(minutes=rng.randrange(0, 10 ** 6))
+            self.rows.append(['trade_{}'.format(i), rng.choice(['BUY', 'BUY', 'SELL', 'BURN']), date,
+                              rng.uniform(0.1, 3), rng.choice(['BTC', 'ETH', 'KNC']), 0.1, rng.uniform(1, 100)])
+        self.rows.sort(key=lambda x: x[2])
+
+    def assert_matches_batch(self, ledger, strategy):
+        buys, sells = split_buys_and_sells(self.rows)
+        basis_dict, _ = process_buys(buys)
+        short_term, long_term, _, sold_assets_with_no_basis, _ = process_sells(sells, basis_dict, strategy)
+        incremental_short_term, incremental_long_term, _ = ledger.get_totals()
+        self.assertAlmostEqual(short_term, incremental_short_term)
+        self.assertAlmostEqual(long_term, incremental_long_term)
+        for asset, asset_ledger in ledger.assets.items():
+            self.assertEqual(basis_dict[asset], asset_ledger.lot_book.remaining())
+            self.assertEqual(sold_assets_with_no_basis.get(asset, {}), asset_ledger.no_basis.get(asset, {}))
+
+    def test_appended_trades_match_batch(self):
+        for strategy in ['fifo', 'hifo']:
+            ledger = IncrementalLedger(strategy)
+            self.assertEqual({'BTC', 'ETH', 'KNC'}, ledger.update(self.rows[:1000]))
+            ledger.update(self.rows)
+            self.assertEqual(set(), ledger.update(self.rows))
+            self.assert_matches_batch(ledger, strategy)
+
+    def test_late_trades_replay_from_earliest_affected_date(self):
+        for strategy in ['lifo', 'lofo']:
+            ledger = IncrementalLedger(strategy)
+            ledger.update([row for i, row in enumerate(self.rows) if i % 7 != 3])
+            self.assertEqual({'BTC', 'ETH', 'KNC'}, ledger.update(self.rows))
+            self.assert_matches_batch(ledger, strategy)
+        late_btc = [row for row in self.rows[:100] if row[4] == 'BTC'][-1]
+        ledger = IncrementalLedger()
+        ledger.update([row for row in self.rows if row is not late_btc])
+        self.assertEqual({'BTC'}, ledger.update(self.rows))
+
+    def test_late_trades_after_reload(self):
+        with tempfile.TemporaryDirectory() as state_dir:
+            state_file = os.path.join(state_dir, 'incremental.sqlite3')
+            ledger = IncrementalLedger.load(state_file, 'lifo')
+            ledger.update([row for i, row in enumerate(self.rows) if i % 50 != 7])
+            ledger.save()
+            ledger.close()
+            ledger = IncrementalLedger.load(state_file, 'lifo')
+            self.assertEqual({'BTC', 'ETH', 'KNC'}, ledger.update(self.rows))
+            self.assert_matches_batch(ledger, 'lifo')
+            # The saved sales carry their lot matches and can be read from a date
+            sales = list(ledger.get_sales('ETH'))
+            self.assertEqual(len([row for row in self.rows if row[4] == 'ETH' and row[1] != 'BUY']), len(sales))
+            self.assertAlmostEqual(ledger.assets['ETH'].audit.total, sum(
+                match.obligation for trade, obligation in sales if trade[1] == 'SELL' and obligation
+                for match in obligation[3]))
+            start_date = sales[len(sales) // 2][0][2]
+            self.assertEqual(sales[len(sales) // 2:], list(ledger.get_sales('ETH', start_date)))
+            ledger.close()
+
+    def test_reexport_with_prepended_rows(self):
+        # Binance numbers rows from the top of a newest-first export, so a new
+        # row shifts the ID of every older one
+        def export(trades):
+            return [['BINANCE:{}'.format(i)] + trade for i, trade in enumerate(reversed(trades))]
+        trades = [
+            ['BUY', datetime.datetime(2021, 1, 1), 1.0, 'BTC', 0, 100.0],
+            ['SELL', datetime.datetime(2021, 2, 1), 0.5, 'BTC', 0, 100.0],
+        ]
+        ledger = IncrementalLedger('fifo')
+        ledger.update(export(trades))
+        self.assertEqual(50.0, ledger.get_totals()[0])
+        trades.append(['SELL', datetime.datetime(2021, 3, 1), 0.1, 'BTC', 0, 20.0])
+        self.assertEqual({'BTC'}, ledger.update(export(trades)))
+        self.assertEqual(60.0, ledger.get_totals()[0])
+        self.assertAlmostEqual(0.4, sum(lot[2] for lot in ledger.get_open_lots()['BTC']))
+        # Identical trades on the same minute are told apart by their order
+        trades.append(list(trades[-1]))
+        self.assertEqual({'BTC'}, ledger.update(export(trades)))
+        self.assertEqual(set(), ledger.update(export(trades)))
+        self.assertAlmostEqual(70.0, ledger.get_totals()[0])
+
+    @mock.patch('builtins.print')
+    def test_state_is_saved_between_runs(self, _):
+        with tempfile.TemporaryDirectory() as state_dir:
+            state_file = os.path.join(state_dir, 'incremental.sqlite3')
+            first = process_trades_incremental(self.rows[:1000], state_file=state_file)
+            self.assertEqual(first, process_trades_incremental(self.rows[:1000], state_file=state_file))
+            ledger = IncrementalLedger.load(state_file)
+            self.assertEqual(1000, len(ledger.get_trade_ids()))
+            ledger.close()
+            process_trades_incremental(self.rows, state_file=state_file)
+            ledger = IncrementalLedger.load(state_file)
+            self.assert_matches_batch(ledger, 'hifo')
+            ledger.close()
+            # Another strategy starts over
+            ledger = IncrementalLedger.load(state_file, 'fifo')
+            self.assertEqual(0, len(ledger.get_trade_ids()))
+            self.assertEqual({}, ledger.assets)
+            ledger.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+from src.exchanges.utils import process_trades
+
+import datetime
+import mock
+import os
+import src.exchanges.instrumentation as instrumentation
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+
+class InstrumentationTest(unittest.TestCase):
+
+    def setUp(self):
+        instrumentation.reset()
+        self.addCleanup(instrumentation.reset)
+
+    @mock.patch('src.exchanges.instrumentation.ENABLED', False)
+    def test_disabled_records_nothing(self):
+        instrumentation.timed('stage')(instrumentation.count)('rows parsed', 10)
+        self.assertEqual({}, instrumentation.TIMERS)
+        self.assertEqual({}, instrumentation.COUNTERS)
+
+    @mock.patch('builtins.print')
+    @mock.patch('src.exchanges.instrumentation.ENABLED', True)
+    def test_process_trades_prints_stage_summary(self, print_mock):
+        date = datetime.datetime(2020, 1, 1)
+        rows = [
+            ['trade_1', 'BUY', date, 1.0, 'BTC', 0, 100.0],
+            ['trade_2', 'BUY', date + datetime.timedelta(hours=1), 1.0, 'BTC', 0, 100.0],
+            ['trade_3', 'SELL', date + datetime.timedelta(days=1), 1.5, 'BTC', 0, 300.0],
+            ['trade_4', 'SELL', date + datetime.timedelta(days=2), 1.0, 'ETH', 0, 10.0],
+        ]
+        process_trades(rows)
+        self.assertEqual(1, instrumentation.TIMERS['process_sells'][0])
+        self.assertEqual(1, instrumentation.TIMERS['calculate_obligation_after_sale'][0])
+        self.assertEqual(2, instrumentation.COUNTERS['lots matched'])
+        self.assertEqual(1, instrumentation.COUNTERS['sales matched'])
+        printed = [call[0][0] for call in print_mock.call_args_list if call[0]]
+        self.assertTrue(any(line.startswith('calculate_obligation_after_sale') for line in printed))
+
+    @mock.patch('builtins.print')
+    @mock.patch('src.exchanges.instrumentation.ENABLED', True)
+    def test_parallel_matching_is_counted_in_the_parent(self, _):
+        date = datetime.datetime(2020, 1, 1)
+        rows = []
+        for i, asset in enumerate(['BTC', 'ETH', 'KNC']):
+            rows.append(['buy_{}'.format(i), 'BUY', date, 2.0, asset, 0, 100.0])
+            rows.append(['sell_{}'.format(i), 'SELL', date + datetime.timedelta(days=1), 1.0, asset, 0, 80.0])
+        process_trades(rows, parallel=True, max_workers=2)
+        self.assertEqual(3, instrumentation.COUNTERS['sales matched'])
+        self.assertEqual(3, instrumentation.COUNTERS['lots matched'])
+
+    def test_profiler_only_starts_from_an_entry_point(self):
+        env = dict(os.environ, TAX_CALCULATOR_PROFILE='run.prof', PYTHONPATH='.')
+        output = subprocess.run([sys.executable, '-c', 'import src.exchanges.instrumentation as i; print(i.PROFILER)'],
+                                env=env, capture_output=True, text=True, check=True).stdout
+        self.assertEqual('None', output.strip())
+        with mock.patch('src.exchanges.instrumentation.PROFILE_FILE', 'run.prof'), \
+                mock.patch('src.exchanges.instrumentation.ENABLED', False), \
+                mock.patch('src.exchanges.instrumentation.start_profiler') as start_mock:
+            instrumentation.enable_from_environment()
+        start_mock.assert_called_once_with('run.prof')
+
+    def test_stack_sampler_writes_folded_stacks(self):
+        sampler = instrumentation.StackSampler(interval=0.0005)
+        sampler.enable()
+        try:
+            end = time.process_time() + 0.05
+            while time.process_time() < end:
+                pass
+        finally:
+            sampler.disable()
+        with tempfile.TemporaryDirectory() as profile_dir:
+            filename = os.path.join(profile_dir, 'profile.folded')
+            sampler.dump_stats(filename)
+            with open(filename) as f:
+                lines = f.read().splitlines()
+        self.assertTrue(lines)
+        stack, samples = lines[0].rsplit(' ', 1)
+        self.assertGreater(int(samples), 0)
+        self.assertIn('test_stack_sampler_writes_folded_stacks', ' '.join(lines))
+
+
+if __name__ == '__main__':
+    unittest.main()
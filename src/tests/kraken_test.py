@@ -0,0 +1,49 @@
+from src.exchanges.kraken import KRAKEN_TRADES_CSV_FIELDS, get_standard_trades, iter_standard_trades
+
+import datetime
+import os
+import tempfile
+import unittest
+
+
+class KrakenTest(unittest.TestCase):
+
+    def test_get_standard_trades(self):
+        lines = [
+            ','.join(KRAKEN_TRADES_CSV_FIELDS),
+            'T2,O2,XETHZUSD,2021-01-02 10:00:00.1234,sell,limit,700.0,700.0,1.82,1.0,0.00000000,,L2',
+            'T1,O1,XXBTZUSD,2021-01-01 10:00:00.5,buy,limit,30000.0,3000.0,7.8,0.1,0.00000000,,L1',
+            'T3,O3,USDTZUSD,2021-01-03 10:00:00.0,buy,limit,1.0,10.0,0.0,10.0,0.00000000,,L3',
+        ]
+        with tempfile.TemporaryDirectory() as csv_dir:
+            filename = os.path.join(csv_dir, 'kraken_trades.csv')
+            with open(filename, 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+            rows = get_standard_trades(filename)
+        self.assertEqual([
+            ['KRAKEN:T1:O1', 'BUY', datetime.datetime(2021, 1, 1, 10, 0, 0, 500000), 0.1, 'BTC', 7.8, 3007.8],
+            ['KRAKEN:T2:O2', 'SELL', datetime.datetime(2021, 1, 2, 10, 0, 0, 123400), 1.0, 'ETH', 1.82, 698.18],
+        ], rows)
+
+    def test_iter_standard_trades_reads_newest_first_statements_backwards(self):
+        lines = [
+            ','.join(KRAKEN_TRADES_CSV_FIELDS),
+            'T4,O4,XETHZUSD,2021-01-03 10:00:00.0,sell,limit,700.0,700.0,1.82,1.0,0.00000000,,L4',
+            'T2,O2,XETHZUSD,2021-01-02 10:00:00.0,buy,limit,600.0,600.0,1.56,1.0,0.00000000,,L2',
+            'T3,O3,XXBTZUSD,2021-01-02 10:00:00.0,buy,limit,30000.0,3000.0,7.8,0.1,0.00000000,,L3',
+            'T1,O1,XXBTZUSD,2021-01-01 10:00:00.0,buy,limit,30000.0,3000.0,7.8,0.1,0.00000000,,L1',
+        ]
+        with tempfile.TemporaryDirectory() as csv_dir:
+            filename = os.path.join(csv_dir, 'kraken_trades.csv')
+            with open(filename, 'w') as f:
+                f.write('\r\n'.join(lines) + '\r\n')
+            self.assertEqual(get_standard_trades(filename), list(iter_standard_trades(filename)))
+            # Out of order rows can't be streamed
+            with open(filename, 'w') as f:
+                f.write('\n'.join([lines[0], lines[4], lines[1], lines[2]]) + '\n')
+            with self.assertRaises(ValueError):
+                list(iter_standard_trades(filename))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+from src.exchanges.cost_basis import FIFO, HIFO
+from src.exchanges.lot_book import LotBook, count_lots_before, insert_lot
+
+import datetime
+import unittest
+
+
+class LotBookTest(unittest.TestCase):
+
+    def test_insert_lot_keeps_equal_timestamps_in_arrival_order(self):
+        date_1 = datetime.datetime(2020, 4, 25, 8)
+        date_2 = datetime.datetime(2020, 4, 25, 9)
+        lots = []
+        insert_lot(lots, (date_2, 1.0, 1.0, 'trade_1'))
+        insert_lot(lots, (date_1, 1.0, 1.0, 'trade_2'))
+        insert_lot(lots, (date_2, 1.0, 1.0, 'trade_3'))
+        insert_lot(lots, (date_1, 1.0, 1.0, 'trade_4'))
+        self.assertEqual(['trade_2', 'trade_4', 'trade_1', 'trade_3'], [lot[3] for lot in lots])
+
+    def test_count_lots_before_excludes_equal_timestamps(self):
+        date_1 = datetime.datetime(2020, 4, 25, 8)
+        date_2 = datetime.datetime(2020, 4, 25, 9)
+        lots = [
+            (date_1, 1.0, 1.0, 'trade_1'),
+            (date_2, 1.0, 1.0, 'trade_2'),
+            (date_2, 1.0, 1.0, 'trade_3'),
+        ]
+        self.assertEqual(0, count_lots_before(lots, date_1))
+        self.assertEqual(1, count_lots_before(lots, date_2))
+        self.assertEqual(3, count_lots_before(lots, date_2 + datetime.timedelta(seconds=1)))
+
+    def test_added_lot_before_last_sale_is_eligible(self):
+        date_1 = datetime.datetime(2020, 4, 25, 8)
+        date_2 = datetime.datetime(2020, 4, 25, 9)
+        date_3 = datetime.datetime(2020, 4, 25, 10)
+        lot_book = LotBook([(date_1, 1.0, 1.0, 'trade_1')])
+        self.assertEqual([(date_1, 1.0, 1.0, 'trade_1')], list(lot_book.match(FIFO, 1.0, date_3)))
+        lot_book.add((date_2, 2.0, 1.0, 'trade_2'))
+        self.assertEqual([(date_2, 2.0, 0.5, 'trade_2')], list(lot_book.match(FIFO, 0.5, date_3)))
+        self.assertEqual([(date_2, 2.0, 0.5, 'trade_2')], lot_book.remaining())
+
+    def test_compact_drops_consumed_lots(self):
+        date = datetime.datetime(2020, 4, 25, 8)
+        lot_book = LotBook([(date + datetime.timedelta(hours=i), float(i), 1.0, 'trade_{}'.format(i)) for i in range(6)])
+        sale_date = date + datetime.timedelta(hours=4)
+        self.assertEqual(3, len(list(lot_book.match(HIFO, 2.5, sale_date))))
+        lot_book.compact()
+        self.assertEqual(4, len(lot_book.lots))
+        self.assertEqual([(date + datetime.timedelta(hours=1), 1.0, 0.5, 'trade_1')],
+                         list(lot_book.match(HIFO, 0.5, sale_date)))
+        self.assertEqual([(date + datetime.timedelta(hours=5), 5.0, 1.0, 'trade_5'),
+                          (date + datetime.timedelta(hours=4), 4.0, 1.0, 'trade_4')],
+                         list(lot_book.match(HIFO, 2.0, sale_date + datetime.timedelta(hours=2))))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+from src.exchanges.binance import get_historical_price, prefetch_historical_prices
+from src.exchanges.ohlc_store import OhlcStore, get_symbol_file
+from src.exchanges.price_cache import PriceCache
+from src.exchanges.price_service import PriceService
+
+import datetime
+import mock
+import os
+import tempfile
+import unittest
+
+# 2020-12-31 03:39 UTC
+MINUTE = 1609385940
+
+
+class OhlcStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.store_dir.cleanup)
+        self.store = OhlcStore(self.store_dir.name)
+
+    def write_csv(self, name, lines):
+        filename = os.path.join(self.store_dir.name, name)
+        with open(filename, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        return filename
+
+    def test_import_binance_klines(self):
+        # Binance dumps have no header and millisecond open times
+        filename = self.write_csv('BTCUSDT-1m-2020-12.csv', [
+            '{},10,12,9,11,937.052,{},34885.95,50,781.946,29111.25,0'.format(
+                (MINUTE + 60 * i) * 1000, (MINUTE + 60 * i) * 1000 + 59999) for i in [2, 0, 1]
+        ])
+        self.assertEqual(3, self.store.import_files('btc', [filename]))
+        self.assertTrue(os.path.exists(get_symbol_file(self.store_dir.name, 'BTC')))
+        self.assertEqual((10.0, 12.0, 9.0, 11.0,), self.store.get_candle('BTC', MINUTE + 90))
+        self.assertIsNone(self.store.get_candle('BTC', MINUTE - 1))
+        self.assertIsNone(self.store.get_candle('BTC', MINUTE + 180))
+        self.assertIsNone(self.store.get_candle('ETH', MINUTE))
+        self.assertEqual(10.0, self.store.get_day_price('BTC', MINUTE - MINUTE % 86400))
+        # Daily candles are not precise enough for minute lookups
+        self.store.import_candles('ETH', [(1609372800, 700.0, 750.0, 690.0, 740.0)], interval=86400)
+        self.assertIsNone(self.store.get_candle('ETH', MINUTE))
+        self.assertEqual(700.0, self.store.get_day_price('ETH', 1609372800))
+
+    def test_imports_merge_with_the_stored_candles(self):
+        filename = self.write_csv('prices.csv', [
+            'timestamp,open,high,low,close',
+            '{},1,2,0.5,1.5'.format(MINUTE),
+            '{},3,4,2.5,3.5'.format(MINUTE + 60),
+        ])
+        self.store.import_files('KNC', [filename])
+        self.assertEqual(3, self.store.import_candles('KNC', [(MINUTE + 60, 5.0, 6.0, 4.5, 5.5), (MINUTE + 120, 1, 1, 1, 1)]))
+        # A fresh store reads the same file
+        store = OhlcStore(self.store_dir.name)
+        self.assertEqual((1.0, 2.0, 0.5, 1.5,), store.get_candle('KNC', MINUTE))
+        self.assertEqual((5.0, 6.0, 4.5, 5.5,), store.get_candle('KNC', MINUTE + 60))
+
+    @mock.patch('src.exchanges.utils.get_request_with_retry')
+    def test_binance_prices_come_from_the_store_first(self, request_mock):
+        self.store.import_candles('BNB', [(MINUTE, 10.0, 12.0, 9.0, 11.0)])
+        date = datetime.datetime.fromtimestamp(MINUTE)
+        with mock.patch('src.exchanges.ohlc_store.OHLC_STORE', self.store), \
+                mock.patch('src.exchanges.price_cache.PRICE_CACHE', PriceCache(':memory:')), \
+                mock.patch('src.exchanges.price_service.PRICE_SERVICE', PriceService()):
+            self.assertEqual(0, prefetch_historical_prices([('BNB', date, True,)]))
+            self.assertEqual(12.0, get_historical_price('BNB', date, True))
+            self.assertEqual(9.0, get_historical_price('BNB', date, False))
+        request_mock.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+from src.exchanges.binance import get_historical_price
+from src.exchanges.price_cache import BINANCE_KLINES, PriceCache
+from src.exchanges.price_service import PriceService
+
+import datetime
+import mock
+import os
+import tempfile
+import unittest
+
+
+class PriceCacheTest(unittest.TestCase):
+
+    def test_prices_survive_reopening(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            path = os.path.join(cache_dir, 'prices.sqlite3')
+            cache = PriceCache(path)
+            cache.put_many([
+                (BINANCE_KLINES, 'BTC', 60, True, 2.0),
+                (BINANCE_KLINES, 'BTC', 60, False, 1.0),
+                (BINANCE_KLINES, 'BTC', 120, True, 3.0),
+            ])
+            cache.close()
+
+            cache = PriceCache(path)
+            self.assertEqual(2.0, cache.get(BINANCE_KLINES, 'BTC', 60, True))
+            self.assertEqual(1.0, cache.get(BINANCE_KLINES, 'BTC', 60, False))
+            self.assertIsNone(cache.get(BINANCE_KLINES, 'ETH', 60, True))
+            self.assertEqual({(60, True): 2.0, (60, False): 1.0}, cache.get_range(BINANCE_KLINES, 'BTC', 0, 119))
+            cache.close()
+
+    def test_least_recently_used_prices_are_evicted(self):
+        cache = PriceCache(':memory:', max_entries=10)
+        with mock.patch('time.time', return_value=1):
+            cache.put_many([(BINANCE_KLINES, 'BTC', bucket, True, 1.0,) for bucket in range(10)])
+        with mock.patch('time.time', return_value=2):
+            cache.get(BINANCE_KLINES, 'BTC', 0, True)
+            cache.put(BINANCE_KLINES, 'BTC', 10, True, 1.0)
+        self.assertEqual(9, cache.size)
+        self.assertEqual(1.0, cache.get(BINANCE_KLINES, 'BTC', 0, True))
+        self.assertIsNone(cache.get(BINANCE_KLINES, 'BTC', 1, True))
+
+    @mock.patch('src.exchanges.utils.get_request_with_retry')
+    def test_binance_prices_are_fetched_once(self, request_mock):
+        request_mock.return_value = [[1609383540000, '10', '12', '9', '11', '937.05200000', 1609383599999,
+                                      '34885.95061710', 50, '781.94600000', '29111.25965560', '0']]
+        date = datetime.datetime(2020, 12, 31, 3, 39)
+        with mock.patch('src.exchanges.price_cache.PRICE_CACHE', PriceCache(':memory:')), \
+                mock.patch('src.exchanges.price_service.PRICE_SERVICE', PriceService()) as service:
+            self.assertEqual(12.0, get_historical_price('BTC', date, True))
+            # A new process only has the persistent cache
+            service.clear()
+            self.assertEqual(9.0, get_historical_price('BTC', date, False))
+            self.assertEqual(12.0, get_historical_price('BTC', date, True))
+        self.assertEqual(1, request_mock.call_count)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+from src.exchanges.binance import get_historical_price
+from src.exchanges.price_cache import BINANCE_KLINES, COINGECKO_HISTORY, PriceCache
+from src.exchanges.price_service import PriceService, get_bucket
+
+import concurrent.futures
+import datetime
+import mock
+import threading
+import unittest
+
+
+class PriceServiceTest(unittest.TestCase):
+
+    def test_get_bucket(self):
+        self.assertEqual(1609383540, get_bucket(BINANCE_KLINES, 1609383599))
+        self.assertEqual(1609372800, get_bucket(COINGECKO_HISTORY, 1609383599))
+
+    def test_repeated_lookups_share_one_fetch(self):
+        service = PriceService()
+        fetch = mock.Mock(return_value=2.0)
+        for _ in range(3):
+            self.assertEqual(2.0, service.get(COINGECKO_HISTORY, 'bitcoin', 0, fetch))
+        self.assertEqual(3.0, service.get(COINGECKO_HISTORY, 'bitcoin', 86400, lambda: 3.0))
+        self.assertEqual(1, fetch.call_count)
+        self.assertEqual((4, 2, 2,), (service.lookups, service.fetches, service.saved,))
+
+    def test_concurrent_lookups_wait_for_the_in_flight_fetch(self):
+        service = PriceService()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return 7.0
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            first = executor.submit(service.get, BINANCE_KLINES, 'BTC', 60, fetch)
+            started.wait(5)
+            others = [executor.submit(service.get, BINANCE_KLINES, 'BTC', 60, fetch) for _ in range(3)]
+            release.set()
+            self.assertEqual([7.0] * 4, [future.result() for future in [first] + others])
+        self.assertEqual(1, len(calls))
+        self.assertEqual(3, service.saved)
+
+    def test_failed_fetches_are_retried(self):
+        service = PriceService()
+        with self.assertRaises(ValueError):
+            service.get(BINANCE_KLINES, 'BTC', 60, mock.Mock(side_effect=ValueError))
+        self.assertEqual(1.0, service.get(BINANCE_KLINES, 'BTC', 60, lambda: 1.0))
+
+    @mock.patch('src.exchanges.utils.get_request_with_retry')
+    def test_buy_and_sell_legs_of_a_minute_share_one_fetch(self, request_mock):
+        request_mock.return_value = [[1609383540000, '10', '12', '9', '11', '937.05200000', 1609383599999,
+                                      '34885.95061710', 50, '781.94600000', '29111.25965560', '0']]
+        date = datetime.datetime(2020, 12, 31, 3, 39)
+        with mock.patch('src.exchanges.price_cache.PRICE_CACHE', PriceCache(':memory:')), \
+                mock.patch('src.exchanges.price_service.PRICE_SERVICE', PriceService()) as service:
+            self.assertEqual(12.0, get_historical_price('BNB', date, True))
+            self.assertEqual(9.0, get_historical_price('BNB', date, False))
+            self.assertEqual(12.0, get_historical_price('BNB', date, True))
+        self.assertEqual(1, request_mock.call_count)
+        self.assertEqual(2, service.saved)
+
+
+if __name__ == '__main__':
+    unittest.main()
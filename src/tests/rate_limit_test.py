@@ -0,0 +1,30 @@
+from src.exchanges.rate_limit import TokenBucket
+
+import mock
+import unittest
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    @mock.patch('time.sleep')
+    @mock.patch('time.monotonic')
+    def test_requests_beyond_the_burst_wait_for_tokens(self, monotonic_mock, sleep_mock):
+        now = [100.0]
+        monotonic_mock.side_effect = lambda: now[0]
+
+        def sleep(seconds):
+            now[0] += seconds
+        sleep_mock.side_effect = sleep
+
+        bucket = TokenBucket(5, capacity=2)
+        self.assertEqual(0, bucket.acquire())
+        self.assertEqual(0, bucket.acquire())
+        self.assertAlmostEqual(0.2, bucket.acquire())
+        now[0] += 1
+        self.assertEqual(0, bucket.acquire())
+        self.assertEqual(0, bucket.acquire())
+        self.assertAlmostEqual(0.2, bucket.acquire())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+from src.exchanges.snapshot import (StaleSnapshotError, YearSnapshot, get_carryforward_trades, hash_file,
+                                    load_or_build_snapshot, load_snapshot)
+from src.exchanges.utils import get_previous_year_leftovers, process_trades
+
+import datetime
+import mock
+import os
+import tempfile
+import unittest
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.date_1 = datetime.datetime(2019, 3, 1, 8)
+        self.date_2 = datetime.datetime(2019, 6, 1, 8)
+        self.date_3 = datetime.datetime(2019, 9, 1, 8)
+        self.rows = [
+            ['trade_1', 'BUY', self.date_1, 2.0, 'BTC', 1.0, 201.0],
+            ['trade_2', 'BUY', self.date_2, 1.0, 'ETH', 0.5, 30.5],
+            ['trade_3', 'SELL', self.date_3, 0.5, 'BTC', 1.0, 99.0],
+            ['trade_4', 'SELL', self.date_3, 1.0, 'KNC', 0.1, 2.0],
+        ]
+        csv_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(csv_dir.cleanup)
+        self.csv_dir = csv_dir.name
+        print_patcher = mock.patch('builtins.print')
+        print_patcher.start()
+        self.addCleanup(print_patcher.stop)
+
+    def write_csv(self, name, content):
+        filename = os.path.join(self.csv_dir, name)
+        with open(filename, 'w') as f:
+            f.write(content)
+        return filename
+
+    def test_snapshot_holds_leftovers_and_unmatched_sells(self):
+        csv_2019 = self.write_csv('trades_2019.csv', '2019')
+        path = os.path.join(self.csv_dir, 'snapshots', 'test_2019.json')
+        process_trades(self.rows, year_snapshot=YearSnapshot(path, [csv_2019]))
+        snapshot = load_snapshot(path)
+        self.assertEqual({
+            'BTC': [(self.date_1, 100.5, 1.5, 'trade_1')],
+            'ETH': [(self.date_2, 30.5, 1.0, 'trade_2')],
+        }, snapshot['basis_dict'])
+        self.assertEqual({'BTC': [], 'KNC': [(self.date_3, 2.0, 1.0, 'trade_4')]}, snapshot['sold_assets_with_no_basis'])
+        self.assertEqual(get_previous_year_leftovers(self.rows), get_carryforward_trades(snapshot))
+
+    def test_changed_csv_makes_later_years_stale(self):
+        csv_2019 = self.write_csv('trades_2019.csv', '2019')
+        csv_2020 = self.write_csv('trades_2020.csv', '2020')
+        path_2019 = os.path.join(self.csv_dir, 'test_2019.json')
+        path_2020 = os.path.join(self.csv_dir, 'test_2020.json')
+        process_trades(self.rows, year_snapshot=YearSnapshot(path_2019, [csv_2019]))
+        process_trades(get_carryforward_trades(load_snapshot(path_2019)),
+                       year_snapshot=YearSnapshot(path_2020, [csv_2020], previous_path=path_2019))
+        self.assertEqual(path_2019, load_snapshot(path_2020)['previous_path'])
+
+        self.write_csv('trades_2019.csv', '2019 amended')
+        with self.assertRaises(StaleSnapshotError):
+            load_snapshot(path_2019)
+        # A stale previous year fails the build before any trade is processed
+        os.remove(path_2020)
+        get_rows = mock.Mock(return_value=self.rows)
+        with self.assertRaises(StaleSnapshotError):
+            load_or_build_snapshot(path_2020, [csv_2020], get_rows, previous_path=path_2019)
+        get_rows.assert_not_called()
+        with self.assertRaises(StaleSnapshotError):
+            process_trades(self.rows, year_snapshot=YearSnapshot(path_2020, [csv_2020], previous_path=path_2019))
+
+        # Rebuilding 2019 gives it a new hash, which makes 2020 stale
+        process_trades(get_carryforward_trades(load_or_build_snapshot(path_2019, [csv_2019], get_rows)),
+                       year_snapshot=YearSnapshot(path_2020, [csv_2020], previous_path=path_2019))
+        load_or_build_snapshot(path_2019, [csv_2019], get_rows)
+        load_snapshot(path_2020)
+        self.write_csv('trades_2019.csv', '2019 amended twice')
+        load_or_build_snapshot(path_2019, [csv_2019], get_rows)
+        self.assertEqual(2, get_rows.call_count)
+        with self.assertRaises(StaleSnapshotError):
+            load_snapshot(path_2020)
+
+    def test_unchanged_sources_are_not_hashed_again(self):
+        csv_2019 = self.write_csv('trades_2019.csv', '2019')
+        csv_2020 = self.write_csv('trades_2020.csv', '2020')
+        path_2019 = os.path.join(self.csv_dir, 'test_2019.json')
+        path_2020 = os.path.join(self.csv_dir, 'test_2020.json')
+        with mock.patch('src.exchanges.snapshot.hash_file', wraps=hash_file) as hash_mock:
+            load_or_build_snapshot(path_2019, [csv_2019], mock.Mock(return_value=self.rows))
+            self.assertEqual(1, hash_mock.call_count)
+            load_or_build_snapshot(path_2020, [csv_2020], mock.Mock(return_value=self.rows), previous_path=path_2019)
+            self.assertEqual([mock.call(csv_2019), mock.call(csv_2020)], hash_mock.call_args_list)
+            load_snapshot(path_2020)
+            self.assertEqual(2, hash_mock.call_count)
+
+    def test_load_or_build_snapshot_only_replays_stale_years(self):
+        csv_2019 = self.write_csv('trades_2019.csv', '2019')
+        path = os.path.join(self.csv_dir, 'test_2019.json')
+        get_rows = mock.Mock(return_value=self.rows)
+        first = load_or_build_snapshot(path, [csv_2019], get_rows)
+        second = load_or_build_snapshot(path, [csv_2019], get_rows)
+        self.assertEqual(first, second)
+        self.assertEqual(1, get_rows.call_count)
+        # A different strategy changes the content hash
+        with open(path) as f:
+            content = f.read()
+        with open(path, 'w') as f:
+            f.write(content.replace('"strategy": "hifo"', '"strategy": "fifo"'))
+        load_or_build_snapshot(path, [csv_2019], get_rows)
+        self.assertEqual(2, get_rows.call_count)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+from src.exchanges.trade_table import TradeTable
+from src.exchanges.utils import process_buys, process_sells, split_buys_and_sells
+
+import datetime
+import unittest
+
+
+class TradeTableTest(unittest.TestCase):
+
+    def setUp(self):
+        start = datetime.datetime(2019, 5, 1, 12, 30, 15, 250000)
+        self.rows = []
+        for i in range(120):
+            asset = ['BTC', 'ETH', 'KNC'][i % 3]
+            action = 'BUY' if i % 5 < 3 else ['SELL', 'BURN'][i % 2]
+            self.rows.append(['TRADE:{}'.format(i), action, start + datetime.timedelta(days=i * 4, microseconds=i),
+                              0.5 + (i * 7) % 11, asset, 0.01 * i, 3.0 + (i * 31) % 97])
+
+    def test_rows_round_trip(self):
+        table = TradeTable.from_rows(self.rows)
+        self.assertEqual(len(self.rows), len(table))
+        self.assertEqual(self.rows, list(table))
+        self.assertEqual(self.rows[-1], table[-1])
+
+    def test_sorted_by_date_is_stable(self):
+        date = datetime.datetime(2020, 1, 1)
+        rows = [['b', 'BUY', date, 1.0, 'BTC', 0, 1.0],
+                ['a', 'BUY', date - datetime.timedelta(seconds=1), 1.0, 'ETH', 0, 1.0],
+                ['c', 'SELL', date, 1.0, 'BTC', 0, 1.0]]
+        self.assertEqual(sorted(rows, key=lambda x: x[2]), list(TradeTable.from_rows(rows).sorted_by_date()))
+
+    def test_engine_gives_the_same_results_for_tables_and_lists(self):
+        list_buys, list_sells = split_buys_and_sells(self.rows)
+        list_bases, list_buy_fees = process_buys(list_buys)
+        list_results = process_sells(list_sells, list_bases)
+
+        table_buys, table_sells = split_buys_and_sells(TradeTable.from_rows(self.rows))
+        self.assertIsInstance(table_sells, TradeTable)
+        table_bases, table_buy_fees = process_buys(table_buys)
+        table_results = process_sells(table_sells, table_bases, parallel=True, max_workers=2)
+
+        self.assertEqual(list_buy_fees, table_buy_fees)
+        self.assertEqual(repr(list_results[:2] + list_results[3:]), repr(table_results[:2] + table_results[3:]))
+        self.assertEqual(repr(list_results[2].records), repr(table_results[2].records))
+        self.assertEqual(repr(list_bases), repr(table_bases))
+
+
+if __name__ == '__main__':
+    unittest.main()
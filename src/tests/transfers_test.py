@@ -0,0 +1,133 @@
+from src.exchanges.audit import AuditList
+from src.exchanges.coinbase import COINBASE_DEPOSITS_CSV_FIELDS, get_deposits_and_withdrawals
+from src.exchanges.transfers import match_transfers, process_venue_trades
+from src.exchanges.utils import process_trade_stream
+
+import datetime
+import mock
+import os
+import tempfile
+import unittest
+
+DATE = datetime.datetime(2020, 1, 1)
+
+
+def transfer(transfer_id, action, days, size, asset='BTC'):
+    return [transfer_id, action, DATE + datetime.timedelta(days=days), size, asset, 0, 0]
+
+
+class TransfersTest(unittest.TestCase):
+
+    def test_match_transfers(self):
+        pairs = match_transfers({
+            'coinbase': [
+                transfer('W1', 'WITHDRAWAL', 1, 1.0),
+                transfer('W2', 'WITHDRAWAL', 2, 2.0),
+                transfer('W3', 'WITHDRAWAL', 3, 5.0),
+                # Deposits on the withdrawing venue never pair with its withdrawals
+                transfer('D0', 'DEPOSIT', 1, 1.0),
+            ],
+            'wallet': [
+                transfer('D1', 'DEPOSIT', 1.1, 0.999, 'btc'),
+                transfer('D2', 'DEPOSIT', 2.5, 1.99),
+                transfer('D3', 'DEPOSIT', 3.5, 4.0),  # too small
+                transfer('D4', 'DEPOSIT', 10, 5.0),  # too late
+                transfer('D5', 'DEPOSIT', 2.5, 2.0, 'ETH'),
+            ],
+        })
+        self.assertEqual([('coinbase', 'W1', 'wallet', 'D1'), ('coinbase', 'W2', 'wallet', 'D2')],
+                         [(w_venue, w[0], d_venue, d[0]) for w_venue, w, d_venue, d in pairs])
+
+    @mock.patch('builtins.print')
+    def test_lots_follow_transfers(self, print_mock):
+        trades_by_venue = {
+            'coinbase': [
+                ['COINBASE:1', 'BUY', DATE, 1.0, 'BTC', 0, 1000.0],
+                ['COINBASE:2', 'BUY', DATE + datetime.timedelta(days=1), 1.0, 'BTC', 0, 3000.0],
+            ],
+            'wallet': [
+                ['0xa:0', 'SELL', DATE + datetime.timedelta(days=5), 0.5, 'BTC', 0, 2500.0],
+            ],
+        }
+        transfers_by_venue = {
+            'coinbase': [transfer('COINBASE:W1', 'WITHDRAWAL', 2, 1.0)],
+            'wallet': [transfer('0xb:0', 'DEPOSIT', 3, 0.99)],
+        }
+        audit = AuditList()
+        short_term, long_term = process_venue_trades(trades_by_venue, transfers_by_venue, 'hifo', audit=audit)
+        # The wallet sells half of the moved 3000 lot, at its original date
+        self.assertEqual((1000.0, 0,), (short_term, long_term,))
+        self.assertEqual([('BURN', 'COINBASE:W1', 'COINBASE:2', DATE + datetime.timedelta(days=1),),
+                          ('SELL', '0xa:0', 'COINBASE:2', DATE + datetime.timedelta(days=1),)],
+                         [(record.action, record.exit_trade_id, record.entry_trade_id, record.entry_date,)
+                          for record in audit.records])
+        self.assertAlmostEqual(0.01, audit.records[0].entry_size)
+        self.assertEqual(0.5, audit.records[1].entry_size)
+        printed = [call[0][0] for call in print_mock.call_args_list if call[0]]
+        self.assertIn('Matched 1 of 1 withdrawals to deposits', printed)
+        self.assertIn('1.49 BTC', printed)
+
+        # Without the transfer the wallet has no lots to sell from
+        self.assertEqual((0, 0,), process_venue_trades(trades_by_venue, {}, 'hifo'))
+
+    @mock.patch('builtins.print')
+    def test_network_fee_is_burnt_from_the_moved_lots(self, _):
+        trades_by_venue = {
+            'coinbase': [
+                ['COINBASE:1', 'BUY', DATE, 1.0, 'BTC', 0, 1000.0],
+                ['COINBASE:2', 'BUY', DATE + datetime.timedelta(days=1), 1.0, 'BTC', 0, 3000.0],
+            ],
+            'wallet': [
+                ['0xa:0', 'SELL', DATE + datetime.timedelta(days=5), 1.98, 'BTC', 0, 7920.0],
+            ],
+        }
+        withdrawal = transfer('COINBASE:W1', 'WITHDRAWAL', 2, 2.0)
+        withdrawal[6] = 8000.0
+        transfers_by_venue = {'coinbase': [withdrawal], 'wallet': [transfer('0xb:0', 'DEPOSIT', 3, 1.98)]}
+        audit = AuditList()
+        short_term, _ = process_venue_trades(trades_by_venue, transfers_by_venue, 'fifo', audit=audit)
+        # 1% of each lot is burnt at the withdrawal, valued at $4000/BTC
+        burns = [record for record in audit.records if record.action == 'BURN']
+        self.assertEqual(['COINBASE:1', 'COINBASE:2'], [record.entry_trade_id for record in burns])
+        self.assertEqual({'COINBASE:W1'}, set(record.exit_trade_id for record in burns))
+        self.assertAlmostEqual(0.02, sum(record.entry_size for record in burns))
+        self.assertAlmostEqual(80.0 - 40.0, sum(record.obligation for record in burns))
+        # The wallet sells the rest at the same price: the burnt and the sold
+        # basis add up to the $4000 withdrawn
+        self.assertAlmostEqual(7920.0 - 3960.0, short_term)
+        self.assertAlmostEqual(4000.0, sum(record.entry_basis * record.entry_size for record in audit.records))
+
+    @mock.patch('builtins.print')
+    def test_one_venue_matches_the_trade_stream(self, _):
+        rows = [
+            ['T1', 'BUY', DATE, 1.0, 'BTC', 1.0, 100.0],
+            ['T2', 'BUY', DATE + datetime.timedelta(days=1), 1.0, 'BTC', 1.0, 300.0],
+            ['T3', 'SELL', DATE + datetime.timedelta(days=400), 1.5, 'BTC', 1.0, 600.0],
+            ['T4', 'BURN', DATE + datetime.timedelta(days=401), 0.1, 'BTC', 1.0, 0],
+        ]
+        for strategy in ['fifo', 'hifo']:
+            self.assertEqual(process_trade_stream(rows, strategy),
+                             process_venue_trades({'coinbase': rows}, {'coinbase': []}, strategy))
+
+    def test_coinbase_deposits_and_withdrawals(self):
+        lines = [
+            ','.join(COINBASE_DEPOSITS_CSV_FIELDS),
+            'default,deposit,2020-01-02T10:00:00.000Z,1000.0,1000.0,USD,t1,,',
+            'default,withdrawal,2020-01-05T10:00:00.000Z,-0.5,0.5,BTC,t3,,',
+            'default,match,2020-01-03T10:00:00.000Z,0.1,0.1,BTC,,100,o1',
+            'default,deposit,2020-01-04T10:00:00.000Z,1.0,1.0,BTC,t2,,',
+            'default,deposit,2020-01-06T10:00:00.000Z,250.0,250.0,USDC,t4,,',
+        ]
+        with tempfile.TemporaryDirectory() as csv_dir:
+            filename = os.path.join(csv_dir, 'coinbase_deposits.csv')
+            with open(filename, 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+            deposits, withdrawals = get_deposits_and_withdrawals(filename)
+        self.assertEqual([['COINBASE:t2', 'DEPOSIT', datetime.datetime(2020, 1, 4, 10), 1.0, 'BTC', 0, 0],
+                          ['COINBASE:t4', 'DEPOSIT', datetime.datetime(2020, 1, 6, 10), 250.0, 'USDC', 0, 0]], deposits)
+        self.assertEqual([['COINBASE:t3', 'WITHDRAWAL', datetime.datetime(2020, 1, 5, 10), 0.5, 'BTC', 0, 0]],
+                         withdrawals)
+
+
+if __name__ == '__main__':
+    unittest.main()
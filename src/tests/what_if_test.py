@@ -0,0 +1,69 @@
+from src.benchmarks.suite import generate_trades
+from src.exchanges.incremental import IncrementalLedger
+from src.exchanges.lot_book import LotBook
+from src.exchanges.utils import calculate_obligation_after_sale, process_buys
+from src.exchanges.what_if import SaleSimulator
+
+import copy
+import datetime
+import unittest
+
+NOW = datetime.datetime(2021, 6, 1)
+
+
+class WhatIfTest(unittest.TestCase):
+
+    def setUp(self):
+        self.basis_dict = {
+            'ETH': [
+                (datetime.datetime(2020, 1, 1), 100.0, 2.0, 'T1'),
+                (datetime.datetime(2021, 1, 1), 700.0, 1.0, 'T2'),
+                (datetime.datetime(2021, 2, 1), 1500.0, 0.5, 'T3'),
+                (datetime.datetime(2021, 7, 1), 2000.0, 1.0, 'T4'),  # bought after the sale
+            ],
+        }
+
+    def test_simulate_splits_short_and_long_term(self):
+        original = copy.deepcopy(self.basis_dict)
+        simulator = SaleSimulator(self.basis_dict, as_of=NOW)
+        what_if = simulator.simulate('ETH', 2.0, 1000.0, 'hifo')
+        # HIFO sells T3 and T2 (short term), then 0.5 of T1 (long term)
+        self.assertEqual((2.0, 1.5, 0.5,), (what_if.matched_size, what_if.short_term_size, what_if.long_term_size,))
+        self.assertEqual((1500.0 - 750.0 - 700.0, 500.0 - 50.0,), (what_if.short_term_gain, what_if.long_term_gain,))
+
+        what_if = simulator.simulate('ETH', 3.0, 1000.0, 'fifo')
+        self.assertEqual((2.0, 1.0,), (what_if.long_term_size, what_if.short_term_size,))
+        self.assertEqual((2000.0 - 200.0, 1000.0 - 700.0,), (what_if.long_term_gain, what_if.short_term_gain,))
+
+        # Only the 3.5 units bought before the sale have a basis
+        self.assertEqual(3.5, simulator.simulate('ETH', 10.0, 1000.0, 'lofo').matched_size)
+        self.assertEqual(0, simulator.simulate('BTC', 1.0, 1000.0).matched_size)
+        self.assertEqual(original, self.basis_dict)
+        with self.assertRaises(ValueError):
+            simulator.simulate('ETH', 1.0, 1000.0, 'specific_id')
+
+    def test_simulate_matches_a_real_sale(self):
+        buys = [row for row in generate_trades(500, assets=['BTC'], buy_ratio=1.0)]
+        basis_dict, _ = process_buys(buys)
+        simulator = SaleSimulator(basis_dict, as_of=NOW)
+        for strategy in ['fifo', 'lifo', 'hifo', 'lofo']:
+            for size in [0.5, 100.0, 1000.0]:
+                what_if = simulator.simulate('BTC', size, 300.0, strategy)
+                short_term, long_term, remaining_size, _ = calculate_obligation_after_sale(
+                    LotBook(basis_dict['BTC']), strategy, size, 300.0 * size, NOW, 'WHAT-IF')
+                self.assertAlmostEqual(short_term, what_if.short_term_gain, places=6)
+                self.assertAlmostEqual(long_term, what_if.long_term_gain, places=6)
+                self.assertAlmostEqual(size - remaining_size, what_if.matched_size, places=6)
+
+    def test_incremental_ledger_open_lots(self):
+        ledger = IncrementalLedger('hifo')
+        ledger.update([
+            ['T1', 'BUY', datetime.datetime(2021, 1, 1), 2.0, 'ETH', 0, 200.0],
+            ['T2', 'SELL', datetime.datetime(2021, 2, 1), 1.5, 'ETH', 0, 300.0],
+        ])
+        what_if = SaleSimulator(ledger.get_open_lots(), as_of=NOW).simulate('ETH', 1.0, 150.0)
+        self.assertEqual((0.5, 25.0,), (what_if.matched_size, what_if.short_term_gain,))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+#!/usr/local/bin/python3
+
+import functools
+import json
+import os
+import sqlite3
+import src.exchanges.price_cache as price_cache
+import threading
+
+
+# coin_map.json maps each ticker to its [coingecko name, coingecko id] pairs.
+# Rather than parsing it on import, it is compiled once into an indexed SQLite
+# file next to the price cache, which is opened on the first lookup and
+# rebuilt whenever coin_map.json changes.
+COIN_MAP_FILE = 'coin_map.json'
+COIN_MAP_INDEX_FILE = 'coin_map.sqlite3'
+COIN_MAP_INDEX = None
+COIN_MAP_INDEX_LOCK = threading.Lock()
+
+
+def get_source_signature(source_file):
+    stat = os.stat(source_file)
+    return '{}:{}'.format(stat.st_size, stat.st_mtime_ns)
+
+
+def build_index(source_file, index_file):
+    with open(source_file) as f:
+        coin_map = json.loads(f.read())
+    temp_file = '{}.{}.tmp'.format(index_file, os.getpid())
+    if os.path.exists(temp_file):
+        os.remove(temp_file)
+    connection = sqlite3.connect(temp_file)
+    connection.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)')
+    connection.execute('CREATE TABLE coins (symbol TEXT, position INTEGER, name TEXT, id TEXT)')
+    connection.executemany('INSERT INTO coins VALUES (?, ?, ?, ?)', [
+        (symbol, position, name, coin_id,)
+        for symbol, entries in coin_map.items()
+        for position, (name, coin_id) in enumerate(entries)])
+    connection.execute('CREATE INDEX coins_symbol ON coins (symbol, position)')
+    connection.execute('INSERT INTO meta VALUES (?, ?)', ('source', get_source_signature(source_file),))
+    connection.commit()
+    connection.close()
+    os.replace(temp_file, index_file)
+
+
+def open_index(source_file, index_file):
+    if os.path.exists(index_file):
+        connection = sqlite3.connect(index_file, check_same_thread=False)
+        row = connection.execute("SELECT value FROM meta WHERE key = 'source'").fetchone()
+        if row and row[0] == get_source_signature(source_file):
+            return connection
+        connection.close()
+    build_index(source_file, index_file)
+    return sqlite3.connect(index_file, check_same_thread=False)
+
+
+def get_index():
+    global COIN_MAP_INDEX
+    with COIN_MAP_INDEX_LOCK:
+        if COIN_MAP_INDEX is None:
+            os.makedirs(price_cache.PRICE_CACHE_DIR, exist_ok=True)
+            COIN_MAP_INDEX = open_index(
+                COIN_MAP_FILE, os.path.join(price_cache.PRICE_CACHE_DIR, COIN_MAP_INDEX_FILE))
+        return COIN_MAP_INDEX
+
+
+# Returns the (name, id) pairs registered for the ticker, in coin_map.json order
+@functools.lru_cache(maxsize=None)
+def get_entries(symbol):
+    index = get_index()
+    with COIN_MAP_INDEX_LOCK:
+        rows = index.execute(
+            'SELECT name, id FROM coins WHERE symbol = ? ORDER BY position', (symbol,)).fetchall()
+    return tuple(rows)
+
+
+# Returns the coingecko id for a ticker and token name, None if it can't be resolved
+@functools.lru_cache(maxsize=None)
+def resolve_id(symbol, name):
+    entries = get_entries(symbol)
+    if len(entries) == 1:
+        # Auto-resolve unique token tickers to avoid naming inconsistencies
+        return entries[0][1]
+    for current_name, current_id in entries:
+        if current_name in name or name in current_name:
+            return current_id
+    return None
@@ -1,8 +1,14 @@
 #!/usr/local/bin/python3
 
+import calendar
+import concurrent.futures
 import csv
 import datetime
-import json
+import src.exchanges.instrumentation as instrumentation
+import src.exchanges.ohlc_store as ohlc_store
+import src.exchanges.price_cache as price_cache
+import src.exchanges.price_service as price_service
+import src.wallets.coin_map as coin_map
 import src.wallets.secrets as secrets
 
 from src.exchanges.utils import get_request_with_retry, process_trades
@@ -14,49 +20,97 @@ ETHERSCAN_CSV_FIELDS = ["Txhash", "Blockno", "UnixTimestamp", "DateTime", "From"
                         "Value_IN(ETH)", "Value_OUT(ETH)", "CurrentValue @ $2463.09/Eth", "TxnFee(ETH)",
                         "TxnFee(USD)", "Historical $Price/Eth", "Status", "ErrCode"]
 ETHERSCAN_TRANSACTION_API_ENDPOINT = 'https://api.etherscan.io/api?module=account&action=tokentx&address={wallet}&startblock={block}&endblock={block}&apikey={token}'
+ETHERSCAN_TRANSACTIONS_RANGE_API_ENDPOINT = 'https://api.etherscan.io/api?module=account&action=tokentx&address={wallet}&startblock={start}&endblock={end}&page=1&offset={offset}&sort=asc&apikey={token}'
+ETHERSCAN_PAGE_SIZE = 10000  # etherscan returns at most 10k results per query
 COINGECKO_FETCH_PRICE_API_ENDPOINT = 'https://api.coingecko.com/api/v3/coins/{asset_id}/history?date={dt_string}'
-with open('coin_map.json') as f:
-    COIN_MAP = json.loads(f.read())
+ETHERSCAN_MAX_WORKERS = 8
 
 
+@instrumentation.timed('coingecko get_daily_price')
 def get_daily_price_from_coingecko(asset, name, timestamp):
     dt_string = datetime.datetime.fromtimestamp(timestamp).strftime("%d-%m-%Y")
-    asset_id = None
-    if asset not in COIN_MAP:
+    bucket = calendar.timegm(datetime.datetime.strptime(dt_string, "%d-%m-%Y").timetuple())
+    # Imported candles of the symbol answer without asking coingecko
+    price = ohlc_store.get_ohlc_store().get_day_price(asset, bucket)
+    if price is not None:
+        return price
+    if not coin_map.get_entries(asset):
         # Unrecognized assets do not trigger taxable events and have 0 value
         print('Unrecognized asset by coingecko: {}'.format(asset))
         return 0
-    if len(COIN_MAP[asset]) == 1:
-        # Auto-resolve unique token tickers to avoid naming inconsistencies
-        asset_id = COIN_MAP[asset][0][1]
-    else:
-        for current_name, current_id in COIN_MAP[asset]:
-            if current_name in name or name in current_name:
-                asset_id = current_id
-                break
+    asset_id = coin_map.resolve_id(asset, name)
     if not asset_id:
         # Tokens that are registered under a valid symbol but aren't recognized by coingecko should be ignored too
         print('Missing asset info for {} {}'.format(asset, name))
         return 0
+    # Every transfer of the token on that day (from any worker) shares one fetch
+    return price_service.PRICE_SERVICE.get(
+        price_cache.COINGECKO_HISTORY, asset_id, bucket, lambda: fetch_daily_price(asset_id, dt_string, bucket))
+
+
+def fetch_daily_price(asset_id, dt_string, bucket):
+    cache = price_cache.get_price_cache()
+    price = cache.get(price_cache.COINGECKO_HISTORY, asset_id, bucket)
+    if price is not None:
+        return price
     url = COINGECKO_FETCH_PRICE_API_ENDPOINT.format(
         asset_id=asset_id, dt_string=dt_string
     )
     response = get_request_with_retry(url, {'accept': 'application/json'})
     if 'market_data' not in response:
         print('Missing price info for {} on {}'.format(asset_id, dt_string))
-        return 0
-    return float(response['market_data']['current_price']['usd'])
+        # Coingecko has no price for this day, remember that instead of asking again
+        price = 0
+    else:
+        price = float(response['market_data']['current_price']['usd'])
+    cache.put(price_cache.COINGECKO_HISTORY, asset_id, bucket, True, price)
+    return price
 
 
-def get_transfers_from_blockno(address, blockno, original_txid, historical_eth_price, trading_fee):
-    url = ETHERSCAN_TRANSACTION_API_ENDPOINT.format(
-        wallet=address, block=blockno, token=secrets.ETHERSCAN_API_KEY
-    )
-    response = get_request_with_retry(url, {})
-    assert response['message'] == 'OK' or response['message'] == 'No transactions found'
+# Fetches every token transfer of the address between two blocks (inclusive) and
+# indexes them by transaction hash. Each query returns up to ETHERSCAN_PAGE_SIZE
+# transfers in block order; the next query restarts at the last block seen, and
+# transfers already seen from that block are skipped.
+def get_token_transfers_by_hash(address, start_block, end_block):
+    transfers_by_hash = {}
+    seen = set()
+    while True:
+        url = ETHERSCAN_TRANSACTIONS_RANGE_API_ENDPOINT.format(
+            wallet=address, start=start_block, end=end_block, offset=ETHERSCAN_PAGE_SIZE,
+            token=secrets.ETHERSCAN_API_KEY
+        )
+        response = get_request_with_retry(url, {})
+        assert response['message'] == 'OK' or response['message'] == 'No transactions found'
+        for transfer in response['result']:
+            key = (transfer['hash'], transfer['logIndex'],)
+            if key in seen:
+                continue
+            seen.add(key)
+            if transfer['hash'] not in transfers_by_hash:
+                transfers_by_hash[transfer['hash']] = []
+            transfers_by_hash[transfer['hash']].append(transfer)
+        if len(response['result']) < ETHERSCAN_PAGE_SIZE:
+            return transfers_by_hash
+        next_start_block = int(response['result'][-1]['blockNumber'])
+        if next_start_block == start_block:
+            raise ValueError('more than {} transfers in block {}'.format(ETHERSCAN_PAGE_SIZE, start_block))
+        start_block = next_start_block
+
+
+# transfers_by_hash comes from get_token_transfers_by_hash; without it the block is queried directly
+def get_transfers_from_blockno(address, blockno, original_txid, historical_eth_price, trading_fee, transfers_by_hash=None):
+    if transfers_by_hash is not None:
+        transfers = transfers_by_hash.get(original_txid, [])
+    else:
+        url = ETHERSCAN_TRANSACTION_API_ENDPOINT.format(
+            wallet=address, block=blockno, token=secrets.ETHERSCAN_API_KEY
+        )
+        response = get_request_with_retry(url, {})
+        assert response['message'] == 'OK' or response['message'] == 'No transactions found'
+        transfers = response['result']
     relevant_transfers = []
     counter = 0
-    for transfer in response['result']:
+    for transfer in transfers:
         if original_txid != transfer['hash'] or transfer['from'] == '0x0000000000000000000000000000000000000000':
             continue
         trade_id = '{}:{}'.format(transfer['hash'], counter)
@@ -108,7 +162,12 @@ def get_transfers_from_blockno(address, blockno, original_txid, historical_eth_p
     return relevant_transfers
 
 
-def get_standard_trades_deposits_withdrawals(address):
+# Deposits and withdrawals are transfers (see src/exchanges/transfers.py), the
+# withdrawal's gas fee is a BURN trade.
+# With range_queries, all token transfers over the CSV's block range are fetched
+# up front in a few paged calls instead of one tokentx call per row.
+@instrumentation.timed('etherscan get_standard_trades_deposits_withdrawals')
+def get_standard_trades_deposits_withdrawals(address, max_workers=ETHERSCAN_MAX_WORKERS, range_queries=True):
     trades = []
     deposits = []
     withdrawals = []
@@ -116,23 +175,39 @@ def get_standard_trades_deposits_withdrawals(address):
     with open(filename, 'r') as f:
         reader = csv.reader(f)
         assert next(reader) == ETHERSCAN_CSV_FIELDS
-        for row in reader:
+        csv_rows = list(reader)
+
+    transfers_by_hash = None
+    if range_queries and csv_rows:
+        blocks = [int(row[1]) for row in csv_rows]
+        transfers_by_hash = get_token_transfers_by_hash(address, min(blocks), max(blocks))
+
+    def fetch_transfers(row):
+        txid = row[0]
+        blockno = row[1]
+        historical_eth_price = float(row[12])
+        trading_fee = float(row[10]) * historical_eth_price
+        return get_transfers_from_blockno(
+            address, blockno, txid, historical_eth_price, trading_fee, transfers_by_hash)
+
+    # Lookups run concurrently, rate limited per API in get_request_with_retry;
+    # map() hands the results back in CSV order.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        all_transfers = executor.map(fetch_transfers, csv_rows)
+        for row, transfers in zip(csv_rows, all_transfers):
             txid = row[0]
-            blockno = row[1]
             date = datetime.datetime.strptime(
                 row[3], "%Y-%m-%d %H:%M:%S")
             txn_fee_amount = float(row[10])
             historical_eth_price = float(row[12])
             trading_fee = txn_fee_amount * historical_eth_price
-            transfers = get_transfers_from_blockno(
-                address, blockno, txid, historical_eth_price, trading_fee)
             if len(transfers) == 1:
-                lone_transfer = transfers[0]
-                if lone_transfer[1] == 'SELL':
+                trade_id, action, size, asset, net_fiat = transfers[0]
+                if action == 'SELL':
                     trades.append([txid, 'BURN', date, txn_fee_amount, 'ETH', trading_fee, 0])
-                    withdrawals.append(lone_transfer)
+                    withdrawals.append([trade_id, 'WITHDRAWAL', date, size, asset, 0, net_fiat])
                 else:
-                    deposits.append(lone_transfer)
+                    deposits.append([trade_id, 'DEPOSIT', date, size, asset, 0, net_fiat])
                 continue
             if not transfers:
                 trades.append([txid, 'BURN', date, txn_fee_amount, 'ETH', trading_fee, 0])
@@ -145,6 +220,8 @@ def get_standard_trades_deposits_withdrawals(address):
 
 
 if __name__ == '__main__':
+    instrumentation.enable_from_environment()
     trades, deposits, withdrawals = get_standard_trades_deposits_withdrawals(
         secrets.PRIMARY_WALLET_ADDRESS)
+    price_service.PRICE_SERVICE.print_summary()
     process_trades(trades)